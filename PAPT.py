@@ -6,25 +6,57 @@ import numpy as np
 import serial
 import serial.tools.list_ports
 import threading
+from collections import deque
+import multiprocessing
+import socket
+import struct
+from multiprocessing import shared_memory
+import queue
 import binascii
 import sys
 import time
 import logging
+import bisect
+import heapq
+import itertools
+import array
+import math
+import os
+import tempfile
+import argparse
+import csv
+import io
+import json
+import zlib
+import hashlib
+import hmac
+import mimetypes
+import urllib.request
+import shutil
+from collections import OrderedDict
 from pathlib import Path
-from ultralytics import YOLO
 import OnenetConnect
 import sqlite3
-from datetime import datetime
-from flask import Flask, jsonify
+from datetime import datetime, timedelta, timezone
+from flask import Flask, jsonify, Response, request, stream_with_context
 
 # 配置日志记录
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # 创建Flask应用
-app = Flask(__name__)
+app = Flask(__name__, static_folder=None)
 
-# 加载预训练的 YOLOv8 模型
-model1 = YOLO("yolov8n.pt")
+# 预训练的 YOLOv8 模型, 首次使用时加载, Web进程不加载
+model1 = None
+
+
+def get_model():
+    """加载并返回 YOLOv8 模型"""
+    global model1
+    if model1 is None:
+        from ultralytics import YOLO
+        model1 = YOLO("yolov8n.pt")
+    return model1
 
 # OneNet平台配置
 ONENET_CONFIG = {
@@ -43,64 +75,3563 @@ PARITIES = {'None': 'N', 'Even': 'E', 'Odd': 'O', 'Mark': 'M', 'Space': 'S'}
 STOPBITS = (1, 1.5, 2)
 TIMEOUT = 0.015
 
-class SmartMonitorSystem:
-    def __init__(self, root):
-        self.root = root
-        self.root.title("智能室内消防报警系统")
-        self.root.geometry("1200x900")
-        
-        # 初始化数据库
-        self.init_database()
-        
-        # 初始化变量
-        self.init_variables()
-        
-        # 创建界面
-        self.create_gui()
-        
-        # 初始化串口和视频捕获
-        self.init_devices()
+# 数据库文件; Web接口读取 app.config['DB_PATH'], Web进程启动时可指定其他文件
+DB_PATH = 'smart_monitor.db'
+app.config['DB_PATH'] = DB_PATH
 
-    def init_database(self):
-        """初始化数据库"""
-        self.conn = sqlite3.connect('smart_monitor.db')
-        cursor = self.conn.cursor()
+# Web服务: 独立进程运行, 通过共享内存读取主进程的实时状态和监控指标
+WEB_HOST = '0.0.0.0'
+WEB_PORT = 5000
+WEB_WORKERS = 2
+STATE_SHM_NAME = 'papt_live_state'
+STATE_SHM_SIZE = 64 * 1024
+METRICS_SHM_NAME = 'papt_metrics'
+METRICS_SHM_SIZE = 1024 * 1024
+METRICS_PUBLISH_INTERVAL = 1.0
+HEATMAP_SHM_NAME = 'papt_heatmap'
+HEATMAP_SHM_SIZE = 256 * 1024
+# 仪表盘静态资源目录, 文件名带内容哈希后可长期缓存
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+# Web压测: 模拟浏览器轮询的接口, 结果基线文件, 与基线比较时允许的退化比例
+LOAD_TEST_ENDPOINTS = ('/get_sensor_data', '/get_valve_data', '/get_people_data', '/get_valve_status')
+LOAD_TEST_BASELINE = 'bench_web_baseline.json'
+LOAD_TEST_TOLERANCE = 0.2
+
+# 管理接口: 令牌从环境变量读取, 未设置时管理接口不可用; 采样分析的间隔和最长时间(秒)
+ADMIN_TOKEN_ENV = 'PAPT_ADMIN_TOKEN'
+PROFILE_INTERVAL = 0.005
+PROFILE_MAX_SECONDS = 120
+
+# 人员检测工作进程: 进程数, 共享内存帧槽数和每槽字节数(最大支持 1920x1080 BGR)
+DETECT_WORKERS = 1
+DETECT_SLOTS_PER_WORKER = 2
+DETECT_SLOT_BYTES = 1920 * 1080 * 3
+DETECT_RESULT_FIELDS = 6  # x1, y1, x2, y2, conf, cls
+# 工作进程卡住的判定: 加载模型和单帧推理的最长时间(秒), 超过时结束并重启该进程;
+# 进程连续异常退出时重启间隔从 DETECT_RESTART_MIN 秒起加倍, 最长 DETECT_RESTART_MAX 秒
+DETECT_LOAD_TIMEOUT = 120.0
+DETECT_TASK_TIMEOUT = 10.0
+DETECT_RESTART_MIN = 0.5
+DETECT_RESTART_MAX = 60.0
+
+# 推理自动调节: 目标检测帧率, CPU预算(占全部核心的比例), 输入尺寸范围和步长(32的倍数), 最大检测间隔(帧)
+DETECT_TARGET_FPS = 10.0
+DETECT_CPU_BUDGET = 0.5
+DETECT_MIN_SIZE = 256
+DETECT_MAX_SIZE = 640
+DETECT_SIZE_STEP = 32
+DETECT_MAX_INTERVAL = 15
+DETECT_CONTROL_PERIOD = 2.0
+DETECT_CONTROL_MIN_SAMPLES = 5
+DETECT_CONTROL_ALPHA = 0.2
+
+# 摄像头编号和各摄像头的区域配置文件
+CAMERA_INDEX = 0
+ZONES_PATH = 'zones.json'
+
+# 视频帧源(--video-source)和视频处理链基准测试: 合成帧数, 结果基线文件, 与基线比较时允许的退化比例,
+# 以及阶段延迟低于多少毫秒的变化视为测量噪声
+SYNTHETIC_FRAMES = 300
+VIDEO_BENCH_BASELINE = 'bench_video_baseline.json'
+VIDEO_BENCH_TOLERANCE = 0.2
+VIDEO_BENCH_NOISE_MS = 0.1
+
+# 人员分布热力图: 网格行列数, 衰减半衰期(秒), 保存文件和保存间隔, 发布到共享内存的间隔, 渲染放大倍数
+HEATMAP_ROWS = 48
+HEATMAP_COLS = 64
+HEATMAP_HALF_LIFE = 3600.0
+HEATMAP_PATH = 'heatmap_{camera}.npz'
+HEATMAP_SAVE_INTERVAL = 60.0
+HEATMAP_PUBLISH_INTERVAL = 1.0
+HEATMAP_RENDER_SCALE = 10
+
+# OneNet上报待发送队列: 文件、容量上限、每批条数、补发速率(条/秒)、重试间隔(秒)、
+# 被服务器拒绝的记录最多发送的次数(之后移入 dead_letter 表)
+OUTBOX_PATH = 'onenet_outbox.db'
+OUTBOX_MAX_RECORDS = 100000
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_DRAIN_RATE = 20.0
+OUTBOX_RETRY_MIN = 1.0
+OUTBOX_RETRY_MAX = 60.0
+OUTBOX_MAX_ATTEMPTS = 5
+
+# 历史数据查看: 每页行数, 表格中最多保留的行数
+HISTORY_PAGE_SIZE = 200
+HISTORY_MAX_ROWS = 1000
+
+# 归档: 超过保留天数的传感器数据按天转存为列式文件
+ARCHIVE_DIR = 'archive'
+ARCHIVE_RETENTION_DAYS = 30
+ARCHIVE_CHECK_INTERVAL = 3600
+# 每天一个目录, 每个通道一个 .npy 文件; offset 为相对当天零点的秒数
+ARCHIVE_COLUMNS = (
+    ('id', np.int64), ('offset', np.uint32), ('temperature', np.float32),
+    ('humidity', np.float32), ('light', np.float32), ('pir', np.int8),
+    ('gas', np.int32), ('device', np.uint16)
+)
+
+# 历史数据导出: 每次从游标读取的行数, 可导出的表及列类型
+EXPORT_CHUNK_SIZE = 5000
+EXPORT_TABLES = {
+    'sensor_data': (('timestamp', 'string'), ('temperature', 'float64'), ('humidity', 'float64'),
+                    ('light', 'float64'), ('pir', 'int64'), ('gas', 'int64'), ('device', 'string')),
+    'valve_operations': (('timestamp', 'string'), ('operation', 'string'), ('mode', 'string'),
+                         ('operator', 'string')),
+    'user_operations': (('timestamp', 'string'), ('operation', 'string'), ('details', 'string')),
+}
+# 统计分析: 传感器通道, 结果缓存条数, 分组直方图最多使用的单元数
+SENSOR_CHANNELS = ('temperature', 'humidity', 'light', 'pir', 'gas')
+STATS_CACHE_SIZE = 128
+# 数值查询每次 fetchmany 的行数; 统计结果覆盖当前时刻时, 新数据到达后最多继续使用的秒数
+FETCH_CHUNK_SIZE = 65536
+STATS_REFRESH_INTERVAL = 30
+# 每个Web进程缓存数据库传感器数值的字节上限(每秒一条时一个设备一个月约 72MB)
+SERIES_CACHE_MAX_BYTES = 128 * 1024 * 1024
+# 精确 p95 最多处理的窗口内样本总数和窗口数, 超过时改用分组直方图插值
+STATS_P95_EXACT_SAMPLES = 20_000_000
+STATS_P95_EXACT_WINDOWS = 20_000
+# 趋势图数据: 可查询的通道(people 为人数), 降采样点数上限; 人数无变化时每隔多少秒记录一次
+SERIES_CHANNELS = SENSOR_CHANNELS + ('people',)
+SERIES_MAX_POINTS = 5000
+PEOPLE_LOG_INTERVAL = 60
+STATS_BLOCK_CELLS = 2_000_000
+
+EXPORT_MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson', 'parquet': 'application/vnd.apache.parquet'}
+
+# 监控指标直方图默认分桶(秒)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+BATCH_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Counter:
+    """计数器指标"""
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=None):
+        self.name = name
+        self.help = help_text
+        self.labels = labels or {}
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        yield self.name, self.labels, self.value
+
+
+class SingleWriterCounter(Counter):
+    """只在一个线程中(或调用方已持有的锁内)累加的计数器, 累加时不加锁"""
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Gauge(Counter):
+    """瞬时值指标. 设置了 function 时在导出时调用它取值, 热路径上不必再 set"""
+    kind = 'gauge'
+    function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def samples(self):
+        yield self.name, self.labels, self.value if self.function is None else self.function()
+
+
+class Histogram:
+    """直方图指标, 分桶计数加总和"""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS, labels=None):
+        self.name = name
+        self.help = help_text
+        self.labels = labels or {}
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[idx] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        return _HistogramTimer(self)
+
+    def samples(self):
+        with self._lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float('inf'),), counts):
+            cumulative += n
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            yield self.name + '_bucket', dict(self.labels, le=le), cumulative
+        yield self.name + '_sum', self.labels, total
+        yield self.name + '_count', self.labels, count
+
+
+class SingleWriterHistogram(Histogram):
+    """只在一个线程中(或调用方已持有的锁内)记录的直方图, 记录时不加锁; 导出时各字段可能相差一次记录"""
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _HistogramTimer:
+    """with 语句计时器, 退出时记录耗时"""
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class MetricsRegistry:
+    """指标注册表, 以 Prometheus 文本格式导出"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help_text, labels, **kwargs):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            if key not in self._metrics:
+                self._metrics[key] = cls(name, help_text, labels=labels, **kwargs)
+            return self._metrics[key]
+
+    def counter(self, name, help_text, labels=None, single_writer=False):
+        return self._get(SingleWriterCounter if single_writer else Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text, labels=None):
+        return self._get(Gauge, name, help_text, labels)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS, labels=None, single_writer=False):
+        return self._get(SingleWriterHistogram if single_writer else Histogram, name, help_text, labels,
+                         buckets=buckets)
+
+    def render(self):
+        """生成 /metrics 文本. 同名指标的各标签序列(如运行中新增的订阅者)合并到一组 HELP/TYPE 下连续输出,
+        各组按首次注册的顺序排列"""
+        families = {}
+        with self._lock:
+            for metric in self._metrics.values():
+                families.setdefault(metric.name, []).append(metric)
+        lines = []
+        for family in families.values():
+            lines.append(f"# HELP {family[0].name} {family[0].help}")
+            lines.append(f"# TYPE {family[0].name} {family[0].kind}")
+            for metric in family:
+                for name, labels, value in metric.samples():
+                    if labels:
+                        label_str = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                        lines.append(f"{name}{{{label_str}}} {value}")
+                    else:
+                        lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+
+# 串口, 只由串口接收线程更新
+SERIAL_BYTES = metrics.counter('papt_serial_bytes_total', '串口接收字节数', single_writer=True)
+SERIAL_FRAMES = metrics.counter('papt_serial_frames_total', '串口接收完整数据帧数', single_writer=True)
+SERIAL_PARSE_ERRORS = metrics.counter('papt_serial_parse_errors_total', '串口数据解析错误数', single_writer=True)
+# 数据库
+DB_WRITE_SECONDS = metrics.histogram('papt_db_write_seconds', '数据库写入耗时')
+DB_BATCH_SIZE = metrics.histogram('papt_db_batch_size', '数据库单次提交行数', buckets=BATCH_BUCKETS)
+DB_WRITE_ERRORS = metrics.counter('papt_db_write_errors_total', '逐条重试后仍写入失败而丢弃的请求数')
+# OneNet
+ONENET_UPLOAD_SECONDS = metrics.histogram('papt_onenet_upload_seconds', 'OneNet上报耗时')
+ONENET_UPLOAD_FAILURES = metrics.counter('papt_onenet_upload_failures_total', 'OneNet上报失败次数')
+# 视频
+VIDEO_STAGE_SECONDS = {
+    stage: metrics.histogram('papt_video_stage_seconds', '视频处理各阶段耗时', labels={'stage': stage})
+    for stage in ('capture', 'inference', 'detect', 'zones', 'heatmap', 'annotate', 'render', 'publish')
+}
+VIDEO_FPS = metrics.gauge('papt_video_fps', '视频处理帧率')
+# 报警
+ALARM_ACTUATION_SECONDS = metrics.histogram('papt_alarm_actuation_seconds', '读数到水闸开启命令写入串口的延迟')
+
+VALVE_COMMAND_QUEUE_SECONDS = metrics.histogram('papt_valve_command_queue_seconds', '水闸命令排队等待写入的时间')
+VALVE_ACK_SECONDS = metrics.histogram('papt_valve_ack_seconds', '水闸命令写入到收到板子确认的延迟')
+VALVE_COMMAND_RETRIES = metrics.counter('papt_valve_command_retries_total', '水闸命令确认超时后重发次数')
+VALVE_COMMAND_FAILURES = metrics.counter('papt_valve_command_failures_total', '重发后仍未确认的水闸命令数')
+
+# 分帧合并指标只在 IngestCoalescer 持有自身的锁时更新
+INGEST_RECORDS = metrics.counter('papt_ingest_records_total', '分帧合并后输出的传感器记录数', single_writer=True)
+INGEST_FRAMES_PER_RECORD = metrics.histogram('papt_ingest_frames_per_record', '每条传感器记录合并的分帧数',
+                                             buckets=BATCH_BUCKETS, single_writer=True)
+EVENTS_PUBLISHED = metrics.counter('papt_events_published_total', '事件总线发布的事件数')
+
+OUTBOX_BACKLOG = metrics.gauge('papt_outbox_backlog', '待发送的OneNet上报条数')
+OUTBOX_EVICTED = metrics.counter('papt_outbox_evicted_total', '待发送队列超出容量被丢弃的条数')
+OUTBOX_DEAD_LETTERS = metrics.counter('papt_outbox_dead_letters_total', '多次被服务器拒绝后移入 dead_letter 表的条数')
+DETECT_FRAMES_DROPPED = metrics.counter('papt_detect_frames_dropped_total', '检测进程繁忙时跳过的帧数')
+DETECT_WORKER_RESTARTS = metrics.counter('papt_detect_worker_restarts_total', '检测进程异常退出后重启次数')
+DETECT_WORKER_HANGS = metrics.counter('papt_detect_worker_hangs_total', '检测进程超时未返回结果被结束的次数')
+DETECT_INPUT_SIZE = metrics.gauge('papt_detect_input_size', '当前推理输入尺寸')
+DETECT_INTERVAL = metrics.gauge('papt_detect_interval_frames', '当前每隔多少帧检测一次')
+DETECT_CPU_RATIO = metrics.gauge('papt_detect_cpu_ratio', '检测进程占用全部CPU的比例')
+ANOMALY_EVENTS = {
+    (channel, kind): metrics.counter('papt_anomaly_events_total', '异常检测触发次数',
+                                     labels={'channel': channel, 'kind': kind})
+    for channel in ('temp', 'gas') for kind in ('rate_of_rise', 'zscore')
+}
+
+# Web进程自己的指标, 以进程号区分, 附加在主进程指标之后输出
+web_metrics = MetricsRegistry()
+SERIES_CACHE_BYTES = web_metrics.gauge('papt_web_series_cache_bytes', 'Web进程传感器数值缓存占用的字节数',
+                                       labels={'pid': str(os.getpid())})
+SERIES_CACHE_EVICTIONS = web_metrics.counter('papt_web_series_cache_evictions_total',
+                                             'Web进程传感器数值缓存超出上限时淘汰或截短的次数',
+                                             labels={'pid': str(os.getpid())})
+
+# 读数到水闸开启命令的延迟预算(秒)
+ALARM_LATENCY_BUDGET = 0.002
+
+# 水闸命令: 板子收到命令后回复确认帧 v1(已打开) / v0(已关闭); 确认超时(秒)和重发次数.
+# 确认帧需要板子固件支持, 固件未升级时保持 VALVE_ACK_REQUIRED = False, 写入串口成功即视为确认,
+# 否则每条命令都会重发 VALVE_ACK_RETRIES 次并记为未确认
+VALVE_ACK_REQUIRED = False
+VALVE_ACK_PREFIX = 'v'
+VALVE_ACK_CODES = {b'\x01': '1', b'\x00': '0'}
+VALVE_ACK_TIMEOUT = 0.5
+VALVE_ACK_RETRIES = 2
+COMMAND_PRIORITY_ALARM = 0
+COMMAND_PRIORITY_MANUAL = 1
+
+# 数据库批量写入单次事务最多行数
+DB_WRITE_BATCH_MAX = 500
+
+# 串口分帧合并: 一次采样的 g/h/y/w 分帧在窗口(秒)内合并为一条记录后再记录和上报
+INGEST_WINDOW = 1.0
+INGEST_GROUPS = ('light', 'pir', 'gas', 'temp')
+
+# 事件总线: 每个订阅者的队列容量, 'block' 策略队列满时最多等待的时间(秒)
+EVENT_QUEUE_SIZE = 1024
+EVENT_BLOCK_TIMEOUT = 0.5
+# 存储订阅者的队列容量: 写库只是交给写入线程, 正常不会积压, 只在数据库长时间卡住时丢弃
+STORAGE_QUEUE_SIZE = 65536
+
+# 温度/烟雾流式异常检测参数
+DETECTOR_CHANNELS = ('temp', 'gas')
+DETECTOR_MAX_DEVICES = 16
+DETECTOR_WINDOW = 30             # 斜率窗口样本数
+DETECTOR_EWMA_ALPHA = 0.05
+DETECTOR_WARMUP = 20             # 样本数不足时不做 z 分数判定
+DETECTOR_Z_THRESHOLD = 4.0
+DETECTOR_MIN_STD = {'temp': 0.3, 'gas': 10.0}
+DETECTOR_RISE_LIMITS = {'temp': 8.0, 'gas': 300.0}   # 每分钟上升量
+DETECTOR_RECENTER = 3600.0       # 窗口时间原点重置间隔(秒)
+
+
+def report_to_onenet(params):
+    """上报属性到OneNet并记录耗时与失败次数, 返回值同 report_device_property:
+    服务器拒绝时返回真值, 网络错误时抛出 OSError"""
+    start = time.perf_counter()
+    try:
+        failed = OnenetConnect.report_device_property(params)
+    except Exception:
+        ONENET_UPLOAD_FAILURES.inc()
+        raise
+    finally:
+        ONENET_UPLOAD_SECONDS.observe(time.perf_counter() - start)
+    if failed:
+        ONENET_UPLOAD_FAILURES.inc()
+    return failed
+
+
+def run_ingest_pipeline(samples, tmpdir):
+    """把 samples 次采样(光照、人体红外、烟雾、温湿度各一帧, 间隔 1 秒)送入主程序的串口处理链
+    (SensorPipeline, 含报警快速通道和异常检测), 由 subscribe_consumers 以与主程序相同的队列和策略接入
+    存储订阅者(批量写库)和上报订阅者(写入待发送队列, 不发送). 串口用管道代替, 与 pyserial 一样
+    每个字节一次 read 系统调用; 界面变量用不需要显示器的 Tcl 解释器承载, 在同一线程中更新
+    (主程序跨线程更新时更慢). 返回全部写库完成的总耗时(秒)"""
+    # 每次运行使用新的数据库文件, 多次运行的结果可以比较
+    workdir = tempfile.mkdtemp(dir=tmpdir)
+    conn = sqlite3.connect(os.path.join(workdir, "bench.db"), check_same_thread=False)
+    init_database(conn)
+    db_writer = DatabaseWriter(conn, threading.Lock())
+    outbox = OnenetOutbox(os.path.join(workdir, "outbox.db"), send=lambda params: False,
+                          max_records=samples * 2)
+    bus = EventBus()
+    # 与 SmartMonitorSystem.log_sensor_data 和 upload_event 相同的写库语句和上报参数
+    subscribe_consumers(bus,
+                        lambda event: db_writer.submit(SENSOR_INSERT_SQL, sensor_row(event.as_dict())),
+                        lambda event: outbox.submit(build_sensor_params(event.as_dict())))
+    tcl = tk.Tcl()
+    display = {key: tk.StringVar(master=tcl) for key in ('temp', 'humi', 'light', 'pir', 'gas')}
+    pipeline = SensorPipeline(bus, AlarmFastPath(lambda cmd, received_at: None, detector=AnomalyDetector()),
+                              display=display)
+    pipeline.device = 'bench'
+    rng = np.random.default_rng(0)
+    frames = [[f"g{300 + i % 7}\n", f"h{i % 2}\n", f"y{10 + i % 3}\n",
+               f"w{25 + rng.standard_normal() * 0.3:.1f}&s{60 + i % 5}!\n"] for i in range(samples)]
+    port, feed = os.pipe()
+
+    start = time.perf_counter()
+    for i, sample in enumerate(frames):
+        os.write(feed, ''.join(sample).encode())
+        for j in range(len(sample)):
+            # 与 receive_serial_data 相同: 逐字节读取, 换行时交给处理链; 异常检测使用模拟的采样时刻
+            buffer = ""
+            char = ""
+            while char != '\n':
+                char = os.read(port, 1).decode()
+                buffer += char
+            pipeline.handle_frame(buffer, received_at=i + j * 0.01)
+    pipeline.ingest.flush()
+    bus.close()
+    db_writer.close()
+    elapsed = time.perf_counter() - start
+
+    os.close(port)
+    os.close(feed)
+    pipeline.close()
+    outbox.stop()
+    conn.close()
+    return elapsed
+
+
+def benchmark_metrics_overhead(samples=2000, repeats=5):
+    """在与主程序相同的串口->数据库处理链上测量指标埋点的开销比例(%):
+    先统计每条记录实际触及的埋点次数(各指标类的 inc、set、observe), 再乘以各自的单次耗时,
+    与每条记录在处理链上的总耗时相比. 处理链和单次耗时都取 repeats 次测量中最快的一次, 减少调度抖动的影响"""
+    methods = [(Counter, 'inc'), (SingleWriterCounter, 'inc'), (Gauge, 'set'),
+               (Histogram, 'observe'), (SingleWriterHistogram, 'observe')]
+    originals = [(cls, name, cls.__dict__[name]) for cls, name in methods]
+    touched = {}
+
+    def counting(kind, method):
+        def wrapper(self, *args):
+            key = (kind, self.name)
+            touched[key] = touched.get(key, 0) + 1
+            return method(self, *args)
+        return wrapper
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # 第一次运行只统计埋点次数(计数本身会拖慢处理链), 之后的运行计时
+        for cls, name, method in originals:
+            setattr(cls, name, counting(f"{cls.__name__}.{name}", method))
+        try:
+            run_ingest_pipeline(samples, tmpdir)
+        finally:
+            for cls, name, method in originals:
+                setattr(cls, name, method)
+        hot_path = min(run_ingest_pipeline(samples, tmpdir) for _ in range(repeats)) / samples
+
+    # 各类埋点的单次耗时, 用未注册的新指标测量
+    rounds = 200000
+    cost = {}
+    for cls, name, _ in originals:
+        call = getattr(cls('bench', 'bench'), name)
+        best = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for _ in range(rounds):
+                call(0.001)
+            best = min(best, time.perf_counter() - start)
+        cost[f"{cls.__name__}.{name}"] = best / rounds
+
+    per_record = {key: count / samples for key, count in touched.items()}
+    instrumentation = sum(cost[kind] * count for (kind, _), count in per_record.items())
+    overhead = instrumentation / hot_path * 100
+    print(f"每条记录触及的埋点 ({samples} 次采样):")
+    for (kind, name), count in sorted(per_record.items(), key=lambda item: -item[1]):
+        print(f"  {name:<40} {kind:<30} {count:6.2f} 次")
+    print("单次耗时: " + ", ".join(f"{kind} {seconds * 1e9:.0f} ns" for kind, seconds in cost.items()))
+    print(f"热路径: {hot_path * 1e6:.1f} us/条, 埋点: {instrumentation * 1e6:.2f} us/条, 开销: {overhead:.3f}%")
+    return overhead
+
+
+class SamplingProfiler:
+    """采样分析器: 按固定间隔读取本进程所有线程的调用栈(sys._current_frames), 汇总为折叠栈,
+    并统计各线程在采样期间用掉的CPU时间. 只在 run 期间工作, 平时不安装任何钩子.
+    按线程的CPU时间需要 time.pthread_getcpuclockid(Linux 等), Windows 和 macOS 上没有,
+    此时各线程的 cpu_seconds 为 None, 只统计整个进程的CPU时间(time.process_time)"""
+
+    THREAD_CPU = hasattr(time, 'pthread_getcpuclockid')
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+
+    @classmethod
+    def thread_cpu(cls):
+        """各线程已用的CPU时间(秒), 平台不支持时返回空字典"""
+        if not cls.THREAD_CPU:
+            return {}
+        times = {}
+        for thread in threading.enumerate():
+            try:
+                times[thread.ident] = time.clock_gettime(time.pthread_getcpuclockid(thread.ident))
+            except (OSError, TypeError):
+                pass
+        return times
+
+    def run(self, seconds):
+        """采样 seconds 秒, 返回可转为 JSON 的结果"""
+        own = threading.get_ident()
+        stacks = {}
+        threads = {}
+        cpu_start = self.thread_cpu()
+        process_start = time.process_time()
+        wall_start = time.perf_counter()
+        deadline = wall_start + seconds
+        samples = 0
+        while time.perf_counter() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                name = names.get(ident, f"thread-{ident}")
+                stack.append(name)
+                key = ';'.join(reversed(stack))
+                stacks[key] = stacks.get(key, 0) + 1
+                entry = threads.setdefault(ident, {'name': name, 'samples': 0, 'cpu_seconds': None})
+                entry['samples'] += 1
+            samples += 1
+            time.sleep(self.interval)
+        wall = time.perf_counter() - wall_start
+        process_cpu = time.process_time() - process_start
+
+        # 采样期间新建的线程从首次出现算起, 已结束的线程无法统计
+        for ident, cpu in self.thread_cpu().items():
+            if ident in threads:
+                threads[ident]['cpu_seconds'] = round(cpu - cpu_start.get(ident, 0.0), 6)
+        return {
+            'pid': os.getpid(),
+            'seconds': round(wall, 3),
+            'interval': self.interval,
+            'samples': samples,
+            'process_cpu_seconds': round(process_cpu, 6),
+            'thread_cpu': self.THREAD_CPU,
+            'threads': sorted(threads.values(), key=lambda entry: -(entry['cpu_seconds'] or 0)),
+            'stacks': stacks
+        }
+
+
+def format_collapsed(result):
+    """折叠栈文本(每行 "线程;函数;...;函数 次数"), 可用 flamegraph.pl 或 speedscope 生成火焰图"""
+    return ''.join(f"{stack} {count}\n" for stack, count in sorted(result['stacks'].items()))
+
+
+def format_thread_cpu(result):
+    lines = [f"进程 {result['pid']}: 采样 {result['samples']} 次, {result['seconds']} 秒, "
+             f"进程CPU {result['process_cpu_seconds']:.3f} s"]
+    if not result['thread_cpu']:
+        lines.append("  本平台没有 time.pthread_getcpuclockid, 不统计各线程的CPU时间")
+    for entry in result['threads']:
+        cpu = entry['cpu_seconds']
+        cpu_text = f"{cpu:.3f} s ({cpu / result['seconds'] * 100:.1f}%)" if cpu is not None else "--"
+        lines.append(f"  {entry['name']:<24} CPU {cpu_text:<20} 样本 {entry['samples']}")
+    return '\n'.join(lines)
+
+
+class ProfileServer:
+    """主进程中执行Web进程转发来的采样请求. 每个Web进程一条管道, 请求逐个处理;
+    空闲时线程阻塞在管道上, 不占用CPU"""
+
+    def __init__(self):
+        self.connections = []
+        self.profiler = SamplingProfiler()
+        self.thread = None
+
+    def add(self, conn):
+        self.connections.append(conn)
+
+    def start(self):
+        if self.connections:
+            self.thread = threading.Thread(target=self.run, name='profile-server')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def run(self):
+        from multiprocessing.connection import wait
+        while self.connections:
+            for conn in wait(self.connections):
+                try:
+                    seconds = conn.recv()
+                except (EOFError, OSError):
+                    # Web进程已退出
+                    self.connections.remove(conn)
+                    continue
+                try:
+                    result = self.profiler.run(seconds)
+                except Exception as e:
+                    logging.error(f"采样分析错误: {str(e)}")
+                    result = {'error': str(e)}
+                try:
+                    conn.send(result)
+                except (EOFError, OSError):
+                    # 采样期间Web进程已退出
+                    self.connections.remove(conn)
+
+
+def profile_remote(seconds, process='main', output=None, url=None):
+    """命令行: 通过本机Web服务的管理接口对运行中的程序采样, 保存折叠栈并打印各线程CPU时间"""
+    token = os.environ.get(ADMIN_TOKEN_ENV)
+    if not token:
+        print(f"需要设置环境变量 {ADMIN_TOKEN_ENV}(与运行中的程序相同)")
+        return False
+    url = url or f"http://127.0.0.1:{WEB_PORT}"
+    request_url = f"{url}/admin/profile?seconds={seconds}&process={process}&format=json"
+    try:
+        req = urllib.request.Request(request_url, headers={'X-Admin-Token': token})
+        with urllib.request.urlopen(req, timeout=seconds + 30) as response:
+            result = json.loads(response.read())
+    except Exception as e:
+        print(f"采样请求失败: {str(e)}")
+        return False
+    output = output or f"profile_{process}_{time.strftime('%Y%m%d_%H%M%S')}.txt"
+    with open(output, 'w', encoding='utf-8') as f:
+        f.write(format_collapsed(result))
+    print(format_thread_cpu(result))
+    print(f"折叠栈已保存: {output}")
+    return True
+
+
+def connect_readonly(db_path=DB_PATH):
+    """以只读方式打开数据库, Web进程和查询线程使用"""
+    return sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+
+
+def attach_shared_memory(name):
+    """打开已有的共享内存, 不让本进程退出时删除它"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python 3.13 之前没有 track 参数. 子进程与父进程共用资源跟踪器, 无需处理;
+        # 单独启动的进程需从自己的资源跟踪器中注销
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name == 'posix' and multiprocessing.parent_process() is None:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class SharedBlock:
+    """一写多读的共享内存块, 用序列锁保证读到完整的数据"""
+    HEADER = struct.Struct('<QI')
+
+    def __init__(self, name, size=None, create=False):
+        self.owner = create
+        if create:
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            except FileExistsError:
+                # 上次异常退出留下的共享内存
+                stale = shared_memory.SharedMemory(name=name)
+                stale.close()
+                stale.unlink()
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            self.HEADER.pack_into(self.shm.buf, 0, 0, 0)
+        else:
+            self.shm = attach_shared_memory(name)
+        self._lock = threading.Lock()
+
+    def write(self, payload):
+        buf = self.shm.buf
+        if len(payload) > len(buf) - self.HEADER.size:
+            raise ValueError(f"共享内存空间不足: {len(payload)} 字节")
+        with self._lock:
+            seq = self.HEADER.unpack_from(buf, 0)[0]
+            # 序号为奇数表示正在写入
+            self.HEADER.pack_into(buf, 0, seq + 1, len(payload))
+            buf[self.HEADER.size:self.HEADER.size + len(payload)] = payload
+            self.HEADER.pack_into(buf, 0, seq + 2, len(payload))
+
+    def read(self):
+        buf = self.shm.buf
+        while True:
+            seq, length = self.HEADER.unpack_from(buf, 0)
+            if seq & 1:
+                time.sleep(0)
+                continue
+            data = bytes(buf[self.HEADER.size:self.HEADER.size + length])
+            if self.HEADER.unpack_from(buf, 0)[0] == seq:
+                return data
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class LiveState:
+    """实时状态(水闸、人数、最新读数、报警), 主进程更新, Web进程读取"""
+
+    def __init__(self, block):
+        self.block = block
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def update(self, **fields):
+        with self._lock:
+            self.values.update(fields)
+            self.block.write(json.dumps(self.values, ensure_ascii=False).encode('utf-8'))
+
+    def read(self):
+        data = self.block.read()
+        return json.loads(data) if data else {}
+
+
+# 主进程中创建, Web进程中打开
+live_state = None
+metrics_snapshot = None
+heatmap_block = None
+# Web进程: 向主进程转发采样请求的管道, 同一时间只允许一次采样
+profile_conn = None
+profile_lock = threading.Lock()
+
+
+def run_detector_worker(shm_name, slot_bytes, tasks, results, worker_id):
+    """人员检测工作进程: 直接在共享内存帧槽上推理, 返回 (N, 6) float32 检测框数组的字节,
+    以及推理耗时和占用的CPU时间"""
+    shm = attach_shared_memory(shm_name)
+    model = get_model()
+    # 序号 0 表示模型已加载, 可以接收任务
+    results.put((worker_id, 0, None, b'', 0.0, 0.0, None))
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            seq, slot, height, width, imgsz = task
+            frame = np.ndarray((height, width, 3), dtype=np.uint8, buffer=shm.buf, offset=slot * slot_bytes)
+            start = time.perf_counter()
+            cpu_start = time.process_time()
+            kwargs = {'imgsz': imgsz} if imgsz else {}
+            boxes = model(frame, classes=[0], verbose=False, **kwargs)[0].boxes
+            data = np.concatenate([
+                boxes.xyxy.cpu().numpy(),
+                boxes.conf.cpu().numpy()[:, None],
+                boxes.cls.cpu().numpy()[:, None]
+            ], axis=1).astype(np.float32)
+            del frame
+            results.put((worker_id, seq, slot, data.tobytes(), time.perf_counter() - start,
+                         time.process_time() - cpu_start, imgsz))
+    finally:
+        shm.close()
+
+
+class InferenceController:
+    """推理输入尺寸和检测间隔的闭环控制. 根据实测的单次推理耗时和CPU时间估算当前输入尺寸下
+    可持续的检测速率. 低于目标帧率或超出CPU预算时缩小输入尺寸, 余量足够时放大(推理代价按尺寸平方估算);
+    检测间隔按采集帧率和可达到的检测速率计算, 输入尺寸已到下限仍不够时检测间隔随之拉长"""
+
+    def __init__(self, target_fps=DETECT_TARGET_FPS, cpu_budget=DETECT_CPU_BUDGET, workers=DETECT_WORKERS,
+                 min_size=DETECT_MIN_SIZE, max_size=DETECT_MAX_SIZE, max_interval=DETECT_MAX_INTERVAL):
+        self.target_fps = target_fps
+        self.cpu_budget = cpu_budget
+        self.workers = workers
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_interval = max_interval
+        self.enabled = True
+        self.cores = os.cpu_count() or 1
+        self.imgsz = max_size
+        self.interval = 1
+        self.latency = None
+        self.cpu = None
+        self.samples = 0
+        self.frame_fps = None
+        self.last_adjust = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def observe(self, seq, boxes, elapsed, cpu, imgsz):
+        """检测进程池的结果回调: 只统计当前输入尺寸下的推理"""
+        with self._lock:
+            if imgsz != self.imgsz:
+                return
+            if self.samples == 0:
+                self.latency, self.cpu = elapsed, cpu
+            else:
+                self.latency += DETECT_CONTROL_ALPHA * (elapsed - self.latency)
+                self.cpu += DETECT_CONTROL_ALPHA * (cpu - self.cpu)
+            self.samples += 1
+
+    def observe_frame(self, fps):
+        """视频循环每帧调用, 记录采集帧率"""
+        self.frame_fps = fps if self.frame_fps is None else self.frame_fps + DETECT_CONTROL_ALPHA * (fps - self.frame_fps)
+
+    def capacity(self, scale=1.0):
+        """输入尺寸放大 scale 倍时可持续的检测速率(次/秒): 受进程数和CPU预算限制"""
+        cost = scale * scale
+        return min(self.workers / (self.latency * cost),
+                   self.cpu_budget * self.cores / max(self.cpu * cost, 1e-6))
+
+    def update(self):
+        """每帧调用, 每隔 DETECT_CONTROL_PERIOD 秒且样本足够时调整一次"""
+        now = time.perf_counter()
+        if not self.enabled:
+            self.imgsz, self.interval = self.max_size, 1
+        elif (now - self.last_adjust >= DETECT_CONTROL_PERIOD and
+                self.samples >= DETECT_CONTROL_MIN_SAMPLES and self.frame_fps):
+            with self._lock:
+                capacity = self.capacity()
+                size = self.imgsz
+                if capacity < self.target_fps and size > self.min_size:
+                    size = max(self.min_size, size - DETECT_SIZE_STEP)
+                elif (size < self.max_size and
+                      self.capacity((size + DETECT_SIZE_STEP) / size) >= self.target_fps * 1.1):
+                    size = min(self.max_size, size + DETECT_SIZE_STEP)
+                rate = min(self.target_fps, capacity * 0.9)
+                self.interval = int(min(self.max_interval, max(1, round(self.frame_fps / rate))))
+                if size != self.imgsz:
+                    # 新的输入尺寸重新统计
+                    self.imgsz = size
+                    self.samples = 0
+                self.last_adjust = now
+        DETECT_INPUT_SIZE.set(self.imgsz)
+        DETECT_INTERVAL.set(self.interval)
+
+    def should_detect(self, frame_index):
+        return frame_index % self.interval == 0
+
+    def state(self):
+        """界面显示用的当前状态"""
+        detect_fps = (self.frame_fps or 0) / self.interval
+        cpu_ratio = (self.cpu or 0) * detect_fps / self.cores
+        DETECT_CPU_RATIO.set(cpu_ratio)
+        return {'imgsz': self.imgsz, 'interval': self.interval, 'latency': self.latency or 0.0,
+                'detect_fps': detect_fps, 'cpu_ratio': cpu_ratio}
+
+
+class DetectorPool:
+    """人员检测进程池. 帧写入共享内存槽位后把槽号交给空闲进程, 不做序列化;
+    没有空闲进程或槽位时跳过该帧. 进程异常退出时按指数退避重启, 加载模型或单帧推理超时的进程
+    视为卡住, 结束后同样重启"""
+
+    def __init__(self, workers=DETECT_WORKERS, slot_bytes=DETECT_SLOT_BYTES, on_result=None,
+                 target=run_detector_worker, load_timeout=DETECT_LOAD_TIMEOUT, task_timeout=DETECT_TASK_TIMEOUT,
+                 restart_min=DETECT_RESTART_MIN, restart_max=DETECT_RESTART_MAX):
+        self.ctx = multiprocessing.get_context('spawn')
+        self.slot_bytes = slot_bytes
+        self.on_result = on_result
+        # target(shm_name, slot_bytes, tasks, results, worker_id) 为工作进程入口
+        self.target = target
+        self.load_timeout = load_timeout
+        self.task_timeout = task_timeout
+        self.restart_min = restart_min
+        self.restart_max = restart_max
+        slots = workers * DETECT_SLOTS_PER_WORKER
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+        self.free_slots = deque(range(slots))
+        self.results = self.ctx.Queue()
+        self.workers = [None] * workers
+        self.seq = 0
+        # 最近一次的检测结果: (帧序号, (N, 6) 检测框数组)
+        self.latest = (0, np.empty((0, DETECT_RESULT_FIELDS), np.float32))
+        self.running = True
+        self._lock = threading.Lock()
+        for worker_id in range(workers):
+            self._start_worker(worker_id)
+        self.collector = threading.Thread(target=self._collect)
+        self.collector.daemon = True
+        self.collector.start()
+
+    def _start_worker(self, worker_id, failures=0):
+        tasks = self.ctx.Queue()
+        process = self.ctx.Process(target=self.target,
+                                   args=(self.shm.name, self.slot_bytes, tasks, self.results, worker_id))
+        process.daemon = True
+        process.start()
+        # busy 为 (帧序号, 槽号, 提交时刻); failures 为连续异常退出次数, 进程加载完模型后清零
+        self.workers[worker_id] = {'process': process, 'tasks': tasks, 'busy': None, 'ready': False,
+                                   'started': time.monotonic(), 'failures': failures, 'restart_at': None}
+
+    def submit(self, frame, imgsz=None):
+        """提交一帧, 返回是否被接受"""
+        if frame.nbytes > self.slot_bytes or frame.dtype != np.uint8 or frame.ndim != 3:
+            raise ValueError(f"不支持的帧格式: {frame.shape} {frame.dtype}")
+        with self._lock:
+            worker = next((w for w in self.workers
+                           if w['ready'] and w['busy'] is None and w['process'].is_alive()), None)
+            if worker is None or not self.free_slots:
+                DETECT_FRAMES_DROPPED.inc()
+                return False
+            slot = self.free_slots.popleft()
+            self.seq += 1
+            seq = self.seq
+            worker['busy'] = (seq, slot, time.monotonic())
+        view = np.ndarray(frame.shape, dtype=np.uint8, buffer=self.shm.buf, offset=slot * self.slot_bytes)
+        view[...] = frame
+        del view
+        worker['tasks'].put((seq, slot, frame.shape[0], frame.shape[1], imgsz))
+        return True
+
+    def _collect(self):
+        """收集检测结果并回收槽位, 同时检查工作进程是否存活、是否卡住"""
+        while self.running:
+            try:
+                worker_id, seq, slot, data, elapsed, cpu, imgsz = self.results.get(timeout=0.5)
+            except queue.Empty:
+                pass
+            else:
+                self._accept(worker_id, seq, slot, data, elapsed, cpu, imgsz)
+            with self._lock:
+                for worker_id in range(len(self.workers)):
+                    if self.running:
+                        self._check_worker(worker_id)
+
+    def _accept(self, worker_id, seq, slot, data, elapsed, cpu, imgsz):
+        with self._lock:
+            worker = self.workers[worker_id]
+            if seq == 0:
+                worker['ready'] = True
+                worker['failures'] = 0
+                return
+            # 已被结束的进程留下的结果, 其槽位已回收
+            if worker['busy'] is None or worker['busy'][0] != seq:
+                return
+            boxes = np.frombuffer(data, dtype=np.float32).reshape(-1, DETECT_RESULT_FIELDS)
+            worker['busy'] = None
+            self.free_slots.append(slot)
+            if seq > self.latest[0]:
+                self.latest = (seq, boxes)
+        VIDEO_STAGE_SECONDS['inference'].observe(elapsed)
+        if self.on_result:
+            self.on_result(seq, boxes, elapsed, cpu, imgsz)
+
+    def _check_worker(self, worker_id):
+        """结束卡住的进程; 已退出的进程回收槽位后按退避间隔重启. 调用方持有 self._lock"""
+        worker = self.workers[worker_id]
+        process = worker['process']
+        now = time.monotonic()
+        if process.is_alive():
+            if worker['busy'] and now - worker['busy'][2] > self.task_timeout:
+                logging.error(f"检测进程 {worker_id} 超过 {self.task_timeout:.0f} 秒未返回结果, 结束后重启")
+            elif not worker['ready'] and now - worker['started'] > self.load_timeout:
+                logging.error(f"检测进程 {worker_id} 超过 {self.load_timeout:.0f} 秒未加载完模型, 结束后重启")
+            else:
+                return
+            DETECT_WORKER_HANGS.inc()
+            process.kill()
+            process.join(timeout=1)
+        if worker['restart_at'] is None:
+            if worker['busy']:
+                self.free_slots.append(worker['busy'][1])
+                worker['busy'] = None
+            delay = min(self.restart_min * 2 ** worker['failures'], self.restart_max)
+            worker['failures'] += 1
+            worker['restart_at'] = now + delay
+            logging.error(f"检测进程 {worker_id} 已退出(代码 {process.exitcode}), {delay:.1f} 秒后重启")
+        elif now >= worker['restart_at']:
+            DETECT_WORKER_RESTARTS.inc()
+            self._start_worker(worker_id, worker['failures'])
+
+    def close(self):
+        self.running = False
+        for worker in self.workers:
+            worker['tasks'].put(None)
+        for worker in self.workers:
+            worker['process'].join(timeout=5)
+            if worker['process'].is_alive():
+                worker['process'].terminate()
+        self.collector.join(timeout=2)
+        self.shm.close()
+        self.shm.unlink()
+
+
+def draw_detections(frame, boxes):
+    """在帧上画出检测框和置信度"""
+    for x1, y1, x2, y2, conf, _ in boxes:
+        cv2.rectangle(frame, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
+        cv2.putText(frame, f"person {conf:.2f}", (int(x1), max(int(y1) - 5, 10)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+    return frame
+
+
+class SyntheticSource:
+    """合成帧源: 固定随机种子生成的背景上有若干移动的人形色块, 用于没有摄像头和录像时测量处理链吞吐量.
+    色块不会被 YOLO 识别为人, 不提供人数标注"""
+
+    def __init__(self, frames=SYNTHETIC_FRAMES, width=640, height=480, people=5, seed=0, loop=False):
+        rng = np.random.default_rng(seed)
+        self.frames = frames
+        self.loop = loop
+        self.index = 0
+        self.size = (width, height)
+        self.background = cv2.GaussianBlur((rng.random((height, width, 3)) * 255).astype(np.uint8), (31, 31), 0)
+        self.positions = rng.random((people, 2)) * (width - 60, height - 140)
+        self.velocities = (rng.random((people, 2)) - 0.5) * 8
+        self.colors = [tuple(int(c) for c in color) for color in rng.integers(0, 255, (people, 3))]
+
+    def read(self):
+        if self.index >= self.frames:
+            if not self.loop:
+                return False, None
+            self.index = 0
+        width, height = self.size
+        frame = self.background.copy()
+        positions = self.positions + self.velocities * self.index
+        # 在画面内来回移动
+        positions = np.abs((positions + (width - 60, height - 140)) % (2 * np.array((width - 60, height - 140)))
+                           - (width - 60, height - 140))
+        for (x, y), color in zip(positions.astype(int), self.colors):
+            cv2.circle(frame, (x + 30, y + 20), 18, color, -1)
+            cv2.rectangle(frame, (x + 10, y + 40), (x + 50, y + 140), color, -1)
+        self.index += 1
+        return True, frame
+
+    def isOpened(self):
+        return True
+
+    def release(self):
+        pass
+
+
+class ImageFolderSource:
+    """图片目录帧源: 按文件名顺序读取目录中的图片"""
+    EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+    def __init__(self, path, loop=False):
+        self.files = sorted(os.path.join(path, name) for name in os.listdir(path)
+                            if name.lower().endswith(self.EXTENSIONS))
+        self.loop = loop
+        self.index = 0
+
+    def read(self):
+        if self.index >= len(self.files):
+            if not self.loop or not self.files:
+                return False, None
+            self.index = 0
+        frame = cv2.imread(self.files[self.index])
+        self.index += 1
+        return frame is not None, frame
+
+    def isOpened(self):
+        return bool(self.files)
+
+    def release(self):
+        pass
+
+
+class VideoFileSource:
+    """视频文件帧源, loop 为 True 时播放结束后从头开始"""
+
+    def __init__(self, path, loop=False):
+        self.capture = cv2.VideoCapture(path)
+        self.loop = loop
+
+    def read(self):
+        ret, frame = self.capture.read()
+        if not ret and self.loop:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.capture.read()
+        return ret, frame
+
+    def isOpened(self):
+        return self.capture.isOpened()
+
+    def release(self):
+        self.capture.release()
+
+
+def open_frame_source(source, loop=False):
+    """打开帧源: 摄像头编号、视频文件、图片目录或 synthetic[:帧数], 返回对象与 cv2.VideoCapture 一样
+    提供 read() 和 release()"""
+    source = str(source)
+    if source.isdigit():
+        return cv2.VideoCapture(int(source))
+    if source == 'synthetic' or source.startswith('synthetic:'):
+        return SyntheticSource(int(source.partition(':')[2] or SYNTHETIC_FRAMES), loop=loop)
+    if os.path.isdir(source):
+        return ImageFolderSource(source, loop)
+    if not os.path.isfile(source):
+        raise FileNotFoundError(f"帧源不存在: {source}")
+    return VideoFileSource(source, loop)
+
+
+def load_count_labels(source, path=None):
+    """读取帧源的人数标注(CSV, 列为 frame,count, 帧号从0开始, 可只标注部分帧).
+    默认位置: 视频文件旁的 <文件名>.labels.csv, 图片目录中的 labels.csv; 没有标注时返回空字典"""
+    source = str(source)
+    if path is None:
+        if os.path.isdir(source):
+            path = os.path.join(source, 'labels.csv')
+        elif os.path.isfile(source):
+            path = os.path.splitext(source)[0] + '.labels.csv'
+        else:
+            return {}
+    if not os.path.exists(path):
+        return {}
+    with open(path, newline='', encoding='utf-8') as f:
+        return {int(row['frame']): int(row['count']) for row in csv.DictReader(f)}
+
+
+class ZoneMap:
+    """摄像头画面中的多边形区域(出口、楼梯间、房间等). 顶点为相对画面宽高的 0~1 坐标.
+    所有区域的边打包成 (区域数, 最大边数) 数组, 先用外接矩形筛出候选 (点, 区域) 对,
+    再对候选对一次性做射线法判断"""
+
+    def __init__(self, zones=()):
+        # zones: [{'id': 标识, 'name': 名称, 'points': [[x, y], ...]}, ...]
+        self.zones = [zone for zone in zones if len(zone['points']) >= 3]
+        self.ids = [zone.get('id') or f"zone{i}" for i, zone in enumerate(self.zones)]
+        self.names = [zone.get('name') or zone_id for zone, zone_id in zip(self.zones, self.ids)]
+        max_edges = max((len(zone['points']) for zone in self.zones), default=0)
+        shape = (len(self.zones), max_edges)
+        x1, y1, x2, y2 = (np.zeros(shape) for _ in range(4))
+        for i, zone in enumerate(self.zones):
+            points = np.asarray(zone['points'], dtype=np.float64)
+            # 不足最大边数的区域用首顶点补齐, 补出的边长度为0, 不与射线相交
+            padded = np.vstack([points, np.repeat(points[:1], max_edges - len(points) + 1, axis=0)])
+            x1[i], y1[i] = padded[:-1, 0], padded[:-1, 1]
+            x2[i], y2[i] = padded[1:, 0], padded[1:, 1]
+        dy = y2 - y1
+        self.x1, self.y1, self.y2 = x1, y1, y2
+        self.bounds = np.array([[np.min(zone['points'], axis=0), np.max(zone['points'], axis=0)]
+                                for zone in self.zones]).reshape(-1, 2, 2)
+        self.slope = np.divide(x2 - x1, dy, out=np.zeros(shape), where=dy != 0)
+
+    @classmethod
+    def load(cls, path=ZONES_PATH, camera=CAMERA_INDEX):
+        """从配置文件读取某个摄像头的区域, 文件不存在时返回空区域表"""
+        if not os.path.exists(path):
+            return cls()
+        try:
+            with open(path, encoding='utf-8') as f:
+                config = json.load(f)
+            return cls(config.get(str(camera), []))
+        except (ValueError, KeyError, TypeError) as e:
+            logging.error(f"区域配置 {path} 格式错误: {str(e)}")
+            return cls()
+
+    def __len__(self):
+        return len(self.zones)
+
+    def contains(self, points):
+        """points 为 (N, 2) 相对坐标, 返回 (N, 区域数) 布尔数组"""
+        px = points[:, 0, None]
+        py = points[:, 1, None]
+        lower, upper = self.bounds[:, 0], self.bounds[:, 1]
+        candidates = (px >= lower[:, 0]) & (px <= upper[:, 0]) & (py >= lower[:, 1]) & (py <= upper[:, 1])
+        point_index, zone_index = np.nonzero(candidates)
+
+        px, py = points[point_index, 0, None], points[point_index, 1, None]
+        y1, y2 = self.y1[zone_index], self.y2[zone_index]
+        crosses = ((y1 <= py) != (y2 <= py)) & (px < self.x1[zone_index] + (py - y1) * self.slope[zone_index])
+        inside = np.zeros(candidates.shape, dtype=bool)
+        inside[point_index, zone_index] = np.count_nonzero(crosses, axis=1) & 1
+        return inside
+
+    def count(self, boxes, width, height):
+        """统计各区域内检测框中心的数量, 返回长度为区域数的数组"""
+        if not self.zones:
+            return np.zeros(0, np.int64)
+        centers = np.empty((len(boxes), 2))
+        centers[:, 0] = (boxes[:, 0] + boxes[:, 2]) / (2 * width)
+        centers[:, 1] = (boxes[:, 1] + boxes[:, 3]) / (2 * height)
+        return np.count_nonzero(self.contains(centers), axis=0)
+
+    def draw(self, frame, counts):
+        """在帧上画出区域边界和区域人数"""
+        height, width = frame.shape[:2]
+        for zone, name, count in zip(self.zones, self.names, counts):
+            points = (np.asarray(zone['points']) * (width, height)).astype(np.int32)
+            cv2.polylines(frame, [points], True, (255, 160, 0), 2)
+            cv2.putText(frame, f"{name}: {count}", tuple(int(v) for v in points[0]),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 160, 0), 2)
+        return frame
+
+
+def benchmark_zones(zones=50, detections=500, repeat=200):
+    """测量区域人数统计耗时"""
+    rng = np.random.default_rng(0)
+    config = []
+    for i in range(zones):
+        center = rng.random(2) * 0.8 + 0.1
+        angles = np.sort(rng.random(8)) * 2 * np.pi
+        points = center + 0.1 * np.c_[np.cos(angles), np.sin(angles)]
+        config.append({'id': f"zone{i}", 'points': points.tolist()})
+    zone_map = ZoneMap(config)
+    corners = rng.random((detections, 2)) * (640, 480)
+    boxes = np.c_[corners, corners + 20, np.ones((detections, 2))].astype(np.float32)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        zone_map.count(boxes, 640, 480)
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"{zones} 个区域, {detections} 个检测框: 每帧 {elapsed * 1000:.3f} ms")
+    return elapsed
+
+
+class OccupancyHeatmap:
+    """人员分布热力图. 按网格累计检测框中心(centers)和检测框覆盖范围(footprint, 每个检测框总权重为1),
+    随时间按半衰期衰减; 检测框通过二维差分数组和一次 np.add.at 累加, 不逐框循环"""
+
+    LAYERS = ('footprint', 'centers')
+
+    def __init__(self, rows=HEATMAP_ROWS, cols=HEATMAP_COLS, half_life=HEATMAP_HALF_LIFE):
+        self.shape = (rows, cols)
+        self.half_life = half_life
+        self.footprint = np.zeros(self.shape, np.float32)
+        self.centers = np.zeros(self.shape, np.float32)
+        self.updated = time.time()
+
+    def decay(self, now):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            factor = np.float32(0.5 ** (elapsed / self.half_life))
+            self.footprint *= factor
+            self.centers *= factor
+            self.updated = now
+
+    def add(self, boxes, width, height, now=None):
+        """累加一帧的检测框 (N, 6), 坐标为 width x height 画面上的像素"""
+        self.decay(time.time() if now is None else now)
+        if len(boxes) == 0:
+            return
+        rows, cols = self.shape
+        sx, sy = cols / width, rows / height
+
+        # 检测框覆盖的网格范围 [x0, x1) x [y0, y1), 至少一格
+        x0 = np.clip((boxes[:, 0] * sx).astype(np.int64), 0, cols - 1)
+        y0 = np.clip((boxes[:, 1] * sy).astype(np.int64), 0, rows - 1)
+        x1 = np.clip(np.ceil(boxes[:, 2] * sx).astype(np.int64), x0 + 1, cols)
+        y1 = np.clip(np.ceil(boxes[:, 3] * sy).astype(np.int64), y0 + 1, rows)
+        weight = (1.0 / ((x1 - x0) * (y1 - y0))).astype(np.float32)
+
+        diff = np.zeros((rows + 1, cols + 1), np.float32)
+        np.add.at(diff, (np.concatenate([y0, y0, y1, y1]), np.concatenate([x0, x1, x0, x1])),
+                  np.concatenate([weight, -weight, -weight, weight]))
+        self.footprint += diff.cumsum(axis=0).cumsum(axis=1)[:rows, :cols]
+
+        cx = np.clip(((boxes[:, 0] + boxes[:, 2]) * (sx / 2)).astype(np.int64), 0, cols - 1)
+        cy = np.clip(((boxes[:, 1] + boxes[:, 3]) * (sy / 2)).astype(np.int64), 0, rows - 1)
+        np.add.at(self.centers, (cy, cx), 1.0)
+
+    def to_bytes(self):
+        """序列化为 npz, 用于共享内存发布和保存到文件"""
+        buffer = io.BytesIO()
+        np.savez(buffer, footprint=self.footprint, centers=self.centers,
+                 updated=np.float64(self.updated), half_life=np.float64(self.half_life))
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, payload):
+        with np.load(io.BytesIO(payload)) as data:
+            heatmap = cls(*data['footprint'].shape, half_life=float(data['half_life']))
+            heatmap.footprint[...] = data['footprint']
+            heatmap.centers[...] = data['centers']
+            heatmap.updated = float(data['updated'])
+        return heatmap
+
+    @classmethod
+    def load(cls, path):
+        """读取保存的热力图, 文件不存在或网格尺寸不同时返回新的热力图"""
+        try:
+            with open(path, 'rb') as f:
+                heatmap = cls.from_bytes(f.read())
+        except (OSError, ValueError, KeyError) as e:
+            if os.path.exists(path):
+                logging.error(f"热力图 {path} 读取失败: {str(e)}")
+            return cls()
+        if heatmap.shape != (HEATMAP_ROWS, HEATMAP_COLS):
+            return cls()
+        heatmap.half_life = HEATMAP_HALF_LIFE
+        return heatmap
+
+    @staticmethod
+    def save(path, payload):
+        """先写临时文件再替换, 避免读到写了一半的文件"""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+    def render(self, layer='footprint', scale=HEATMAP_RENDER_SCALE):
+        """渲染为彩色 PNG 图片(BGR, 最近邻放大 scale 倍)"""
+        grid = getattr(self, layer)
+        peak = float(grid.max())
+        gray = (grid * (255.0 / peak)).astype(np.uint8) if peak > 0 else np.zeros(self.shape, np.uint8)
+        image = cv2.applyColorMap(gray, cv2.COLORMAP_JET)
+        image = np.repeat(np.repeat(image, scale, axis=0), scale, axis=1)
+        ok, encoded = cv2.imencode('.png', image)
+        return encoded.tobytes()
+
+    def overlay(self, frame, layer='footprint', alpha=0.4):
+        """把热力图叠加到视频帧上"""
+        grid = getattr(self, layer)
+        peak = float(grid.max())
+        if peak <= 0:
+            return frame
+        gray = (grid * (255.0 / peak)).astype(np.uint8)
+        colored = cv2.resize(cv2.applyColorMap(gray, cv2.COLORMAP_JET), (frame.shape[1], frame.shape[0]))
+        return cv2.addWeighted(frame, 1 - alpha, colored, alpha, 0)
+
+
+def heatmap_path(camera=CAMERA_INDEX):
+    return HEATMAP_PATH.format(camera=camera)
+
+
+def read_heatmap(camera=CAMERA_INDEX):
+    """Web进程读取热力图: 优先读取主进程发布到共享内存的最新数据, 否则读取保存的文件"""
+    payload = heatmap_block.read() if heatmap_block else b''
+    heatmap = OccupancyHeatmap.from_bytes(payload) if payload else OccupancyHeatmap.load(heatmap_path(camera))
+    heatmap.decay(time.time())
+    return heatmap
+
+
+def benchmark_heatmap(detections=50, repeat=2000):
+    """测量每帧累加热力图的耗时"""
+    rng = np.random.default_rng(0)
+    heatmap = OccupancyHeatmap()
+    corners = rng.random((detections, 2)) * (560, 360)
+    boxes = np.c_[corners, corners + (80, 120), np.ones((detections, 2))].astype(np.float32)
+    start = time.perf_counter()
+    for i in range(repeat):
+        heatmap.add(boxes, 640, 480, now=heatmap.updated + 0.03)
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"{detections} 个检测框: 每帧 {elapsed * 1e6:.1f} us")
+    return elapsed
+
+
+def render_frame(frame, size=(640, 480)):
+    """转换为界面显示用的图片"""
+    image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    return Image.fromarray(image).resize(size)
+
+
+class VideoPipeline:
+    """每帧的视频处理链: 按自动调节提交检测, 统计人数和区域人数, 累计热力图, 标注画面,
+    有新的检测结果时发布人数事件. GUI 的视频线程和无界面基准测试共用"""
+
+    def __init__(self, detector_pool, control, zones, heatmap, bus, camera=CAMERA_INDEX, show_heatmap=None):
+        self.detector_pool = detector_pool
+        self.control = control
+        self.zones = zones
+        self.heatmap = heatmap
+        self.bus = bus
+        self.camera = camera
+        # show_heatmap() 返回是否在画面上叠加热力图
+        self.show_heatmap = show_heatmap
+        self.frame_index = 0
+        self.last_seq = 0
+        self.timings = {}
+
+    def process(self, frame):
+        """处理一帧, 返回 (标注后的画面, 人数, 各区域人数); 各阶段耗时保存在 timings 中:
+        detect 为提交检测, zones 为区域计数, heatmap 为累计热力图, annotate 为标注, publish 为发布人数事件"""
+        start = time.perf_counter()
+        # 人流量检测在工作进程中进行, 按自动调节的间隔和输入尺寸提交,
+        # 检测进程繁忙时跳过本帧, 使用最近一次的结果
+        self.control.update()
+        if self.control.should_detect(self.frame_index):
+            self.detector_pool.submit(frame, self.control.imgsz)
+        self.frame_index += 1
+        seq, boxes = self.detector_pool.latest
         
-        # 创建传感器数据表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sensor_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                temperature REAL,
-                humidity REAL,
-                light REAL,
-                pir INTEGER,
-                gas INTEGER
-            )
-        ''')
+        zones_start = time.perf_counter()
+        # 获取人数和各区域人数
+        people_count = len(boxes)
+        zone_counts = self.zones.count(boxes, frame.shape[1], frame.shape[0]).tolist()
         
-        # 创建水闸操作记录表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS valve_operations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                operation TEXT,
-                mode TEXT,
-                operator TEXT
-            )
-        ''')
+        heatmap_start = time.perf_counter()
+        new_result = seq != self.last_seq
+        if new_result:
+            # 每个检测结果只累计一次热力图
+            self.heatmap.add(boxes, frame.shape[1], frame.shape[0])
         
-        # 创建用户操作记录表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_operations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                operation TEXT,
-                details TEXT
-            )
-        ''')
+        annotate_start = time.perf_counter()
+        # 在画面上标注检测结果和区域
+        annotated_frame = draw_detections(frame, boxes)
+        if self.show_heatmap and self.show_heatmap():
+            annotated_frame = self.heatmap.overlay(annotated_frame)
+        self.zones.draw(annotated_frame, zone_counts)
         
-        self.conn.commit()
+        publish_start = time.perf_counter()
+        # 有新的检测结果时发布人数事件, 上报、记录和Web状态由订阅者处理
+        if new_result:
+            self.last_seq = seq
+            zones = tuple(zip(self.zones.ids, self.zones.names, zone_counts))
+            self.bus.publish(PeopleCount(self.camera, people_count, zones, time.time()))
+        end = time.perf_counter()
+        
+        self.timings = {'detect': zones_start - start, 'zones': heatmap_start - zones_start,
+                        'heatmap': annotate_start - heatmap_start, 'annotate': publish_start - annotate_start,
+                        'publish': end - publish_start}
+        for stage, seconds in self.timings.items():
+            VIDEO_STAGE_SECONDS[stage].observe(seconds)
+        return annotated_frame, people_count, zone_counts
+
+
+def benchmark_inference(seconds=10.0, workers=DETECT_WORKERS):
+    """比较推理空闲、进程内推理饱和和进程池推理饱和时模拟串口处理的延迟"""
+    fast_path = AlarmFastPath(lambda cmd, received_at: None, detector=AnomalyDetector())
+    frame = (np.random.default_rng(0).random((480, 640, 3)) * 255).astype(np.uint8)
+
+    def ingest(duration):
+        # 模拟串口线程: 每 10 ms 处理一条读数, 记录从预定时刻到处理完成的延迟
+        latencies = []
+        deadline = time.perf_counter() + duration
+        next_tick = time.perf_counter()
+        i = 0
+        while next_tick < deadline:
+            next_tick += 0.01
+            time.sleep(max(0.0, next_tick - time.perf_counter()))
+            temp_humi = f"w{20 + i % 5}.5&s60!".split('&')
+            data = {'temp': float(temp_humi[0][1:]), 'humi': float(temp_humi[1][1:].rstrip('!')),
+                    'light': 100.0, 'pir': 0, 'gas': 0, 'device': 'COM1'}
+            fast_path.check(data, changed=('temp', 'humi'))
+            latencies.append(time.perf_counter() - next_tick)
+            i += 1
+        latencies.sort()
+        return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99) - 1]
+
+    report = {'空闲': ingest(seconds)}
+
+    stop = threading.Event()
+
+    def saturate_in_process():
+        model = get_model()
+        while not stop.is_set():
+            model(frame, classes=[0], verbose=False)
+
+    thread = threading.Thread(target=saturate_in_process, daemon=True)
+    thread.start()
+    time.sleep(3)
+    report['进程内推理'] = ingest(seconds)
+    stop.set()
+    thread.join()
+
+    pool = DetectorPool(workers)
+    stop.clear()
+
+    def saturate_pool():
+        while not stop.is_set():
+            if not pool.submit(frame):
+                time.sleep(0.001)
+
+    thread = threading.Thread(target=saturate_pool, daemon=True)
+    thread.start()
+    time.sleep(10)  # 等待工作进程加载模型
+    report['进程池推理'] = ingest(seconds)
+    stop.set()
+    thread.join()
+    pool.close()
+
+    for name, (p50, p99) in report.items():
+        print(f"{name}: 串口处理延迟 p50 {p50 * 1000:.2f} ms, p99 {p99 * 1000:.2f} ms")
+    return report
+
+
+def peak_memory_mb(children=False):
+    """本进程的峰值内存(MB); children 为 True 时为已结束的子进程中最大的一个. 不支持的平台返回 None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB, macOS 为字节
+    return round(usage / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def benchmark_video(source='synthetic', max_frames=None, sync=False, labels_path=None,
+                    baseline_path=VIDEO_BENCH_BASELINE, save_baseline=False):
+    """不启动界面, 用录像、图片目录或合成帧运行完整的视频处理链(读取、检测、标注、渲染、上报到桩),
+    报告帧率、各阶段延迟、CPU和内存占用, 有人数标注时同时报告检测人数的准确度.
+    sync 为 True 时每帧都等检测结果返回后再处理下一帧(固定最大输入尺寸), 用于测量准确度.
+    结果与基线比较, 基线不存在或 save_baseline 时保存为新基线; 返回是否未出现退化"""
+    labels = load_count_labels(source, labels_path)
+    capture = open_frame_source(source)
+    if not capture.isOpened():
+        print(f"无法打开帧源: {source}")
+        return False
+
+    control = InferenceController()
+    control.enabled = not sync
+    detections = {}
+
+    def on_result(seq, boxes, elapsed, cpu, imgsz):
+        detections[seq] = (len(boxes), elapsed, cpu)
+        control.observe(seq, boxes, elapsed, cpu, imgsz)
+
+    # 上报桩: 只构建 OneNet 参数, 不发送
+    uploaded = []
+    bus = EventBus()
+    bus.subscribe((PeopleCount,), lambda event: uploaded.append(build_people_params(event)),
+                  'bench-upload', policy='drop_oldest')
+
+    pool = DetectorPool(on_result=on_result)
+    pipeline = VideoPipeline(pool, control, ZoneMap.load(ZONES_PATH, CAMERA_INDEX), OccupancyHeatmap(), bus)
+    print("等待检测进程加载模型...")
+    warmup = np.zeros((480, 640, 3), np.uint8)
+    while not pool.submit(warmup):
+        time.sleep(0.1)
+    while pool.latest[0] < pool.seq:
+        time.sleep(0.1)
+    warmup_seq = pool.seq
+    detections.clear()
+
+    stages = {stage: [] for stage in ('capture', 'detect', 'zones', 'heatmap', 'annotate', 'render', 'publish')}
+    frame_of_seq = {}
+    frames = 0
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    try:
+        while max_frames is None or frames < max_frames:
+            start = time.perf_counter()
+            ret, frame = capture.read()
+            if not ret:
+                break
+            stages['capture'].append(time.perf_counter() - start)
+            seq = pool.seq
+            annotated_frame, people_count, zone_counts = pipeline.process(frame)
+            if pool.seq != seq:
+                frame_of_seq[pool.seq] = frames
+            for stage, seconds in pipeline.timings.items():
+                stages[stage].append(seconds)
+            start = time.perf_counter()
+            render_frame(annotated_frame)
+            stages['render'].append(time.perf_counter() - start)
+            frames += 1
+            if sync:
+                while pool.latest[0] < pool.seq:
+                    time.sleep(0.0005)
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        # 等待最后提交的检测结果
+        deadline = time.perf_counter() + 10
+        while pool.latest[0] < pool.seq and time.perf_counter() < deadline:
+            time.sleep(0.01)
+    finally:
+        capture.release()
+        pool.close()
+        bus.close()
+
+    if not frames:
+        print(f"帧源 {source} 没有读到任何帧")
+        return False
+    results = [value for seq, value in detections.items() if seq > warmup_seq]
+    report = {
+        'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'source': str(source), 'frames': frames, 'sync': sync,
+        'fps': round(frames / wall, 1),
+        'detections': len(results),
+        'stages': {stage: summarize_latencies(values) for stage, values in stages.items()},
+        'inference': summarize_latencies([elapsed for _, elapsed, _ in results]),
+        'cpu': {
+            'main_ratio': round(cpu / wall, 3),
+            'detector_ratio': round(sum(cpu for _, _, cpu in results) / wall, 3),
+            'cores': os.cpu_count()
+        },
+        'memory_mb': {'main_peak': peak_memory_mb(), 'detector_peak': peak_memory_mb(children=True)},
+        'uploads': len(uploaded)
+    }
+
+    # 人数准确度: 只比较有标注的帧上的检测结果
+    errors = [detections[seq][0] - labels[frame_index] for seq, frame_index in frame_of_seq.items()
+              if frame_index in labels and seq in detections]
+    if errors:
+        errors = np.abs(np.asarray(errors))
+        report['accuracy'] = {'labeled_frames': len(errors), 'mae': round(float(errors.mean()), 3),
+                              'exact_ratio': round(float((errors == 0).mean()), 3)}
+
+    print(f"{source}: {frames} 帧, {report['fps']} 帧/s, 检测 {len(results)} 次, 上报 {len(uploaded)} 次")
+    for stage, summary in report['stages'].items():
+        print(f"  {stage:<10} p50 {summary.get('p50_ms', '-')} ms  p95 {summary.get('p95_ms', '-')} ms  "
+              f"p99 {summary.get('p99_ms', '-')} ms")
+    inference = report['inference']
+    print(f"  推理       p50 {inference.get('p50_ms', '-')} ms  p95 {inference.get('p95_ms', '-')} ms")
+    print(f"  CPU: 主进程 {report['cpu']['main_ratio'] * 100:.0f}%, 检测进程 {report['cpu']['detector_ratio'] * 100:.0f}% "
+          f"(单核为 100%, 共 {report['cpu']['cores']} 核)")
+    print(f"  峰值内存: 主进程 {report['memory_mb']['main_peak']} MB, 检测进程 {report['memory_mb']['detector_peak']} MB")
+    if 'accuracy' in report:
+        accuracy = report['accuracy']
+        print(f"  人数准确度: {accuracy['labeled_frames']} 个标注帧, 平均绝对误差 {accuracy['mae']}, "
+              f"完全正确 {accuracy['exact_ratio'] * 100:.1f}%")
+    elif labels:
+        print("  有人数标注, 但标注帧都没有检测结果(可加 --bench-video-sync)")
+
+    passed = True
+    if os.path.exists(baseline_path):
+        with open(baseline_path, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('source') != report['source'] or baseline.get('sync') != sync:
+            print(f"基线 {baseline_path} 的帧源或模式不同, 不比较")
+        else:
+            print(f"与基线 {baseline_path} ({baseline.get('time')}) 比较:")
+            checks = [(f"{stage} p95", baseline['stages'].get(stage, {}).get('p95_ms'), summary.get('p95_ms'))
+                      for stage, summary in report['stages'].items()]
+            for name, old, new in checks:
+                if old is None or new is None:
+                    continue
+                worse = new > old * (1 + VIDEO_BENCH_TOLERANCE) and new - old > VIDEO_BENCH_NOISE_MS
+                passed &= not worse
+                print(f"  {name}: {old} -> {new} ms{' (退化)' if worse else ''}")
+            if report['fps'] < baseline['fps'] * (1 - VIDEO_BENCH_TOLERANCE):
+                passed = False
+                print(f"  帧率: {baseline['fps']} -> {report['fps']} 帧/s (退化)")
+            old_mae = baseline.get('accuracy', {}).get('mae')
+            if old_mae is not None and 'accuracy' in report and report['accuracy']['mae'] > old_mae:
+                passed = False
+                print(f"  人数平均绝对误差: {old_mae} -> {report['accuracy']['mae']} (退化)")
+    if save_baseline or not os.path.exists(baseline_path):
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存为基线: {baseline_path}")
+    return passed
+
+
+class OnenetOutbox:
+    """OneNet上报待发送队列. 上报先追加到 SQLite 文件, 后台线程按批次限速发送,
+    网络中断时保留未发送记录, 超出容量时丢弃最旧的记录.
+    send(params) 成功时返回假值, 服务器拒绝时返回真值, 网络错误时抛出 OSError;
+    网络错误不计入重试次数, 被拒绝 max_attempts 次的记录移入 dead_letter 表, 不再阻塞后面的记录"""
+
+    def __init__(self, path=OUTBOX_PATH, send=report_to_onenet, max_records=OUTBOX_MAX_RECORDS,
+                 drain_rate=OUTBOX_DRAIN_RATE, retry_min=OUTBOX_RETRY_MIN, retry_max=OUTBOX_RETRY_MAX,
+                 max_attempts=OUTBOX_MAX_ATTEMPTS):
+        self.send = send
+        self.max_records = max_records
+        self.drain_rate = drain_rate
+        self.retry_min = retry_min
+        self.retry_max = retry_max
+        self.max_attempts = max_attempts
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created REAL,
+                payload TEXT,
+                attempts INTEGER DEFAULT 0
+            )
+        ''')
+        if 'attempts' not in [row[1] for row in self.conn.execute("PRAGMA table_info(outbox)")]:
+            self.conn.execute("ALTER TABLE outbox ADD COLUMN attempts INTEGER DEFAULT 0")
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS dead_letter (
+                id INTEGER PRIMARY KEY,
+                created REAL,
+                payload TEXT,
+                attempts INTEGER,
+                failed_at REAL,
+                error TEXT
+            )
+        ''')
+        self.conn.commit()
+        self._lock = threading.Lock()
+        self.backlog = self.conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+        OUTBOX_BACKLOG.set(self.backlog)
+
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self.thread:
+            self.thread.join()
+        self.conn.close()
+
+    def submit(self, params):
+        """追加一条属性上报, 各属性附带采集时间(毫秒)"""
+        now = time.time()
+        stamped = {name: dict(prop, time=int(now * 1000)) for name, prop in params.items()}
+        with self._lock:
+            self.conn.execute("INSERT INTO outbox (created, payload) VALUES (?, ?)",
+                              (now, json.dumps(stamped, ensure_ascii=False)))
+            self.backlog += 1
+            excess = self.backlog - self.max_records
+            if excess > 0:
+                self.conn.execute("DELETE FROM outbox WHERE id IN (SELECT id FROM outbox ORDER BY id LIMIT ?)",
+                                  (excess,))
+                self.backlog -= excess
+                OUTBOX_EVICTED.inc(excess)
+            self.conn.commit()
+            OUTBOX_BACKLOG.set(self.backlog)
+        self._wakeup.set()
+
+    def peek(self, limit):
+        with self._lock:
+            return self.conn.execute("SELECT id, payload, attempts FROM outbox ORDER BY id LIMIT ?",
+                                     (limit,)).fetchall()
+
+    def remove(self, ids):
+        with self._lock:
+            cursor = self.conn.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+            self.backlog -= cursor.rowcount
+            self.conn.commit()
+            OUTBOX_BACKLOG.set(self.backlog)
+
+    def reject(self, record_id, attempts, error):
+        """记录一次被服务器拒绝; 达到 max_attempts 次时移入 dead_letter 表, 返回是否已移入"""
+        with self._lock:
+            if attempts < self.max_attempts:
+                self.conn.execute("UPDATE outbox SET attempts = ? WHERE id = ?", (attempts, record_id))
+                self.conn.commit()
+                return False
+            self.conn.execute("INSERT OR REPLACE INTO dead_letter "
+                              "SELECT id, created, payload, ?, ?, ? FROM outbox WHERE id = ?",
+                              (attempts, time.time(), error, record_id))
+            cursor = self.conn.execute("DELETE FROM outbox WHERE id = ?", (record_id,))
+            self.backlog -= cursor.rowcount
+            self.conn.commit()
+            OUTBOX_BACKLOG.set(self.backlog)
+        OUTBOX_DEAD_LETTERS.inc()
+        logging.error(f"OneNet上报记录 {record_id} 被拒绝 {attempts} 次, 已移入 dead_letter 表: {error}")
+        return True
+
+    def dead_letters(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM dead_letter").fetchone()[0]
+
+    def run(self):
+        """发送线程: 按批取出最旧的记录依次发送, 网络错误或记录被拒绝时按指数退避重试"""
+        delay = self.retry_min
+        while not self._stop.is_set():
+            batch = self.peek(OUTBOX_BATCH_SIZE)
+            if not batch:
+                self._wakeup.wait(1.0)
+                self._wakeup.clear()
+                continue
+
+            sent = []
+            failure = None
+            for record_id, payload, attempts in batch:
+                try:
+                    rejected = self.send(json.loads(payload))
+                except OSError as e:
+                    failure = f"网络错误: {str(e)}"
+                    break
+                except Exception as e:
+                    rejected = str(e) or type(e).__name__
+                if rejected:
+                    if sent:
+                        self.remove(sent)
+                        sent = []
+                    if not self.reject(record_id, attempts + 1, str(rejected)):
+                        failure = f"服务器拒绝({attempts + 1}/{self.max_attempts}): {rejected}"
+                        break
+                    continue
+                sent.append(record_id)
+                if len(batch) > 1:
+                    # 积压时限速补发
+                    time.sleep(1.0 / self.drain_rate)
+            if sent:
+                self.remove(sent)
+
+            if failure:
+                logging.warning(f"OneNet上报失败, {delay:.0f} 秒后重试, 待发送 {self.backlog} 条, {failure}")
+                self._stop.wait(delay)
+                delay = min(delay * 2, self.retry_max)
+            else:
+                delay = self.retry_min
+
+
+class AnomalyDetector:
+    """温度和烟雾的流式异常检测, 每个样本 O(1) 更新 EWMA、滑动窗口斜率和 z 分数.
+    各设备的状态按 (设备槽位, 通道) 存放在定长数组中"""
+
+    RATE_OF_RISE = 1
+    ZSCORE = 2
+
+    def __init__(self, max_devices=DETECTOR_MAX_DEVICES, window=DETECTOR_WINDOW):
+        self.window = window
+        self.slots = {}
+        size = max_devices * len(DETECTOR_CHANNELS)
+        self.channel_index = {channel: i for i, channel in enumerate(DETECTOR_CHANNELS)}
+        self.min_std = [DETECTOR_MIN_STD[channel] for channel in DETECTOR_CHANNELS]
+        self.rise_limits = [DETECTOR_RISE_LIMITS[channel] / 60.0 for channel in DETECTOR_CHANNELS]
+
+        # EWMA 均值/方差和样本数
+        self.mean = array.array('d', bytes(8 * size))
+        self.var = array.array('d', bytes(8 * size))
+        self.count = array.array('l', bytes(array.array('l').itemsize * size))
+        # 斜率窗口: 环形缓冲区和最小二乘所需的累加和, 时间相对 origin
+        self.ring_t = array.array('d', bytes(8 * size * window))
+        self.ring_x = array.array('d', bytes(8 * size * window))
+        self.head = array.array('l', bytes(array.array('l').itemsize * size))
+        self.origin = array.array('d', bytes(8 * size))
+        self.sum_t = array.array('d', bytes(8 * size))
+        self.sum_x = array.array('d', bytes(8 * size))
+        self.sum_tt = array.array('d', bytes(8 * size))
+        self.sum_tx = array.array('d', bytes(8 * size))
+        # 最近一次的输出
+        self.zscore = array.array('d', bytes(8 * size))
+        self.slope = array.array('d', bytes(8 * size))
+
+    def slot(self, device):
+        slot = self.slots.get(device)
+        if slot is None:
+            if len(self.slots) * len(DETECTOR_CHANNELS) >= len(self.mean):
+                raise ValueError(f"异常检测设备数超过上限 {len(self.slots)}")
+            slot = self.slots[device] = len(self.slots)
+        return slot
+
+    def update(self, device, channel, t, x):
+        """加入一个样本 (时间t秒, 值x), 返回触发标志位 RATE_OF_RISE | ZSCORE"""
+        c = self.channel_index[channel]
+        k = self.slot(device) * len(DETECTOR_CHANNELS) + c
+        n = self.count[k]
+        flags = 0
+
+        # z 分数: 与更新前的 EWMA 比较, 只关注上升方向
+        mean = self.mean[k]
+        if n >= DETECTOR_WARMUP:
+            std = max(math.sqrt(self.var[k]), self.min_std[c])
+            z = (x - mean) / std
+            if z > DETECTOR_Z_THRESHOLD:
+                flags |= self.ZSCORE
+        else:
+            z = 0.0
+        self.zscore[k] = z
+
+        if n == 0:
+            self.mean[k] = x
+            self.origin[k] = t
+        else:
+            diff = x - mean
+            incr = DETECTOR_EWMA_ALPHA * diff
+            self.mean[k] = mean + incr
+            self.var[k] = (1.0 - DETECTOR_EWMA_ALPHA) * (self.var[k] + diff * incr)
+
+        # 滑动窗口最小二乘斜率: 移出最旧样本, 加入新样本
+        window = self.window
+        pos = k * window + self.head[k]
+        rt = t - self.origin[k]
+        if n >= window:
+            old_t, old_x = self.ring_t[pos], self.ring_x[pos]
+            self.sum_t[k] -= old_t
+            self.sum_x[k] -= old_x
+            self.sum_tt[k] -= old_t * old_t
+            self.sum_tx[k] -= old_t * old_x
+            m = window
+        else:
+            m = n + 1
+        self.ring_t[pos] = rt
+        self.ring_x[pos] = x
+        self.sum_t[k] += rt
+        self.sum_x[k] += x
+        self.sum_tt[k] += rt * rt
+        self.sum_tx[k] += rt * x
+        self.head[k] = (self.head[k] + 1) % window
+        self.count[k] = n + 1
+        if rt > DETECTOR_RECENTER:
+            self._recenter(k, m)
+
+        sum_t = self.sum_t[k]
+        denom = m * self.sum_tt[k] - sum_t * sum_t
+        if m >= 5 and denom > 1e-9:
+            slope = (m * self.sum_tx[k] - sum_t * self.sum_x[k]) / denom
+            if slope > self.rise_limits[c]:
+                flags |= self.RATE_OF_RISE
+        else:
+            slope = 0.0
+        self.slope[k] = slope
+        return flags
+
+    def _recenter(self, k, m):
+        """把时间原点移到窗口内最旧的样本, 重新计算累加和, 避免累加和精度下降"""
+        window = self.window
+        base = k * window
+        start = self.head[k] if m == window else 0
+        positions = [base + (start + i) % window for i in range(m)]
+        shift = self.ring_t[positions[0]]
+        self.origin[k] += shift
+        sum_t = sum_x = sum_tt = sum_tx = 0.0
+        for pos in positions:
+            rt = self.ring_t[pos] - shift
+            self.ring_t[pos] = rt
+            x = self.ring_x[pos]
+            sum_t += rt
+            sum_x += x
+            sum_tt += rt * rt
+            sum_tx += rt * x
+        self.sum_t[k], self.sum_x[k], self.sum_tt[k], self.sum_tx[k] = sum_t, sum_x, sum_tt, sum_tx
+
+    def state(self, device, channel):
+        """设备某通道最近的 EWMA 均值、z 分数和斜率(每分钟)"""
+        k = self.slot(device) * len(DETECTOR_CHANNELS) + self.channel_index[channel]
+        return {'ewma': self.mean[k], 'zscore': self.zscore[k], 'slope_per_min': self.slope[k] * 60.0}
+
+
+def benchmark_detector(samples=200000, devices=8):
+    """测量异常检测的吞吐量(样本/秒)"""
+    detector = AnomalyDetector()
+    names = [f'COM{i}' for i in range(devices)]
+    start = time.perf_counter()
+    for i in range(samples):
+        device = names[i % devices]
+        channel = 'temp' if i & 1 else 'gas'
+        detector.update(device, channel, i * 0.1, 25.0 + (i % 7) * 0.1)
+    elapsed = time.perf_counter() - start
+    rate = samples / elapsed
+    print(f"异常检测: {samples} 个样本, {elapsed:.2f} s, {rate:.0f} 样本/秒")
+    return rate
+
+
+class AlarmFastPath:
+    """报警快速通道: 先判定阈值并下发开闸命令, 记录、上报和界面提示交给后台线程"""
+
+    def __init__(self, write_command, on_trip=None, detector=None):
+        # write_command(命令, 读数接收时刻)
+        self.write_command = write_command
+        self.on_trip = on_trip
+        self.detector = detector
+        # 阈值和模式使用普通变量缓存, 串口线程判定时无需读取Tk变量
+        self.thresholds = {'temp': 30.0, 'humi': 80.0, 'light': 1000.0}
+        self.auto_mode = True
+        self.valve_open = False
+        self._lock = threading.Lock()
+
+        # 后续任务队列, 由后台线程依次执行
+        self.tasks = queue.Queue()
+        self.worker = threading.Thread(target=self._run_tasks)
+        self.worker.daemon = True
+        self.worker.start()
+
+    def check(self, data, received_at=None, changed=()):
+        """检查读数是否越限或出现异常上升, 触发且水闸未开时立即开闸, 返回是否触发.
+        changed 为本次更新的字段, 其中的温度和烟雾送入异常检测"""
+        if received_at is None:
+            received_at = time.perf_counter()
+
+        reasons = []
+        if self.detector:
+            device = data.get('device', '')
+            for channel in DETECTOR_CHANNELS:
+                if channel in changed:
+                    flags = self.detector.update(device, channel, received_at, data[channel])
+                    if flags & AnomalyDetector.RATE_OF_RISE:
+                        ANOMALY_EVENTS[channel, 'rate_of_rise'].inc()
+                        reasons.append(f"{'温度' if channel == 'temp' else '烟雾'}快速上升")
+                    if flags & AnomalyDetector.ZSCORE:
+                        ANOMALY_EVENTS[channel, 'zscore'].inc()
+                        reasons.append(f"{'温度' if channel == 'temp' else '烟雾'}异常偏高")
+
+        if not self.auto_mode:
+            return False
+        thresholds = self.thresholds
+        if (data['temp'] > thresholds['temp'] or
+                data['humi'] > thresholds['humi'] or
+                data['light'] > thresholds['light']):
+            reasons.insert(0, "超过阈值")
+        if not reasons:
+            return False
+
+        with self._lock:
+            if self.valve_open:
+                return False
+            self.valve_open = True
+        # 读数时刻随命令传给写入线程, 写入串口后记录动作延迟
+        self.write_command(b'\x01', received_at)
+        if self.on_trip:
+            self.submit(self.on_trip, data, '、'.join(reasons))
+        return True
+
+    def submit(self, func, *args):
+        """提交后续任务(记录、上报、界面提示)"""
+        self.tasks.put((func, args))
+
+    def _run_tasks(self):
+        while True:
+            func, args = self.tasks.get()
+            try:
+                func(*args)
+            except Exception as e:
+                logging.error(f"后台任务执行错误: {str(e)}")
+
+
+class CommandWriter:
+    """串口下行命令的唯一写入者. 命令按优先级排队(报警命令优先), 逐条写入后等待板子确认,
+    超时重发; 等待确认期间有更高优先级的命令到达时放弃当前命令, 先发送新命令.
+    require_ack 为假时不等待确认帧, 写入成功即视为确认"""
+
+    def __init__(self, write, on_done=None, ack_timeout=VALVE_ACK_TIMEOUT, retries=VALVE_ACK_RETRIES,
+                 require_ack=VALVE_ACK_REQUIRED):
+        # write(payload) 返回 False 表示串口未打开
+        self.write = write
+        self.on_done = on_done
+        self.require_ack = require_ack
+        self.ack_timeout = ack_timeout
+        self.retries = retries
+        self._queue = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        self._expected = None
+        self._acked = False
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def send(self, payload, priority=COMMAND_PRIORITY_MANUAL, context=None, received_at=None):
+        """命令入队, 完成后以 (payload, context, 结果) 调用 on_done;
+        结果为 'acked'、'timeout'、'preempted' 或 'closed'(串口未打开).
+        报警命令给出触发读数的接收时刻 received_at, 首次写入串口后记录读数到开闸的延迟"""
+        with self._cond:
+            heapq.heappush(self._queue, (priority, next(self._order), time.perf_counter(), payload, context,
+                                         received_at))
+            self._cond.notify()
+
+    def acknowledge(self, code):
+        """串口线程收到确认帧时调用, 返回是否与等待中的命令匹配"""
+        with self._cond:
+            if self._expected is None or code != self._expected:
+                return False
+            self._acked = True
+            self._cond.notify()
+            return True
+
+    def _preempted(self, priority):
+        return bool(self._queue) and self._queue[0][0] < priority
+
+    def run(self):
+        while True:
+            with self._cond:
+                while self.running and not self._queue:
+                    self._cond.wait()
+                if not self.running:
+                    return
+                priority, _, queued_at, payload, context, received_at = heapq.heappop(self._queue)
+                self._expected = VALVE_ACK_CODES.get(payload) if self.require_ack else None
+                self._acked = False
+            VALVE_COMMAND_QUEUE_SECONDS.observe(time.perf_counter() - queued_at)
+
+            result = 'timeout'
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    VALVE_COMMAND_RETRIES.inc()
+                sent_at = time.perf_counter()
+                try:
+                    written = self.write(payload)
+                except Exception as e:
+                    logging.error(f"水闸命令写入错误: {str(e)}")
+                    written = None
+                if written is False:
+                    result = 'closed'
+                    break
+                if received_at is not None and not attempt:
+                    latency = time.perf_counter() - received_at
+                    ALARM_ACTUATION_SECONDS.observe(latency)
+                    if latency > ALARM_LATENCY_BUDGET:
+                        logging.warning(f"水闸动作延迟超出预算: {latency * 1000:.2f} ms")
+                if self._expected is None:
+                    # 不需要确认的命令, 或固件不支持确认帧
+                    result = 'acked'
+                    break
+                with self._cond:
+                    self._cond.wait_for(lambda: self._acked or self._preempted(priority) or not self.running,
+                                        self.ack_timeout)
+                    if self._acked:
+                        VALVE_ACK_SECONDS.observe(time.perf_counter() - sent_at)
+                        result = 'acked'
+                    elif self._preempted(priority):
+                        result = 'preempted'
+                if result != 'timeout' or not self.running:
+                    break
+
+            with self._cond:
+                self._expected = None
+            if result == 'timeout':
+                VALVE_COMMAND_FAILURES.inc()
+                logging.warning(f"水闸命令 {payload!r} 重发 {self.retries} 次后仍未收到确认")
+            if self.on_done:
+                try:
+                    self.on_done(payload, context, result)
+                except Exception as e:
+                    logging.error(f"水闸命令回调错误: {str(e)}")
+
+    def close(self):
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+        self.thread.join(timeout=2)
+
+
+class DatabaseWriter:
+    """数据库写入线程. 取出队列中已积攒的全部写入请求, 在一个事务中执行后提交一次,
+    提交后依次调用各请求的回调. 批量写入失败时回滚并逐条重试, 只丢弃出错的请求"""
+
+    def __init__(self, conn, lock, max_batch=DB_WRITE_BATCH_MAX):
+        self.conn = conn
+        self.lock = lock
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, sql, params, on_done=None):
+        self.queue.put((sql, params, on_done))
+
+    def run(self):
+        running = True
+        while running:
+            item = self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < self.max_batch:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+            self.write_batch(batch)
+
+    def write_batch(self, batch):
+        start = time.perf_counter()
+        with self.lock:
+            try:
+                # 相邻的同一语句合并为 executemany
+                for sql, items in itertools.groupby(batch, key=lambda item: item[0]):
+                    self.conn.executemany(sql, [params for _, params, _ in items])
+                self.conn.commit()
+            except Exception as e:
+                self.conn.rollback()
+                logging.error(f"数据库批量写入错误, 改为逐条写入: {str(e)}")
+                batch = self.write_each(batch)
+        DB_WRITE_SECONDS.observe(time.perf_counter() - start)
+        DB_BATCH_SIZE.observe(len(batch))
+        for _, _, on_done in batch:
+            if on_done:
+                try:
+                    on_done()
+                except Exception as e:
+                    logging.error(f"数据库写入回调错误: {str(e)}")
+
+    def write_each(self, batch):
+        """逐条执行批量中的请求后提交一次, 出错的请求记录日志后丢弃, 返回写入成功的请求"""
+        written = []
+        for item in batch:
+            sql, params, _ = item
+            try:
+                self.conn.execute(sql, params)
+                written.append(item)
+            except Exception as e:
+                DB_WRITE_ERRORS.inc()
+                logging.error(f"数据库写入错误, 丢弃该条记录: {str(e)} ({sql.split('(')[0].strip()})")
+        try:
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            DB_WRITE_ERRORS.inc(len(written))
+            logging.error(f"数据库提交错误: {str(e)}")
+            return []
+        return written
+
+    def close(self):
+        """写完队列中剩余的请求后退出"""
+        self.queue.put(None)
+        self.thread.join(timeout=5)
+
+
+class IngestCoalescer:
+    """按设备合并同一次采样的分帧数据(g/h/y/w 各一行)为一条记录. 所有分组到齐、
+    同一字段再次到达(下一次采样已开始)或窗口超时时输出, 记录时间为该次采样第一帧的接收时间"""
+
+    def __init__(self, emit, window=INGEST_WINDOW, groups=INGEST_GROUPS):
+        # emit(data) 在串口线程或超时检查线程中调用, 应尽快返回
+        self.emit = emit
+        self.window = window
+        self.groups = frozenset(groups)
+        self.pending = {}
+        self._lock = threading.Lock()
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, data, changed, now=None):
+        """加入一帧; data 为该设备的最新完整读数, changed 为本帧更新的字段"""
+        if not changed:
+            return
+        now = time.time() if now is None else now
+        device = data.get('device', '')
+        changed = self.groups.intersection(changed) or frozenset(changed)
+        with self._lock:
+            entry = self.pending.get(device)
+            if entry and entry['seen'] & changed:
+                self._emit(self.pending.pop(device))
+                entry = None
+            if entry is None:
+                entry = self.pending[device] = {'first': now, 'frames': 0, 'seen': set()}
+            entry['data'] = data
+            entry['frames'] += 1
+            entry['seen'] |= changed
+            if entry['seen'] >= self.groups:
+                self._emit(self.pending.pop(device))
+
+    def flush(self, device=None):
+        """立即输出某个设备(默认全部)未完成的记录"""
+        with self._lock:
+            for key in [key for key in self.pending if device is None or key == device]:
+                self._emit(self.pending.pop(key))
+
+    def _emit(self, entry):
+        data = dict(entry['data'])
+        data['timestamp'] = utc_text(entry['first'])
+        INGEST_RECORDS.inc()
+        INGEST_FRAMES_PER_RECORD.observe(entry['frames'])
+        try:
+            self.emit(data)
+        except Exception as e:
+            logging.error(f"合并记录输出错误: {str(e)}")
+
+    def run(self):
+        """输出超过窗口时间仍未到齐的记录"""
+        while self.running:
+            time.sleep(self.window / 4)
+            deadline = time.time() - self.window
+            with self._lock:
+                for device in [device for device, entry in self.pending.items() if entry['first'] <= deadline]:
+                    self._emit(self.pending.pop(device))
+
+    def close(self):
+        self.running = False
+        self.flush()
+
+
+class Event:
+    """事件总线上的事件. 子类在 __slots__ 中声明字段, 创建后不可修改"""
+    __slots__ = ()
+
+    def __init__(self, *args, **kwargs):
+        values = dict(zip(self.__slots__, args), **kwargs)
+        for name in self.__slots__:
+            object.__setattr__(self, name, values.get(name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} 不可修改")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} 不可修改")
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class SensorReading(Event):
+    """一次采样合并后的传感器读数, timestamp 为 UTC 'YYYY-MM-DD HH:MM:SS'"""
+    __slots__ = ('device', 'timestamp', 'temp', 'humi', 'light', 'pir', 'gas')
+
+
+class PeopleCount(Event):
+    """一次检测结果的人数, zones 为 ((区域id, 区域名称, 人数), ...)"""
+    __slots__ = ('camera', 'count', 'zones', 'time')
+
+
+class ValveChange(Event):
+    """水闸命令完成, result 为 CommandWriter 的结果('acked'、'timeout' 等)"""
+    __slots__ = ('open', 'mode', 'result', 'time')
+
+
+def build_sensor_params(data):
+    """构建OneNet属性参数字典"""
+    params = {}
+    
+    # 添加有值的字段
+    if data['temp']:
+        params["temp"] = {"value": int(data['temp'])}
+    if data['humi']:
+        params["shidu"] = {"value": int(data['humi'])}
+    if data['light']:
+        params["guangzhao"] = {"value": int(data['light'])}
+    if data['pir']:
+        params["rentihongwai"] = {"value": data['pir']}
+    if data['gas']:
+        params["yanwu"] = {"value": data['gas']}
+    return params
+
+
+def build_people_params(event):
+    """由 PeopleCount 事件构建OneNet属性参数字典, 各区域人数上报为 <区域id>_people"""
+    params = {
+        "people_count_in": {"value": event.count},
+        "people_count_out": {"value": 0},
+        "current_people": {"value": event.count}
+    }
+    for zone_id, _, count in event.zones:
+        params[f"{zone_id}_people"] = {"value": count}
+    return params
+
+
+class Subscription:
+    """订阅者: 有界队列加一个处理线程. 队列满时按策略处理新事件:
+    'drop' 丢弃新事件, 'drop_oldest' 丢弃最早的事件, 'block' 最多等待 block_timeout 秒后丢弃.
+    'block' 会让发布者等待, 串口和视频线程发布的事件不要使用"""
+
+    POLICIES = ('drop', 'drop_oldest', 'block')
+
+    def __init__(self, name, handler, maxsize=EVENT_QUEUE_SIZE, policy='drop', block_timeout=EVENT_BLOCK_TIMEOUT):
+        if policy not in self.POLICIES:
+            raise ValueError(f"未知的队列策略: {policy}")
+        self.name = name
+        self.handler = handler
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.queue = queue.Queue(maxsize)
+        self.dropped = metrics.counter('papt_event_dropped_total', '订阅者队列满时丢弃的事件数',
+                                       labels={'subscriber': name})
+        self.backlog = metrics.gauge('papt_event_backlog', '订阅者队列中待处理的事件数',
+                                     labels={'subscriber': name})
+        # 积压量在导出时读取队列长度, 不在每个事件上更新
+        self.backlog.set_function(self.queue.qsize)
+        self.thread = threading.Thread(target=self.run, name=f"event-{name}")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, event):
+        try:
+            if self.policy == 'block':
+                self.queue.put(event, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(event)
+        except queue.Full:
+            if self.policy != 'drop_oldest':
+                self.dropped.inc()
+                return
+            # 与处理线程竞争时重试一次, 仍然满则丢弃新事件
+            try:
+                self.queue.get_nowait()
+                self.dropped.inc()
+                self.queue.put_nowait(event)
+            except (queue.Empty, queue.Full):
+                self.dropped.inc()
+
+    def run(self):
+        while True:
+            event = self.queue.get()
+            if event is None:
+                break
+            try:
+                self.handler(event)
+            except Exception as e:
+                logging.error(f"事件处理错误({self.name}): {str(e)}")
+
+    def close(self, timeout=5):
+        """处理完队列中剩余的事件后退出; 处理线程卡住时最多等待 timeout 秒"""
+        deadline = time.monotonic() + timeout
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            logging.warning(f"订阅者 {self.name} 的队列一直是满的, 未处理完就关闭")
+            return
+        self.thread.join(timeout=max(0.0, deadline - time.monotonic()))
+
+
+class EventBus:
+    """进程内发布/订阅. 生产者只调用 publish, 每个订阅者在自己的线程中按自己的速度处理,
+    处理慢的订阅者只会积压或丢弃自己的事件, 不会阻塞生产者('block' 策略除外)和其他订阅者"""
+
+    def __init__(self):
+        self._routes = {}
+        self._subscriptions = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, event_types, handler, name, maxsize=EVENT_QUEUE_SIZE, policy='drop',
+                  block_timeout=EVENT_BLOCK_TIMEOUT):
+        subscription = Subscription(name, handler, maxsize, policy, block_timeout)
+        with self._lock:
+            self._subscriptions.append(subscription)
+            # 发布时只读取路由表, 订阅时整体替换, 发布无需加锁
+            routes = dict(self._routes)
+            for event_type in event_types:
+                routes[event_type] = routes.get(event_type, ()) + (subscription,)
+            self._routes = routes
+        return subscription
+
+    def publish(self, event):
+        EVENTS_PUBLISHED.inc()
+        for subscription in self._routes.get(type(event), ()):
+            subscription.put(event)
+
+    def close(self):
+        with self._lock:
+            subscriptions, self._subscriptions, self._routes = self._subscriptions, [], {}
+        for subscription in subscriptions:
+            subscription.close()
+
+
+def subscribe_consumers(bus, store, upload, push=None):
+    """接入主程序的订阅者: 存储、上报和Web状态.
+    发布者是串口和视频线程, 各订阅者都不等待: 存储队列很大, 只在写库长时间卡住时丢弃新事件
+    (计入 papt_event_dropped_total), 上报和Web状态积压时丢弃最早的事件"""
+    bus.subscribe((SensorReading, PeopleCount, ValveChange), store, 'storage',
+                  maxsize=STORAGE_QUEUE_SIZE, policy='drop')
+    bus.subscribe((SensorReading, PeopleCount), upload, 'uploader', policy='drop_oldest')
+    if push:
+        bus.subscribe((PeopleCount, ValveChange), push, 'web', policy='drop_oldest')
+
+
+class SensorPipeline:
+    """串口读数处理链, 在串口接收线程中逐帧调用: 计数并解析一帧, 更新最新读数和界面变量,
+    每一帧先做报警检查(不等合并窗口), 再把同一次采样的分帧合并后发布到事件总线.
+    主程序和 --bench-metrics 共用"""
+
+    def __init__(self, bus, alarm, display=None, on_ack=None):
+        self.alarm = alarm
+        # 界面变量(字段 -> 带 set 方法的变量), 可为空
+        self.display = display or {}
+        # 水闸命令确认帧的回调
+        self.on_ack = on_ack
+        self.device = ""
+        # 最近一次解析出的读数, 串口线程直接使用, 不读取Tk变量
+        self.reading = {'temp': 0.0, 'humi': 0.0, 'light': 0.0, 'pir': 0, 'gas': 0}
+        self.ingest = IngestCoalescer(lambda data: bus.publish(SensorReading(**data)))
+
+    def show(self, field, value):
+        var = self.display.get(field)
+        if var is not None:
+            var.set(value)
+
+    def handle_frame(self, frame, received_at=None):
+        """处理一个完整数据帧(含行尾); received_at 为接收时刻, 默认取当前时刻"""
+        if received_at is None:
+            received_at = time.perf_counter()
+        SERIAL_BYTES.inc(len(frame))
+        SERIAL_FRAMES.inc()
+        data = frame.strip()
+        try:
+            if not data:
+                return
+
+            # 解析数据
+            sensor_type = data[0]
+            changed = ()
+
+            if sensor_type == 'g':  # 光强
+                value = data[1:]
+                self.reading['light'] = float(value)
+                self.show('light', value)
+                changed = ('light',)
+
+            elif sensor_type == 'h':  # 人体红外
+                value = data[1:]
+                self.reading['pir'] = int(value)
+                self.show('pir', value)
+                changed = ('pir',)
+
+            elif sensor_type == 'y':  # 烟雾
+                value = data[1:]
+                self.reading['gas'] = int(value)
+                self.show('gas', value)
+                changed = ('gas',)
+
+            elif sensor_type == VALVE_ACK_PREFIX:  # 水闸命令确认
+                if self.on_ack:
+                    self.on_ack(data[1:])
+                return
+
+            elif sensor_type == 'w':  # 温湿度组合数据
+                try:
+                    # 分离温度和湿度数据
+                    temp_humi = data.split('&')
+                    if len(temp_humi) == 2:
+                        temp = temp_humi[0][1:]  # 去掉'w'
+                        humi = temp_humi[1][1:].rstrip('!')  # 去掉's'和'!'
+                        self.reading['temp'], self.reading['humi'] = float(temp), float(humi)
+                        self.show('temp', temp)
+                        self.show('humi', humi)
+                        changed = ('temp', 'humi')
+                except Exception as e:
+                    SERIAL_PARSE_ERRORS.inc()
+                    logging.error(f"温湿度数据解析错误: {str(e)}")
+
+            self.dispatch(received_at, changed)
+
+        except ValueError as e:
+            SERIAL_PARSE_ERRORS.inc()
+            logging.error(f"数据格式错误: {str(e)}")
+        except Exception as e:
+            SERIAL_PARSE_ERRORS.inc()
+            logging.error(f"数据处理错误: {str(e)}")
+
+    def dispatch(self, received_at, changed):
+        """报警检查后交给分帧合并, 触发报警时立即输出未合并完的记录"""
+        if not changed:
+            return
+        try:
+            data = dict(self.reading, device=self.device)
+            tripped = self.alarm.check(data, received_at, changed)
+            self.ingest.add(data, changed)
+            if tripped:
+                self.ingest.flush(data['device'])
+        except Exception as e:
+            logging.error(f"数据上报错误: {str(e)}")
+
+    def close(self):
+        self.ingest.close()
+
+
+def benchmark_event_bus(events=20000, slow_delay=0.001):
+    """一个处理很慢的订阅者和一个正常订阅者同时订阅时, 测量生产者发布每个事件的耗时"""
+    bus = EventBus()
+    handled = []
+    bus.subscribe((SensorReading,), handled.append, 'bench-fast', maxsize=events, policy='block')
+    bus.subscribe((SensorReading,), lambda event: time.sleep(slow_delay), 'bench-slow', policy='drop_oldest')
+    latencies = np.empty(events)
+    for i in range(events):
+        event = SensorReading('bench', None, 25.0, 50.0, 300.0, 0, i)
+        start = time.perf_counter()
+        bus.publish(event)
+        latencies[i] = time.perf_counter() - start
+    bus.close()
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1e6
+    print(f"发布 {events} 个事件: p50 {p50:.1f} us, p99 {p99:.1f} us, 最大 {latencies.max() * 1e6:.1f} us; "
+          f"正常订阅者处理 {len(handled)} 个")
+    return len(handled) == events
+
+
+def parse_time_filter(text, end_of_day=False):
+    """解析筛选日期, 只填日期时补全为当天起止时间, 格式错误时抛出 ValueError"""
+    text = (text or '').strip()
+    if not text:
+        return None
+    if len(text) == 10:
+        datetime.strptime(text, '%Y-%m-%d')
+        return text + (' 23:59:59' if end_of_day else ' 00:00:00')
+    datetime.strptime(text, '%Y-%m-%d %H:%M:%S')
+    return text
+
+
+def day_seconds(timestamp):
+    """'YYYY-MM-DD HH:MM:SS' 中的时间部分换算为当天秒数"""
+    return int(timestamp[11:13]) * 3600 + int(timestamp[14:16]) * 60 + int(timestamp[17:19])
+
+
+class ArchiveStore:
+    """传感器数据归档层: 按天存放的列式 NumPy 文件, 读取时使用内存映射"""
+
+    def __init__(self, root=ARCHIVE_DIR):
+        self.root = Path(root)
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def days(self):
+        """已归档的日期列表, 升序"""
+        if not self.root.is_dir():
+            return []
+        return sorted(p.name for p in self.root.iterdir()
+                      if p.is_dir() and len(p.name) == 10 and (p / 'meta.json').exists())
+
+    def load(self, day):
+        """以内存映射方式打开某天的全部通道, 返回 (通道字典, 元数据)"""
+        with self._lock:
+            if day not in self._cache:
+                path = self.root / day
+                meta = json.loads((path / 'meta.json').read_text(encoding='utf-8'))
+                cols = {name: np.load(path / f'{name}.npy', mmap_mode='r') for name, _ in ARCHIVE_COLUMNS}
+                self._cache[day] = (cols, meta)
+            return self._cache[day]
+
+    def devices(self):
+        """归档中出现过的设备名, 只读各天的 meta.json"""
+        names = set()
+        for day in self.days():
+            meta = json.loads((self.root / day / 'meta.json').read_text(encoding='utf-8'))
+            names.update(meta['devices'])
+        return names
+
+    def write_day(self, day, rows):
+        """把某天的行 (id, timestamp, temperature, humidity, light, pir, gas, device) 写入归档,
+        已有归档时合并并按 id 去重"""
+        devices = []
+        codes = {}
+        for row in rows:
+            name = row[7] or ''
+            if name not in codes:
+                codes[name] = len(devices)
+                devices.append(name)
+
+        def column(index, dtype, default):
+            return np.array([default if row[index] is None else row[index] for row in rows], dtype=dtype)
+
+        arrays = {
+            'id': column(0, np.int64, 0),
+            'offset': np.array([day_seconds(row[1]) for row in rows], dtype=np.uint32),
+            'temperature': column(2, np.float32, np.nan),
+            'humidity': column(3, np.float32, np.nan),
+            'light': column(4, np.float32, np.nan),
+            'pir': column(5, np.int8, 0),
+            'gas': column(6, np.int32, 0),
+            'device': np.array([codes[row[7] or ''] for row in rows], dtype=np.uint16),
+        }
+
+        path = self.root / day
+        if (path / 'meta.json').exists():
+            old_cols, old_meta = self.load(day)
+            old = {name: np.array(old_cols[name]) for name, _ in ARCHIVE_COLUMNS}
+            for name in old_meta['devices']:
+                if name not in codes:
+                    codes[name] = len(devices)
+                    devices.append(name)
+            remap = np.array([codes[name] for name in old_meta['devices']], dtype=np.uint16)
+            old['device'] = remap[old['device']] if len(remap) else old['device']
+            arrays = {name: np.concatenate([old[name], arrays[name]]) for name, _ in ARCHIVE_COLUMNS}
+
+        # 按 id 去重后按 (offset, id) 排序
+        _, unique = np.unique(arrays['id'], return_index=True)
+        order = unique[np.lexsort((arrays['id'][unique], arrays['offset'][unique]))]
+        arrays = {name: arrays[name][order].astype(dtype) for name, dtype in ARCHIVE_COLUMNS}
+
+        tmp = self.root / f'{day}.tmp'
+        if tmp.exists():
+            shutil.rmtree(tmp)
+        tmp.mkdir(parents=True)
+        for name, _ in ARCHIVE_COLUMNS:
+            np.save(tmp / f'{name}.npy', arrays[name])
+        meta = {'date': day, 'rows': int(len(arrays['id'])), 'devices': devices}
+        (tmp / 'meta.json').write_text(json.dumps(meta, ensure_ascii=False), encoding='utf-8')
+
+        with self._lock:
+            self._cache.pop(day, None)
+            if path.exists():
+                shutil.rmtree(path)
+            os.replace(tmp, path)
+
+    def archive_older_than(self, db_path=DB_PATH, retention_days=ARCHIVE_RETENTION_DAYS):
+        """把早于保留天数的整天数据移出 SQLite, 返回归档行数"""
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=retention_days)).strftime('%Y-%m-%d')
+        archived = 0
+        conn = sqlite3.connect(db_path, timeout=30)
+        try:
+            while True:
+                oldest = conn.execute("SELECT MIN(timestamp) FROM sensor_data").fetchone()[0]
+                if not oldest or oldest[:10] >= cutoff:
+                    break
+                day = oldest[:10]
+                next_day = (datetime.strptime(day, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+                rows = conn.execute('''
+                    SELECT id, timestamp, temperature, humidity, light, pir, gas, device
+                    FROM sensor_data
+                    WHERE timestamp >= ? AND timestamp < ?
+                    ORDER BY timestamp, id
+                ''', (day, next_day)).fetchall()
+                self.write_day(day, rows)
+                conn.execute("DELETE FROM sensor_data WHERE timestamp >= ? AND timestamp < ?", (day, next_day))
+                conn.commit()
+                archived += len(rows)
+                logging.info(f"已归档 {day} 的传感器数据 {len(rows)} 条")
+        finally:
+            conn.close()
+        return archived
+
+    def select(self, day, filters, direction=None, key=None):
+        """某天满足筛选条件和分页键的行号, 升序"""
+        cols, meta = self.load(day)
+        offsets = cols['offset']
+        lo, hi = 0, len(offsets)
+        start, end = filters.get('start'), filters.get('end')
+        if start and start[:10] == day:
+            lo = max(lo, int(np.searchsorted(offsets, day_seconds(start), 'left')))
+        if end and end[:10] == day:
+            hi = min(hi, int(np.searchsorted(offsets, day_seconds(end), 'right')))
+        if key and key[0][:10] == day:
+            # 时间相同的行按 id 比较
+            seconds = day_seconds(key[0])
+            left = int(np.searchsorted(offsets, seconds, 'left'))
+            right = int(np.searchsorted(offsets, seconds, 'right'))
+            if direction == 'older':
+                hi = min(hi, left + int(np.searchsorted(cols['id'][left:right], key[1], 'left')))
+            else:
+                lo = max(lo, left + int(np.searchsorted(cols['id'][left:right], key[1], 'right')))
+        index = np.arange(lo, max(lo, hi))
+        device = filters.get('device')
+        if device:
+            if device not in meta['devices']:
+                return index[:0]
+            index = index[np.asarray(cols['device'][lo:max(lo, hi)]) == meta['devices'].index(device)]
+        return index
+
+    def rows(self, day, index, fields):
+        """按行号取出指定字段, 返回 (id, 字段...) 元组列表"""
+        cols, meta = self.load(day)
+        values = []
+        for field in fields:
+            if field == 'timestamp':
+                stamps = np.datetime64(day, 's') + cols['offset'][index].astype('timedelta64[s]')
+                values.append([text.replace('T', ' ') for text in np.datetime_as_string(stamps, unit='s')])
+            elif field == 'device':
+                values.append([meta['devices'][code] for code in cols['device'][index]])
+            elif cols[field].dtype == np.float32:
+                values.append(np.round(cols[field][index].astype(np.float64), 4).tolist())
+            else:
+                values.append(cols[field][index].tolist())
+        return list(zip(cols['id'][index].tolist(), *values))
+
+    def page(self, filters, direction, key, limit, fields):
+        """键集分页, 'older' 按时间倒序, 'newer' 按时间正序返回"""
+        start, end = filters.get('start'), filters.get('end')
+        days = [day for day in self.days()
+                if (not start or day >= start[:10]) and (not end or day <= end[:10])]
+        if direction == 'older':
+            days = [day for day in days if not key or day <= key[0][:10]]
+            days.reverse()
+        else:
+            days = [day for day in days if not key or day >= key[0][:10]]
+
+        result = []
+        for day in days:
+            index = self.select(day, filters, direction, key)
+            if direction == 'older':
+                index = index[::-1]
+            result.extend(self.rows(day, index[:limit - len(result)], fields))
+            if len(result) >= limit:
+                break
+        return result
+
+    def load_range(self, start, end, device=None, channels=SENSOR_CHANNELS):
+        """读取时间范围内的归档数据, 返回 (UTC秒时间戳数组, {通道: float64数组})"""
+        filters = {'start': start, 'end': end, 'device': device}
+        times, values = [], {channel: [] for channel in channels}
+        for day in self.days():
+            if (start and day < start[:10]) or (end and day > end[:10]):
+                continue
+            cols, _ = self.load(day)
+            index = self.select(day, filters)
+            day_epoch = int(np.datetime64(day, 's').astype(np.int64))
+            times.append(cols['offset'][index].astype(np.int64) + day_epoch)
+            for channel in channels:
+                values[channel].append(cols[channel][index].astype(np.float64))
+        if not times:
+            return np.empty(0, np.int64), {channel: np.empty(0) for channel in channels}
+        return np.concatenate(times), {channel: np.concatenate(values[channel]) for channel in channels}
+
+    def iter_rows(self, start, end, fields, chunk_size=EXPORT_CHUNK_SIZE):
+        """按时间正序分块遍历时间范围内的归档行(不含 id)"""
+        filters = {'start': start, 'end': end}
+        for day in self.days():
+            if (start and day < start[:10]) or (end and day > end[:10]):
+                continue
+            index = self.select(day, filters)
+            for i in range(0, len(index), chunk_size):
+                yield [row[1:] for row in self.rows(day, index[i:i + chunk_size], fields)]
+
+
+archive = ArchiveStore()
+
+
+def fetch_numeric(cursor, width, count, chunk_size=FETCH_CHUNK_SIZE, dtype=np.float64):
+    """把只含数值列的查询结果用 fetchmany 分块写入预分配的 (count, width) 数组, NULL 读为 nan"""
+    out = np.empty((count, width), dtype)
+    filled = 0
+    while filled < count:
+        rows = cursor.fetchmany(min(chunk_size, count - filled))
+        if not rows:
+            break
+        out[filled:filled + len(rows)] = rows
+        filled += len(rows)
+    return out[:filled]
+
+
+def query_numeric(conn, columns, table, where, params, order, dtype=np.float64):
+    """先计数再读取, 在同一个读事务中执行, 保证计数与结果一致"""
+    sql_where = f" WHERE {' AND '.join(where)}" if where else ""
+    conn.execute("BEGIN")
+    try:
+        count = conn.execute(f"SELECT COUNT(*) FROM {table}{sql_where}", params).fetchone()[0]
+        cursor = conn.execute(f"SELECT {', '.join(columns)} FROM {table}{sql_where} ORDER BY {order}", params)
+        return fetch_numeric(cursor, len(columns), count, dtype=dtype)
+    finally:
+        conn.execute("COMMIT")
+
+
+def to_epoch(text):
+    """UTC 'YYYY-MM-DD HH:MM:SS' 转为秒时间戳"""
+    return int(np.datetime64(text, 's').astype(np.int64))
+
+
+def utc_text(seconds=None):
+    """秒时间戳(默认当前时刻)转为 UTC 'YYYY-MM-DD HH:MM:SS', 与 SQLite CURRENT_TIMESTAMP 的格式和时区相同"""
+    moment = datetime.now(timezone.utc) if seconds is None else datetime.fromtimestamp(seconds, timezone.utc)
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+class SensorSeriesCache:
+    """Web进程内缓存数据库(热层)中传感器数据的数值数组, 按 (数据库, 设备) 缓存全部通道.
+    首次查询读取所需的时间范围, 之后只读取 id 更大的新行追加, 查询更早的时间时向前补读;
+    归档线程把旧数据移出数据库后, 丢弃缓存中早于数据库最早记录的部分(这部分改从归档读取).
+    读数按 float32 保存(与归档相同), 时间为 UTC 秒. 总大小超过 max_bytes 时先淘汰最久未用的条目,
+    仍超出时当前条目只保留最新的部分, 更早的时间下次查询时重新读取"""
+
+    EPOCH = "CAST(strftime('%s', timestamp) AS INTEGER)"
+
+    def __init__(self, channels=SENSOR_CHANNELS, max_bytes=SERIES_CACHE_MAX_BYTES):
+        self.channels = channels
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _read(self, conn, where, params, order='timestamp, id'):
+        rows = query_numeric(conn, ('id', self.EPOCH) + self.channels, 'sensor_data', where, params, order)
+        return rows[:, 0].astype(np.int64), rows[:, 1].astype(np.int64), rows[:, 2:].astype(np.float32)
+
+    def get(self, start, end, device=None, db_path=DB_PATH):
+        """返回 start~end(文本, 可为 None)内的 (时间数组, {通道: float64数组})"""
+        key = (db_path, device)
+        device_where, device_params = (["device = ?"], [device]) if device else ([], [])
+        with self._lock:
+            conn = connect_readonly(db_path)
+            try:
+                entry = self.entries.get(key)
+                if entry is None or (entry['since'] and (not start or start < entry['since'])):
+                    # 首次读取或向前补读: 只读已缓存的最大 id 之前的行, 之后的行由追加步骤读取
+                    where, params = list(device_where), list(device_params)
+                    if start:
+                        where.append("timestamp >= ?")
+                        params.append(start)
+                    if entry is not None:
+                        where += ["timestamp < ?", "id <= ?"]
+                        params += [entry['since'], entry['last_id']]
+                    ids, times, data = self._read(conn, where, params)
+                    if entry is None:
+                        entry = {'last_id': int(ids.max()) if len(ids) else 0}
+                        entry.update(times=times, data=data)
+                    else:
+                        entry['times'] = np.concatenate([times, entry['times']])
+                        entry['data'] = np.concatenate([data, entry['data']])
+                    entry['since'] = start
+                    self.entries[key] = entry
+
+                # 追加新写入的行: 按 id 范围查询和排序, 不按时间过滤或排序, 以免扫描整个时间索引;
+                # 合并记录的时间可能早于已缓存的最后一行, 此时重新排序
+                ids, times, data = self._read(conn, device_where + ["id > ?"], device_params + [entry['last_id']], 'id')
+                if len(ids):
+                    entry['last_id'] = int(ids.max())
+                    if entry['since']:
+                        keep = times >= to_epoch(entry['since'])
+                        times, data = times[keep], data[keep]
+                    late = len(times) and (np.any(np.diff(times) < 0) or
+                                           len(entry['times']) and times[0] < entry['times'][-1])
+                    entry['times'] = np.concatenate([entry['times'], times])
+                    entry['data'] = np.concatenate([entry['data'], data])
+                    if late:
+                        order = np.argsort(entry['times'], kind='stable')
+                        entry['times'], entry['data'] = entry['times'][order], entry['data'][order]
+
+                # 已归档(不在数据库中)的数据从缓存中去掉
+                oldest = conn.execute("SELECT MIN(timestamp) FROM sensor_data").fetchone()[0]
+            finally:
+                conn.close()
+            times, data = entry['times'], entry['data']
+            cut = np.searchsorted(times, to_epoch(oldest), 'left') if oldest else len(times)
+            if cut:
+                entry['times'], entry['data'] = times, data = times[cut:], data[cut:]
+            self.entries.move_to_end(key)
+            self._shrink(key)
+
+        lo = np.searchsorted(times, to_epoch(start), 'left') if start else 0
+        hi = np.searchsorted(times, to_epoch(end), 'right') if end else len(times)
+        return times[lo:hi], {channel: data[lo:hi, i].astype(np.float64) for i, channel in enumerate(self.channels)}
+
+    @staticmethod
+    def _size(entry):
+        return entry['times'].nbytes + entry['data'].nbytes
+
+    def _shrink(self, key):
+        """超出 max_bytes 时淘汰最久未用的其他条目, 仍超出时把 key 的条目截为最新的部分. 调用方持有 self._lock"""
+        total = sum(self._size(entry) for entry in self.entries.values())
+        while total > self.max_bytes and len(self.entries) > 1:
+            _, entry = self.entries.popitem(last=False)
+            total -= self._size(entry)
+            SERIES_CACHE_EVICTIONS.inc()
+        entry = self.entries[key]
+        if total > self.max_bytes:
+            SERIES_CACHE_EVICTIONS.inc()
+            times = entry['times']
+            row_bytes = self._size(entry) // len(times)
+            # 在整秒处截断, 使 since 之后的行都在缓存中; 复制出新数组, 释放原来的整块内存
+            keep = self.max_bytes // row_bytes
+            cut = np.searchsorted(times, times[-keep], 'right') if keep else len(times)
+            if cut >= len(times):
+                del self.entries[key]
+                total = 0
+            else:
+                entry['since'] = utc_text(int(times[cut]))
+                entry['times'], entry['data'] = times[cut:].copy(), entry['data'][cut:].copy()
+                total = self._size(entry)
+        SERIES_CACHE_BYTES.set(total)
+
+
+sensor_series_cache = SensorSeriesCache()
+
+
+def load_sensor_series(start, end, device=None, channels=SENSOR_CHANNELS, db_path=DB_PATH):
+    """读取时间范围内归档和数据库中的传感器数据, 返回按时间排序的 (UTC秒时间戳数组, {通道: float64数组});
+    数据库部分由 sensor_series_cache 增量缓存"""
+    archive_times, archive_values = archive.load_range(start, end, device, channels)
+    times, values = sensor_series_cache.get(start, end, device, db_path)
+    return (np.concatenate([archive_times, times]),
+            {channel: np.concatenate([archive_values[channel], values[channel]]) for channel in channels})
+
+
+def load_series(channel, start, end, device=None, db_path=DB_PATH):
+    """读取单个通道的历史数据, 返回按时间排序的 (UTC秒时间戳数组, float64数组); people 通道读取人流量记录"""
+    if channel != 'people':
+        times, values = load_sensor_series(start, end, device, (channel,), db_path)
+        return times, values[channel]
+
+    where, params = [], []
+    if start:
+        where.append("timestamp >= ?")
+        params.append(start)
+    if end:
+        where.append("timestamp <= ?")
+        params.append(end)
+    conn = connect_readonly(db_path)
+    try:
+        rows = query_numeric(conn, (SensorSeriesCache.EPOCH, 'count'), 'people_flow', where, params, 'timestamp, id')
+    finally:
+        conn.close()
+    return rows[:, 0].astype(np.int64), rows[:, 1]
+
+
+def align_series_range(start, end, points):
+    """把 start 向下, end(缺省为当前时刻) 向上对齐到一个输出点的时间宽度 ceil((end-start)/points) 秒,
+    同一时间段内先后到达的请求得到相同的范围, 可以共用 series_cache 中的结果. 网页端按相同规则对齐"""
+    if not start:
+        return start, end
+    start_epoch = to_epoch(start)
+    end_epoch = to_epoch(end) if end else int(time.time())
+    bucket = max(1, -(-(end_epoch - start_epoch) // points))
+    start_epoch -= start_epoch % bucket
+    end_epoch += -end_epoch % bucket
+    return utc_text(start_epoch), utc_text(end_epoch)
+
+
+def lttb(times, values, threshold):
+    """Largest-Triangle-Three-Buckets 降采样, 返回保留点的下标.
+    首尾点固定保留, 其余点均分为 threshold - 2 个桶, 每桶取与上一桶所选点和下一桶均值构成三角形面积最大的点.
+    桶边界和各桶均值一次算出, 逐桶只做数组运算"""
+    n = len(values)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = (times - times[0]).astype(np.float64)
+    y = values.astype(np.float64)
+
+    # 内部点 [1, n - 1) 均分为 threshold - 2 个桶, 最后加上末点单独成桶
+    edges = np.empty(threshold, np.int64)
+    edges[:-1] = 1 + np.floor(np.arange(threshold - 1) * ((n - 2) / (threshold - 2))).astype(np.int64)
+    edges[-1] = n
+    sizes = np.diff(edges)
+    mean_x = np.add.reduceat(x, edges[:-1]) / sizes
+    mean_y = np.add.reduceat(y, edges[:-1]) / sizes
+
+    selected = np.empty(threshold, np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        ax, ay = x[a], y[a]
+        cx, cy = mean_x[i + 1], mean_y[i + 1]
+        area = np.abs((ax - cx) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (cy - ay))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def benchmark_lttb(points=10_000_000, threshold=1000):
+    """测量 LTTB 降采样耗时"""
+    times = np.arange(points, dtype=np.int64)
+    values = np.cumsum(np.random.default_rng(0).standard_normal(points))
+    start = time.perf_counter()
+    lttb(times, values, threshold)
+    elapsed = time.perf_counter() - start
+    print(f"LTTB: {points} 点降至 {threshold} 点, 耗时 {elapsed * 1000:.1f} ms")
+    return elapsed
+
+
+def sliding_reduce(array, width, func):
+    """result[i] = func(array[i:i + width]), 倍增法, 复杂度 O(n log width)"""
+    table = array
+    span = 1
+    while span * 2 <= width:
+        table = func(table[:-span], table[span:])
+        span *= 2
+    # table[i] 为 array[i:i + span] 的归约结果, 两段重叠覆盖整个窗口
+    count = len(array) - width + 1
+    return func(table[:count], table[width - span:width - span + count])
+
+
+def window_percentile(times, values, starts, ends, q):
+    """各窗口 (starts[i], ends[i]] 内样本的精确百分位数, 与 np.percentile 默认的线性插值定义相同.
+    样本按时间排序, 每个窗口是一段连续下标, 用 np.partition 只取相邻的两个次序统计量"""
+    first = np.searchsorted(times, starts, 'right')
+    last = np.searchsorted(times, ends, 'right')
+    result = np.full(len(ends), np.nan)
+    for i in np.flatnonzero(last > first):
+        samples = values[first[i]:last[i]]
+        rank = q / 100 * (len(samples) - 1)
+        k = int(rank)
+        if k + 1 < len(samples):
+            part = np.partition(samples, (k, k + 1))
+            result[i] = part[k] + (rank - k) * (part[k + 1] - part[k])
+        else:
+            result[i] = samples.max()
+    return result
+
+
+def rolling_stats(times, values, start, end, window, step):
+    """滚动窗口统计. 窗口结束时刻从 start+step 起每隔 step 秒一个, 覆盖 (结束时刻-window, 结束时刻],
+    最后一个窗口的结束时刻截止到 end. 样本先按 gcd(window, step) 秒分组聚合, 再在分组上滑动.
+    p95 与 np.percentile 相同(次序统计量之间线性插值); 窗口内样本总数超过 STATS_P95_EXACT_SAMPLES
+    或窗口数超过 STATS_P95_EXACT_WINDOWS 时改为分组直方图插值的近似值, 误差不超过一个直方图桶宽.
+    返回 (窗口结束时刻数组, 样本数数组, {通道: {统计量: 数组}}, p95 是否精确)"""
+    grain = math.gcd(window, step)
+    per_window, per_step = window // grain, step // grain
+    ends = np.arange(start + step, end + step, step, dtype=np.int64)
+    n_bins = (len(ends) - 1) * per_step + per_window
+    if n_bins * 16 > STATS_BLOCK_CELLS:
+        raise ValueError("时间范围相对 gcd(window, step) 过大")
+
+    # 每个样本所属分组, 分组 j 覆盖 (origin + j*grain, origin + (j+1)*grain]; 不取 end 之后的样本
+    origin = start + step - window
+    lo = np.searchsorted(times, origin, 'right')
+    hi = np.searchsorted(times, min(origin + n_bins * grain, end), 'right')
+    bins = (times[lo:hi] - origin - 1) // grain
+    firsts = np.arange(len(ends)) * per_step
+    starts, ends = ends - window, np.minimum(ends, end)
+
+    def windowed(per_bin):
+        """分组值按窗口求和"""
+        cumulative = np.concatenate([np.zeros((1,) + per_bin.shape[1:], per_bin.dtype), np.cumsum(per_bin, axis=0)])
+        return cumulative[firsts + per_window] - cumulative[firsts]
+
+    counts = windowed(np.bincount(bins, minlength=n_bins))
+    exact = (len(ends) <= STATS_P95_EXACT_WINDOWS and
+             counts.sum() <= STATS_P95_EXACT_SAMPLES)
+    stats = {}
+    for channel, data in values.items():
+        data = data[lo:hi]
+        valid = ~np.isnan(data)
+        if valid.all():
+            b, v, t = bins, data, times[lo:hi]
+        else:
+            b, v, t = bins[valid], data[valid], times[lo:hi][valid]
+        n = windowed(np.bincount(b, minlength=n_bins))
+
+        # 均值和标准差: 减去整体均值后按分组累加, 降低累加误差
+        shift = v.mean() if len(v) else 0.0
+        centered = v - shift
+        sums = windowed(np.bincount(b, weights=centered, minlength=n_bins))
+        squares = windowed(np.bincount(b, weights=centered * centered, minlength=n_bins))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = sums / n
+            std = np.sqrt(np.maximum(squares / n - mean * mean, 0.0))
+        mean = mean + shift
+
+        if not len(v):
+            empty = np.full(len(ends), np.nan)
+            stats[channel] = {'mean': mean, 'min': empty, 'max': empty.copy(), 'std': std, 'p95': empty.copy()}
+            continue
+
+        # 最小值和最大值: 分组极值再滑动归约
+        bin_min = np.full(n_bins, np.inf)
+        bin_max = np.full(n_bins, -np.inf)
+        np.minimum.at(bin_min, b, v)
+        np.maximum.at(bin_max, b, v)
+        minimum = sliding_reduce(bin_min, per_window, np.minimum)[firsts]
+        maximum = sliding_reduce(bin_max, per_window, np.maximum)[firsts]
+
+        if exact:
+            stats[channel] = {
+                'mean': mean,
+                'min': np.where(n > 0, minimum, np.nan),
+                'max': np.where(n > 0, maximum, np.nan),
+                'std': std,
+                'p95': window_percentile(t, v, starts, ends, 95),
+            }
+            continue
+
+        # 近似 p95: 每个分组一个取值直方图, 按窗口累加后在桶内线性插值
+        n_buckets = int(min(256, max(16, STATS_BLOCK_CELLS // n_bins)))
+        low, high = v.min(), v.max()
+        width = (high - low) / n_buckets
+        if width > 0:
+            bucket = np.minimum(((v - low) / width).astype(np.int64), n_buckets - 1)
+        else:
+            bucket = np.zeros(len(v), np.int64)
+        histogram = np.bincount(b * n_buckets + bucket, minlength=n_bins * n_buckets).astype(np.int32)
+        histogram = histogram.reshape(n_bins, n_buckets)
+        window_hist = np.cumsum(windowed(histogram), axis=1)
+        rank = 0.95 * np.maximum(n - 1, 0)
+        position = np.minimum((window_hist <= rank[:, None]).sum(axis=1), n_buckets - 1)
+        rows = np.arange(len(ends))
+        below = np.where(position > 0, window_hist[rows, position - 1], 0)
+        in_bucket = window_hist[rows, position] - below
+        with np.errstate(invalid='ignore', divide='ignore'):
+            frac = np.where(in_bucket > 0, (rank - below + 0.5) / in_bucket, 0.5)
+        p95 = np.clip(low + (position + frac) * width, minimum, maximum)
+
+        has_data = n > 0
+        stats[channel] = {
+            'mean': mean,
+            'min': np.where(has_data, minimum, np.nan),
+            'max': np.where(has_data, maximum, np.nan),
+            'std': std,
+            'p95': np.where(has_data, p95, np.nan),
+        }
+    return ends, counts, stats, exact
+
+
+class StatsCache:
+    """统计结果LRU缓存, 新数据到达时清除覆盖该时刻的条目"""
+
+    def __init__(self, maxsize=STATS_CACHE_SIZE, refresh_interval=STATS_REFRESH_INTERVAL):
+        self.maxsize = maxsize
+        self.refresh_interval = refresh_interval
+        self.last_update = None
+        # 键 -> [结果, 写入时刻, 是否已过期]
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """已过期的条目在写入后 refresh_interval 秒内仍然返回, 避免每秒一条的新数据让缓存失效"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, put_at, stale = entry
+            if stale and time.monotonic() - put_at >= self.refresh_interval:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = [value, time.monotonic(), False]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def observe_update(self, timestamp):
+        """主进程最近一次写入传感器数据的时间变化时标记受影响的条目"""
+        if timestamp and timestamp != self.last_update:
+            self.last_update = timestamp
+            self.invalidate(timestamp)
+
+    def invalidate(self, timestamp):
+        """标记结束时间不早于 timestamp (或未指定结束时间) 的条目已过期, 键的第二项为结束时间"""
+        with self._lock:
+            for key, entry in self._entries.items():
+                if key[1] is None or key[1] >= timestamp:
+                    entry[2] = True
+
+
+stats_cache = StatsCache()
+series_cache = StatsCache()
+
+
+class HistoryQuery:
+    """历史数据键集分页查询, 以 (timestamp, id) 为键翻页"""
+
+    def __init__(self, table, fields, has_device=False):
+        self.table = table
+        self.fields = fields
+        self.has_device = has_device
+
+    def build(self, filters, direction, key, limit):
+        """生成查询语句. direction 为 'older' 时向更早翻页, 'newer' 时向更新翻页"""
+        where, params = [], []
+        if filters.get('start'):
+            where.append("timestamp >= ?")
+            params.append(filters['start'])
+        if filters.get('end'):
+            where.append("timestamp <= ?")
+            params.append(filters['end'])
+        if self.has_device and filters.get('device'):
+            where.append("device = ?")
+            params.append(filters['device'])
+
+        if direction == 'newer':
+            order = 'ASC'
+            if key:
+                where.append("(timestamp, id) > (?, ?)")
+                params.extend(key)
+        else:
+            order = 'DESC'
+            if key:
+                where.append("(timestamp, id) < (?, ?)")
+                params.extend(key)
+
+        sql = f"SELECT id, {', '.join(self.fields)} FROM {self.table}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY timestamp {order}, id {order} LIMIT ?"
+        params.append(limit)
+        return sql, params
+
+    def page(self, conn, filters, direction, key, limit):
+        """查询一页数据, 按翻页方向排序"""
+        sql, params = self.build(filters, direction, key, limit)
+        return conn.execute(sql, params).fetchall()
+
+    def fetch(self, conn, filters, direction, key, limit=HISTORY_PAGE_SIZE):
+        """查询一页数据, 结果始终按时间倒序排列"""
+        rows = self.page(conn, filters, direction, key, limit)
+        if direction == 'newer':
+            rows.reverse()
+        return rows
+
+
+class TieredHistoryQuery(HistoryQuery):
+    """同时覆盖 SQLite 近期数据和归档数据的分页查询, 归档数据都早于 SQLite 中的数据"""
+
+    def __init__(self, table, fields, archive, has_device=False):
+        super().__init__(table, fields, has_device)
+        self.archive = archive
+
+    def page(self, conn, filters, direction, key, limit):
+        if direction == 'older':
+            rows = super().page(conn, filters, direction, key, limit)
+            if len(rows) < limit:
+                last = (rows[-1][1], rows[-1][0]) if rows else key
+                rows += self.archive.page(filters, direction, last, limit - len(rows), self.fields)
+        else:
+            rows = self.archive.page(filters, direction, key, limit, self.fields)
+            if len(rows) < limit:
+                last = (rows[-1][1], rows[-1][0]) if rows else key
+                rows += super().page(conn, filters, direction, last, limit - len(rows))
+        return rows
+
+
+def history_devices(db_path=DB_PATH, archive=None):
+    """历史数据中出现过的设备名, 按名称排序.
+    沿 (device, timestamp, id) 索引逐个跳到下一个设备, 查询次数只与设备数有关"""
+    names = set(archive.devices()) if archive is not None else set()
+    conn = connect_readonly(db_path)
+    try:
+        device = ''
+        while True:
+            device = conn.execute("SELECT MIN(device) FROM sensor_data WHERE device > ?", (device,)).fetchone()[0]
+            if device is None:
+                break
+            names.add(device)
+    finally:
+        conn.close()
+    names.discard('')
+    return sorted(names)
+
+
+class HistoryQueryWorker(threading.Thread):
+    """历史数据查询线程, 使用只读连接, 结果放入队列由Tk主线程取出"""
+
+    def __init__(self, db_path=DB_PATH):
+        super().__init__()
+        self.daemon = True
+        self.db_path = db_path
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+
+    def submit(self, view, generation, direction, key):
+        self.requests.put((view, generation, direction, key))
+
+    def stop(self):
+        self.requests.put(None)
+
+    def run(self):
+        conn = connect_readonly(self.db_path)
+        try:
+            while True:
+                request = self.requests.get()
+                if request is None:
+                    break
+                view, generation, direction, key = request
+                try:
+                    rows = view.query.fetch(conn, view.filters, direction, key)
+                    self.results.put((view, generation, direction, rows, None))
+                except Exception as e:
+                    self.results.put((view, generation, direction, [], e))
+        finally:
+            conn.close()
+
+
+class HistoryView:
+    """历史数据表格, 滚动到两端时按需加载, 表格内只保留有限行数"""
+
+    def __init__(self, parent, worker, query, columns, width):
+        self.worker = worker
+        self.query = query
+        self.filters = {}
+        self.generation = 0
+        self.loading = False
+        self.has_older = False
+        self.has_newer = False
+        self.keys = {}
+
+        self.tree = ttk.Treeview(parent, columns=columns, show="headings")
+        for col in columns:
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=width)
+
+        self.scrollbar = ttk.Scrollbar(parent, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self.on_scroll)
+
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+    def reset(self, filters):
+        """按新的筛选条件从最新数据重新加载"""
+        self.filters = filters
+        self.generation += 1
+        self.tree.delete(*self.tree.get_children())
+        self.keys.clear()
+        self.has_older = False
+        self.has_newer = False
+        self.request('older', None)
+
+    def request(self, direction, key):
+        self.loading = True
+        self.worker.submit(self, self.generation, direction, key)
+
+    def on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if self.loading:
+            return
+        children = self.tree.get_children()
+        if not children:
+            return
+        if float(last) >= 0.95 and self.has_older:
+            self.request('older', self.keys[children[-1]])
+        elif float(first) <= 0.05 and self.has_newer:
+            self.request('newer', self.keys[children[0]])
+
+    def apply(self, generation, direction, rows):
+        """在Tk主线程中把查询结果写入表格"""
+        if generation != self.generation:
+            return
+        self.loading = False
+
+        children = self.tree.get_children()
+        total = len(children)
+        first_visible = int(self.tree.yview()[0] * total) if total else 0
+
+        if direction == 'older':
+            for row in rows:
+                self.insert(tk.END, row)
+            self.has_older = len(rows) >= HISTORY_PAGE_SIZE
+            trimmed = self.trim(from_top=True)
+            first_visible -= trimmed
+        else:
+            for row in reversed(rows):
+                self.insert(0, row)
+            self.has_newer = len(rows) >= HISTORY_PAGE_SIZE
+            self.trim(from_top=False)
+            first_visible += len(rows)
+
+        # 插入或裁剪后保持当前可见位置不跳动
+        total = len(self.tree.get_children())
+        if total and first_visible > 0:
+            self.tree.yview_moveto(first_visible / total)
+
+    def insert(self, index, row):
+        iid = str(row[0])
+        if self.tree.exists(iid):
+            return
+        self.tree.insert("", index, iid=iid, values=row[1:])
+        self.keys[iid] = (row[1], row[0])
+
+    def trim(self, from_top):
+        """表格超出最大行数时从一端裁剪, 返回裁剪行数"""
+        children = self.tree.get_children()
+        excess = len(children) - HISTORY_MAX_ROWS
+        if excess <= 0:
+            return 0
+        removed = children[:excess] if from_top else children[-excess:]
+        self.tree.delete(*removed)
+        for iid in removed:
+            del self.keys[iid]
+        if from_top:
+            self.has_newer = True
+        else:
+            self.has_older = True
+        return excess
+
+
+def init_database(conn):
+    """创建数据表和索引, 旧数据库补充新增的列; 主程序和压测共用"""
+    cursor = conn.cursor()
+    
+    # WAL模式下Web进程的只读查询不阻塞写入
+    cursor.execute("PRAGMA journal_mode=WAL")
+    
+    # 创建传感器数据表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sensor_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            temperature REAL,
+            humidity REAL,
+            light REAL,
+            pir INTEGER,
+            gas INTEGER,
+            device TEXT
+        )
+    ''')
+    
+    # 旧数据库补充设备列
+    cursor.execute("PRAGMA table_info(sensor_data)")
+    if 'device' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE sensor_data ADD COLUMN device TEXT")
+    
+    # 创建水闸操作记录表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS valve_operations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            operation TEXT,
+            mode TEXT,
+            operator TEXT
+        )
+    ''')
+    
+    # 创建用户操作记录表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_operations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            operation TEXT,
+            details TEXT
+        )
+    ''')
+    
+    # 创建人流量记录表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS people_flow (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            count INTEGER
+        )
+    ''')
+    
+    # 创建区域人数记录表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS zone_counts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            camera INTEGER,
+            zone TEXT,
+            count INTEGER
+        )
+    ''')
+    
+    # 历史数据按时间分页查询所用索引
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sensor_data_time ON sensor_data (timestamp, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sensor_data_device_time ON sensor_data (device, timestamp, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_valve_operations_time ON valve_operations (timestamp, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_operations_time ON user_operations (timestamp, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_people_flow_time ON people_flow (timestamp, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_zone_counts_time ON zone_counts (zone, timestamp, id)")
+    
+    conn.commit()
+
+
+SENSOR_INSERT_SQL = '''
+    INSERT INTO sensor_data (timestamp, temperature, humidity, light, pir, gas, device)
+    VALUES (COALESCE(?, CURRENT_TIMESTAMP), ?, ?, ?, ?, ?, ?)
+'''
+
+
+def sensor_row(data, device=None):
+    """传感器读数转为 SENSOR_INSERT_SQL 的参数, 读数中没有设备时使用 device"""
+    return (
+        data.get('timestamp'),
+        float(data['temp']),
+        float(data['humi']),
+        float(data['light']),
+        int(data['pir']),
+        int(data['gas']),
+        data.get('device') or device
+    )
+
+
+class SmartMonitorSystem:
+    def __init__(self, root, video_source=CAMERA_INDEX):
+        self.root = root
+        # 视频帧源: 摄像头编号、视频文件、图片目录或 synthetic
+        self.video_source = video_source
+        self.root.title("智能室内消防报警系统")
+        self.root.geometry("1200x900")
+        
+        # 初始化数据库
+        self.init_database()
+        
+        # OneNet上报待发送队列
+        self.outbox = OnenetOutbox()
+        self.outbox.start()
+        
+        # 启动数据归档线程
+        self.retention_thread = threading.Thread(target=self.run_retention)
+        self.retention_thread.daemon = True
+        self.retention_thread.start()
+        
+        # 初始化变量
+        self.init_variables()
+        
+        # 创建界面
+        self.create_gui()
+        
+        # 初始化串口和视频捕获
+        self.init_devices()
+
+    def init_database(self):
+        """初始化数据库"""
+        # 数据库在后台线程中写入, 访问时加锁
+        self.conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        self.db_lock = threading.Lock()
+        init_database(self.conn)
+
+        # 传感器数据和操作记录由写入线程批量提交
+        self.db_writer = DatabaseWriter(self.conn, self.db_lock)
+
+    def run_retention(self):
+        """定期把超过保留天数的传感器数据移入归档"""
+        while True:
+            try:
+                archive.archive_older_than(DB_PATH, ARCHIVE_RETENTION_DAYS)
+            except Exception as e:
+                logging.error(f"数据归档错误: {str(e)}")
+            time.sleep(ARCHIVE_CHECK_INTERVAL)
 
     def init_variables(self):
         # 串口相关
@@ -118,6 +3649,14 @@ class SmartMonitorSystem:
         self.humi_threshold = tk.DoubleVar(value=80.0)
         self.light_threshold = tk.DoubleVar(value=1000.0)
         
+        # 推理自动调节设置
+        self.detect_auto = tk.BooleanVar(value=True)
+        self.detect_target_fps = tk.DoubleVar(value=DETECT_TARGET_FPS)
+        self.detect_cpu_budget = tk.DoubleVar(value=DETECT_CPU_BUDGET * 100)
+        
+        # 视频画面叠加人员分布热力图
+        self.show_heatmap = tk.BooleanVar(value=False)
+        
         # 消防水闸状态
         self.valve_state = tk.BooleanVar(value=False)
         self.valve_mode = tk.StringVar(value="自动")  # 自动/手动控制模式
@@ -131,13 +3670,63 @@ class SmartMonitorSystem:
             'gas': tk.StringVar(value="0")
         }
 
+        # 事件总线: 读数、人数和水闸命令结果只发布一次, 存储、上报和Web状态各自在自己的线程中处理
+        self.bus = EventBus()
+        self.people_logged = (None, 0.0)
+        subscribe_consumers(self.bus, self.store_event, self.upload_event, self.push_event)
+
         # 添加串口数据缓冲
         self.serial_buffer = ""
+        self.device_id = ""
         
         # 添加串口接收线程
         self.serial_thread = None
         self.is_receiving = False
 
+        # 报警快速通道, 阈值和模式变化时同步
+        self.serial_write_lock = threading.Lock()
+        self.detector = AnomalyDetector()
+        self.inference_control = InferenceController()
+        self.commands = CommandWriter(self.write_valve_command, on_done=self.on_valve_command_done)
+        self.alarm = AlarmFastPath(lambda cmd, received_at: self.commands.send(cmd, COMMAND_PRIORITY_ALARM, '自动',
+                                                                                received_at),
+                                   on_trip=self.on_alarm_trip, detector=self.detector)
+        # 串口读数处理链
+        self.pipeline = SensorPipeline(self.bus, self.alarm, display=self.sensor_data,
+                                       on_ack=self.commands.acknowledge)
+        for var in (self.temp_threshold, self.humi_threshold, self.light_threshold, self.valve_mode):
+            var.trace_add('write', lambda *args: self.sync_alarm_settings())
+        self.valve_state.trace_add('write', lambda *args: self.sync_valve_state())
+        for var in (self.detect_auto, self.detect_target_fps, self.detect_cpu_budget):
+            var.trace_add('write', lambda *args: self.sync_detect_settings())
+        self.sync_alarm_settings()
+        self.alarm_count = 0
+        self.publish_state(valve_open=False, valve_mode=self.valve_mode.get(), people=0,
+                           alarm_count=0, last_alarm=None)
+
+    def publish_state(self, **fields):
+        """更新供Web进程读取的实时状态"""
+        if live_state is not None:
+            live_state.update(**fields)
+
+    def sync_alarm_settings(self):
+        """把界面上的阈值和控制模式同步到报警快速通道"""
+        try:
+            self.alarm.thresholds = {
+                'temp': self.temp_threshold.get(),
+                'humi': self.humi_threshold.get(),
+                'light': self.light_threshold.get()
+            }
+        except tk.TclError:
+            # 输入框内容暂时不是有效数字, 保留上次的阈值
+            pass
+        self.alarm.auto_mode = self.valve_mode.get() == "自动"
+        self.publish_state(valve_mode=self.valve_mode.get())
+
+    def sync_valve_state(self):
+        self.alarm.valve_open = self.valve_state.get()
+        self.publish_state(valve_open=self.valve_state.get())
+
     def create_gui(self):
         # 创建主框架
         main_frame = tk.Frame(self.root)
@@ -260,10 +3849,48 @@ class SmartMonitorSystem:
         tk.Button(btn_frame, text="开始监控", command=self.start_video).pack(side=tk.LEFT, padx=5)
         tk.Button(btn_frame, text="停止监控", command=self.stop_video).pack(side=tk.LEFT, padx=5)
         tk.Button(btn_frame, text="拍照", command=self.take_snapshot).pack(side=tk.LEFT, padx=5)
+        tk.Checkbutton(btn_frame, text="显示热力图", variable=self.show_heatmap).pack(side=tk.LEFT, padx=5)
         
         # 人流量信息显示
         self.flow_info = tk.Label(parent, text="当前人流量: 0 人")
         self.flow_info.pack(pady=5)
+        
+        # 推理自动调节
+        control_frame = tk.LabelFrame(parent, text="推理自动调节")
+        control_frame.pack(fill=tk.X, padx=5, pady=5)
+        
+        settings_frame = tk.Frame(control_frame)
+        settings_frame.pack(fill=tk.X, padx=5, pady=2)
+        tk.Checkbutton(settings_frame, text="启用", variable=self.detect_auto).pack(side=tk.LEFT)
+        tk.Label(settings_frame, text="目标帧率:").pack(side=tk.LEFT)
+        tk.Entry(settings_frame, textvariable=self.detect_target_fps, width=6).pack(side=tk.LEFT)
+        tk.Label(settings_frame, text="FPS  CPU预算:").pack(side=tk.LEFT)
+        tk.Entry(settings_frame, textvariable=self.detect_cpu_budget, width=6).pack(side=tk.LEFT)
+        tk.Label(settings_frame, text="%").pack(side=tk.LEFT)
+        
+        self.detect_info = tk.Label(control_frame, text="--")
+        self.detect_info.pack(padx=5, pady=2)
+        self.refresh_detect_info()
+
+    def sync_detect_settings(self):
+        """把界面上的推理调节设置同步到控制器"""
+        control = self.inference_control
+        try:
+            control.target_fps = max(0.1, self.detect_target_fps.get())
+            control.cpu_budget = min(1.0, max(0.01, self.detect_cpu_budget.get() / 100))
+        except tk.TclError:
+            # 输入框内容暂时不是有效数字, 保留上次的设置
+            pass
+        control.enabled = self.detect_auto.get()
+
+    def refresh_detect_info(self):
+        """每秒刷新推理调节状态"""
+        state = self.inference_control.state()
+        self.detect_info.config(
+            text=f"输入尺寸: {state['imgsz']}  每 {state['interval']} 帧检测一次  "
+                 f"推理: {state['latency'] * 1000:.0f} ms  检测帧率: {state['detect_fps']:.1f}  "
+                 f"CPU: {state['cpu_ratio'] * 100:.0f}%")
+        self.root.after(1000, self.refresh_detect_info)
 
     def create_data_view_button(self, parent):
         """创建数据查看按钮"""
@@ -279,6 +3906,30 @@ class SmartMonitorSystem:
         data_window.title("历史数据查看")
         data_window.geometry("800x600")
         
+        # 查询线程, 窗口关闭时停止
+        worker = HistoryQueryWorker()
+        worker.start()
+        
+        # 筛选条件
+        filter_frame = tk.Frame(data_window)
+        filter_frame.pack(fill=tk.X, padx=5, pady=5)
+        
+        start_var = tk.StringVar()
+        end_var = tk.StringVar()
+        device_var = tk.StringVar()
+        tk.Label(filter_frame, text="开始日期:").pack(side=tk.LEFT)
+        tk.Entry(filter_frame, textvariable=start_var, width=20).pack(side=tk.LEFT)
+        tk.Label(filter_frame, text="结束日期:").pack(side=tk.LEFT)
+        tk.Entry(filter_frame, textvariable=end_var, width=20).pack(side=tk.LEFT)
+        tk.Label(filter_frame, text="设备:").pack(side=tk.LEFT)
+        try:
+            devices = history_devices(archive=archive)
+        except (sqlite3.Error, OSError, ValueError) as e:
+            logging.error(f"读取设备列表失败: {e}")
+            devices = []
+        ttk.Combobox(filter_frame, textvariable=device_var, width=12,
+                     values=[""] + devices).pack(side=tk.LEFT)
+        
         # 创建选项卡
         notebook = ttk.Notebook(data_window)
         notebook.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
@@ -286,100 +3937,65 @@ class SmartMonitorSystem:
         # 传感器数据选项卡
         sensor_frame = ttk.Frame(notebook)
         notebook.add(sensor_frame, text="传感器数据")
-        self.create_sensor_data_view(sensor_frame)
         
         # 水闸操作记录选项卡
         valve_frame = ttk.Frame(notebook)
         notebook.add(valve_frame, text="水闸操作记录")
-        self.create_valve_data_view(valve_frame)
         
         # 用户操作记录选项卡
         user_frame = ttk.Frame(notebook)
         notebook.add(user_frame, text="用户操作记录")
-        self.create_user_data_view(user_frame)
-
-    def create_sensor_data_view(self, parent):
-        """创建传感器数据视图"""
-        # 创建表格
-        columns = ("时间", "温度", "湿度", "光照", "人体红外", "烟雾")
-        tree = ttk.Treeview(parent, columns=columns, show="headings")
-        
-        # 设置列标题
-        for col in columns:
-            tree.heading(col, text=col)
-            tree.column(col, width=100)
-        
-        # 添加滚动条
-        scrollbar = ttk.Scrollbar(parent, orient=tk.VERTICAL, command=tree.yview)
-        tree.configure(yscrollcommand=scrollbar.set)
-        
-        # 布局
-        tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        
-        # 加载数据
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT timestamp, temperature, humidity, light, pir, gas 
-            FROM sensor_data 
-            ORDER BY timestamp DESC 
-            LIMIT 100
-        ''')
-        
-        for row in cursor.fetchall():
-            tree.insert("", tk.END, values=row)
-
-    def create_valve_data_view(self, parent):
-        """创建水闸操作记录视图"""
-        columns = ("时间", "操作", "模式", "操作者")
-        tree = ttk.Treeview(parent, columns=columns, show="headings")
-        
-        for col in columns:
-            tree.heading(col, text=col)
-            tree.column(col, width=150)
-        
-        scrollbar = ttk.Scrollbar(parent, orient=tk.VERTICAL, command=tree.yview)
-        tree.configure(yscrollcommand=scrollbar.set)
         
-        tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT timestamp, operation, mode, operator 
-            FROM valve_operations 
-            ORDER BY timestamp DESC 
-            LIMIT 100
-        ''')
-        
-        for row in cursor.fetchall():
-            tree.insert("", tk.END, values=row)
-
-    def create_user_data_view(self, parent):
-        """创建用户操作记录视图"""
-        columns = ("时间", "操作", "详情")
-        tree = ttk.Treeview(parent, columns=columns, show="headings")
+        views = [
+            HistoryView(sensor_frame, worker,
+                        TieredHistoryQuery('sensor_data', ('timestamp', 'temperature', 'humidity', 'light', 'pir', 'gas'),
+                                           archive, has_device=True),
+                        ("时间", "温度", "湿度", "光照", "人体红外", "烟雾"), 100),
+            HistoryView(valve_frame, worker,
+                        HistoryQuery('valve_operations', ('timestamp', 'operation', 'mode', 'operator')),
+                        ("时间", "操作", "模式", "操作者"), 150),
+            HistoryView(user_frame, worker,
+                        HistoryQuery('user_operations', ('timestamp', 'operation', 'details')),
+                        ("时间", "操作", "详情"), 200),
+        ]
         
-        for col in columns:
-            tree.heading(col, text=col)
-            tree.column(col, width=200)
+        def apply_filters():
+            try:
+                filters = {
+                    'start': parse_time_filter(start_var.get()),
+                    'end': parse_time_filter(end_var.get(), end_of_day=True),
+                    'device': device_var.get().strip()
+                }
+            except ValueError:
+                messagebox.showerror("错误", "日期格式应为 YYYY-MM-DD 或 YYYY-MM-DD HH:MM:SS", parent=data_window)
+                return
+            for view in views:
+                view.reset(filters)
         
-        scrollbar = ttk.Scrollbar(parent, orient=tk.VERTICAL, command=tree.yview)
-        tree.configure(yscrollcommand=scrollbar.set)
+        tk.Button(filter_frame, text="查询", command=apply_filters).pack(side=tk.LEFT, padx=5)
         
-        tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        # 定时取回查询结果
+        def poll_results():
+            while True:
+                try:
+                    view, generation, direction, rows, error = worker.results.get_nowait()
+                except queue.Empty:
+                    break
+                if error:
+                    logging.error(f"历史数据查询错误: {str(error)}")
+                    view.loading = False
+                else:
+                    view.apply(generation, direction, rows)
+            if data_window.winfo_exists():
+                data_window.after(50, poll_results)
         
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT timestamp, operation, details 
-            FROM user_operations 
-            ORDER BY timestamp DESC 
-            LIMIT 100
-        ''')
+        def on_close():
+            worker.stop()
+            data_window.destroy()
         
-        for row in cursor.fetchall():
-            tree.insert("", tk.END, values=row)
+        data_window.protocol("WM_DELETE_WINDOW", on_close)
+        apply_filters()
+        poll_results()
 
     def get_available_ports(self):
         """获取可用串口列表"""
@@ -393,6 +4009,9 @@ class SmartMonitorSystem:
         self.serial_port = None
         self.camera = None
         self.video_thread = None
+        self.detector_pool = None
+        self.zones = ZoneMap()
+        self.heatmap = OccupancyHeatmap()
 
     def toggle_serial(self):
         """切换串口状态"""
@@ -404,6 +4023,7 @@ class SmartMonitorSystem:
                     timeout=TIMEOUT
                 )
                 self.portisopen = True
+                self.device_id = self.pipeline.device = self.port_var.get()
                 self.serial_btn.config(text="关闭串口")
                 messagebox.showinfo("成功", "串口已打开")
                 
@@ -417,6 +4037,9 @@ class SmartMonitorSystem:
                 messagebox.showerror("错误", f"无法打开串口: {str(e)}")
         else:
             self.is_receiving = False
+            # 等旧的接收线程退出, 避免很快重新打开时两个线程同时读串口
+            if self.serial_thread:
+                self.serial_thread.join(timeout=1)
             if self.serial_port:
                 self.serial_port.close()
             self.portisopen = False
@@ -431,98 +4054,47 @@ class SmartMonitorSystem:
                     char = self.serial_port.read().decode()
                     self.serial_buffer += char
                     
-                    # 如果收到换行符或回车符，处理完整数据
+                    # 如果收到换行符或回车符，处理完整数据; 字节数按帧累计, 不在每个字节上计数
                     if char in '\n\r':
-                        self.process_serial_data(self.serial_buffer.strip())
+                        self.pipeline.handle_frame(self.serial_buffer)
                         self.serial_buffer = ""
                         
                 except Exception as e:
                     logging.error(f"串口数据接收错误: {str(e)}")
             time.sleep(0.01)
 
-    def process_serial_data(self, data):
-        """处理串口数据"""
-        try:
-            if not data:
+    def store_event(self, event):
+        """存储订阅者: 把事件写入数据库"""
+        if isinstance(event, SensorReading):
+            self.log_sensor_data(event.as_dict())
+        elif isinstance(event, PeopleCount):
+            # 人数变化或超过记录间隔时写入人流量记录, 供趋势图使用
+            logged, logged_at = self.people_logged
+            counts = (event.count, event.zones)
+            if counts != logged or event.time - logged_at >= PEOPLE_LOG_INTERVAL:
+                self.people_logged = (counts, event.time)
+                self.log_people_count(event.count, {zone_id: count for zone_id, _, count in event.zones})
+        elif isinstance(event, ValveChange):
+            operation = "打开" if event.open else "关闭"
+            if event.result == 'timeout':
+                operation += "(未确认)"
+            elif event.result != 'acked':
                 return
-                
-            # 解析数据
-            sensor_type = data[0]
-            value = ""
-            
-            if sensor_type == 'g':  # 光强
-                value = data[1:]
-                self.sensor_data['light'].set(value)
-                
-            elif sensor_type == 'h':  # 人体红外
-                value = data[1:]
-                self.sensor_data['pir'].set(value)
-                
-            elif sensor_type == 'y':  # 烟雾
-                value = data[1:]
-                self.sensor_data['gas'].set(value)
-                
-            elif sensor_type == 'w':  # 温湿度组合数据
-                try:
-                    # 分离温度和湿度数据
-                    temp_humi = data.split('&')
-                    if len(temp_humi) == 2:
-                        # 处理温度
-                        temp = temp_humi[0][1:]  # 去掉'w'
-                        self.sensor_data['temp'].set(temp)
-                        
-                        # 处理湿度
-                        humi = temp_humi[1][1:].rstrip('!')  # 去掉's'和'!'
-                        self.sensor_data['humi'].set(humi)
-                except Exception as e:
-                    logging.error(f"温湿度数据解析错误: {str(e)}")
+            self.log_valve_operation(operation, event.mode)
 
-            # 自动上报数据
-            self.auto_report_sensor_data()
-            
-        except Exception as e:
-            logging.error(f"数据处理错误: {str(e)}")
+    def upload_event(self, event):
+        """上报订阅者: 加入OneNet待发送队列"""
+        if isinstance(event, SensorReading):
+            self.outbox.submit(build_sensor_params(event.as_dict()))
+        elif isinstance(event, PeopleCount):
+            self.outbox.submit(build_people_params(event))
 
-    def auto_report_sensor_data(self):
-        """自动上报传感器数据"""
-        try:
-            # 获取传感器数据
-            data = {
-                'temp': float(self.sensor_data['temp'].get()),
-                'humi': float(self.sensor_data['humi'].get()),
-                'light': float(self.sensor_data['light'].get()),
-                'pir': int(self.sensor_data['pir'].get()),
-                'gas': int(self.sensor_data['gas'].get())
-            }
-            
-            # 记录数据到数据库
-            self.log_sensor_data(data)
-            
-            # 构建参数字典
-            params = {}
-            
-            # 添加有值的字段
-            if data['temp']:
-                params["temp"] = {"value": int(data['temp'])}
-            if data['humi']:
-                params["shidu"] = {"value": int(data['humi'])}
-            if data['light']:
-                params["guangzhao"] = {"value": int(data['light'])}
-            if data['pir']:
-                params["rentihongwai"] = {"value": data['pir']}
-            if data['gas']:
-                params["yanwu"] = {"value": data['gas']}
-            
-            # 检查阈值
-            self.check_thresholds(data)
-            
-            # 上报到OneNet
-            OnenetConnect.report_device_property(params)
-                
-        except ValueError as e:
-            logging.error(f"数据格式错误: {str(e)}")
-        except Exception as e:
-            logging.error(f"数据上报错误: {str(e)}")
+    def push_event(self, event):
+        """Web状态订阅者: 更新Web进程读取的实时状态"""
+        if isinstance(event, PeopleCount):
+            self.publish_state(people=event.count, zones={name: count for _, name, count in event.zones})
+        elif isinstance(event, ValveChange) and event.result == 'acked':
+            self.publish_state(valve_open=event.open)
 
     def report_sensor_data(self):
         """上报传感器数据"""
@@ -536,65 +4108,59 @@ class SmartMonitorSystem:
                 'gas': int(self.sensor_data['gas'].get())
             }
             
-            # 记录数据到数据库
-            self.log_sensor_data(data)
-            
-            # 构建参数字典
-            params = {}
-            
-            # 添加有值的字段
-            if data['temp']:
-                params["temp"] = {"value": int(data['temp'])}
-            if data['humi']:
-                params["shidu"] = {"value": int(data['humi'])}
-            if data['light']:
-                params["guangzhao"] = {"value": int(data['light'])}
-            if data['pir']:
-                params["rentihongwai"] = {"value": data['pir']}
-            if data['gas']:
-                params["yanwu"] = {"value": data['gas']}
-            
             # 检查阈值
             self.check_thresholds(data)
             
-            # 上报到OneNet
-            if OnenetConnect.report_device_property(params):
-                messagebox.showerror("错误", "数据上报失败")
-            else:
-                messagebox.showinfo("成功", "数据上报成功")
+            # 记录数据到数据库
+            self.log_sensor_data(data)
+            
+            # 与自动上报一样交给待发送队列: 断网时保留并在恢复后补发, 被拒绝时重试后移入 dead_letter 表
+            self.outbox.submit(build_sensor_params(data))
+            messagebox.showinfo("成功", "数据已加入上报队列")
                 
         except ValueError as e:
             messagebox.showerror("错误", "请输入有效的数值")
         except Exception as e:
             messagebox.showerror("错误", f"上报失败: {str(e)}")
 
-    def check_thresholds(self, data):
+    def check_thresholds(self, data, received_at=None, changed=()):
         """检查传感器数据是否超过阈值"""
-        if self.valve_mode.get() == "自动":
-            if (data['temp'] > self.temp_threshold.get() or
-                data['humi'] > self.humi_threshold.get() or
-                data['light'] > self.light_threshold.get()):
-                
-                if not self.valve_state.get():
-                    self.valve_state.set(True)
-                    if self.portisopen:
-                        self.serial_port.write(b'\x01')
-                        messagebox.showinfo("自动控制", "检测到异常，消防水闸已自动打开")
+        return self.alarm.check(data, received_at, changed)
+
+    def write_valve_command(self, cmd):
+        """向串口写入水闸控制命令, 只由命令写入线程调用, 串口未打开时返回 False"""
+        if not self.portisopen:
+            return False
+        with self.serial_write_lock:
+            self.serial_port.write(cmd)
+        return True
+
+    def on_valve_command_done(self, cmd, mode, result):
+        """水闸命令完成(确认、超时或被报警命令取代)后发布事件, 由存储订阅者记录操作"""
+        self.bus.publish(ValveChange(cmd == b'\x01', mode, result, time.time()))
+
+    def on_alarm_trip(self, data, reason):
+        """自动开闸后的后续任务, 在 AlarmFastPath 的后台线程执行; 不能直接调用Tk,
+        界面更新经 root.after 交给Tk主线程(notify_alarm_trip)"""
+        self.alarm_count += 1
+        self.publish_state(valve_open=True, alarm_count=self.alarm_count,
+                           last_alarm=f"{datetime.now().strftime('%H:%M:%S')} {reason}")
+        self.root.after(0, self.notify_alarm_trip, reason)
+
+    def notify_alarm_trip(self, reason):
+        self.valve_state.set(True)
+        if self.portisopen:
+            messagebox.showinfo("自动控制", f"检测到异常({reason})，消防水闸已自动打开")
 
     def toggle_valve(self):
         """控制消防水闸开关"""
         if self.valve_mode.get() == "手动":
             state = self.valve_state.get()
             if self.portisopen:
-                # 发送水闸控制命令
+                # 发送水闸控制命令, 收到确认后记录操作
                 cmd = b'\x01' if state else b'\x00'
-                self.serial_port.write(cmd)
-                messagebox.showinfo("成功", f"消防水闸已{'打开' if state else '关闭'}")
-                # 记录操作
-                self.log_valve_operation(
-                    "打开" if state else "关闭",
-                    self.valve_mode.get()
-                )
+                self.commands.send(cmd, COMMAND_PRIORITY_MANUAL, self.valve_mode.get())
+                messagebox.showinfo("成功", f"消防水闸{'打开' if state else '关闭'}命令已发送")
             else:
                 messagebox.showwarning("警告", "串口未打开")
         else:
@@ -605,7 +4171,16 @@ class SmartMonitorSystem:
     def start_video(self):
         """启动视频监控"""
         if not self.is_capturing:
-            self.camera = cv2.VideoCapture(0)
+            # 检测进程首次启动监控时创建, 程序退出前一直保留
+            if self.detector_pool is None:
+                self.detector_pool = DetectorPool(on_result=self.inference_control.observe)
+            try:
+                self.camera = open_frame_source(self.video_source, loop=True)
+            except FileNotFoundError as e:
+                messagebox.showerror("错误", str(e))
+                return
+            self.zones = ZoneMap.load(ZONES_PATH, CAMERA_INDEX)
+            self.heatmap = OccupancyHeatmap.load(heatmap_path(CAMERA_INDEX))
             self.is_capturing = True
             self.video_thread = threading.Thread(target=self.update_video)
             self.video_thread.daemon = True
@@ -619,40 +4194,59 @@ class SmartMonitorSystem:
 
     def update_video(self):
         """更新视频画面"""
+        last_frame_time = time.perf_counter()
+        heatmap_published = heatmap_saved = time.time()
+        pipeline = VideoPipeline(self.detector_pool, self.inference_control, self.zones, self.heatmap, self.bus,
+                                 show_heatmap=self.show_heatmap.get)
         while self.is_capturing:
-            ret, frame = self.camera.read()
+            with VIDEO_STAGE_SECONDS['capture'].time():
+                ret, frame = self.camera.read()
             if ret:
-                # 人流量检测
-                results = model1(frame, classes=[0])  # 只检测人
-                
-                # 获取人数
-                people_count = len(results[0].boxes)
+                # 检测、人数统计、热力图、标注和人数事件
+                annotated_frame, people_count, zone_counts = pipeline.process(frame)
                 
-                # 在画面上标注检测结果
-                annotated_frame = results[0].plot()
+                # 热力图定期发布给Web进程并保存到文件
+                now = time.time()
+                if now - heatmap_published >= HEATMAP_PUBLISH_INTERVAL:
+                    save = now - heatmap_saved >= HEATMAP_SAVE_INTERVAL
+                    self.publish_heatmap(save)
+                    heatmap_published = now
+                    if save:
+                        heatmap_saved = now
                 
+                render_start = time.perf_counter()
                 # 转换图像格式
-                image = cv2.cvtColor(annotated_frame, cv2.COLOR_BGR2RGB)
-                image = Image.fromarray(image)
-                image = image.resize((640, 480))
-                photo = ImageTk.PhotoImage(image=image)
+                photo = ImageTk.PhotoImage(image=render_frame(annotated_frame))
                 
                 # 更新画面
                 self.video_canvas.create_image(0, 0, image=photo, anchor=tk.NW)
                 self.video_canvas.photo = photo
                 
                 # 更新人流量信息
-                self.flow_info.config(text=f"当前人流量: {people_count} 人")
+                zone_text = ''.join(f", {name}: {count}" for name, count in zip(self.zones.names, zone_counts))
+                self.flow_info.config(text=f"当前人流量: {people_count} 人{zone_text}")
+                VIDEO_STAGE_SECONDS['render'].observe(time.perf_counter() - render_start)
                 
-                # 上报人流量数据
-                params = {
-                    "people_count_in": {"value": people_count},
-                    "people_count_out": {"value": 0},
-                    "current_people": {"value": people_count}
-                }
-                OnenetConnect.report_device_property(params)
+                now = time.perf_counter()
+                fps = 1.0 / max(now - last_frame_time, 1e-6)
+                VIDEO_FPS.set(fps)
+                self.inference_control.observe_frame(fps)
+                last_frame_time = now
             
             time.sleep(0.03)  # 控制帧率
+        self.publish_heatmap(save=True)
+
+    def publish_heatmap(self, save=False):
+        """把热力图写入共享内存, save 为 True 时同时保存到文件"""
+        self.heatmap.decay(time.time())
+        payload = self.heatmap.to_bytes()
+        try:
+            if heatmap_block is not None:
+                heatmap_block.write(payload)
+            if save:
+                OccupancyHeatmap.save(heatmap_path(CAMERA_INDEX), payload)
+        except Exception as e:
+            logging.error(f"热力图发布错误: {str(e)}")
 
     def take_snapshot(self):
         """拍摄快照"""
@@ -665,119 +4259,143 @@ class SmartMonitorSystem:
 
     def log_sensor_data(self, data):
         """记录传感器数据"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            INSERT INTO sensor_data (temperature, humidity, light, pir, gas)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (
-            float(data['temp']),
-            float(data['humi']),
-            float(data['light']),
-            int(data['pir']),
-            int(data['gas'])
-        ))
-        self.conn.commit()
+        sensor = {key: data[key] for key in ('temp', 'humi', 'light', 'pir', 'gas')}
+        self.db_writer.submit(SENSOR_INSERT_SQL, sensor_row(data, self.device_id),
+                              lambda: self.publish_state(sensor_updated=utc_text(), sensor=sensor))
+
+    def log_people_count(self, count, zones=None):
+        """记录人流量和各区域人数"""
+        for zone_id, zone_count in (zones or {}).items():
+            self.db_writer.submit("INSERT INTO zone_counts (camera, zone, count) VALUES (?, ?, ?)",
+                                  (CAMERA_INDEX, zone_id, int(zone_count)))
+        self.db_writer.submit("INSERT INTO people_flow (count) VALUES (?)", (int(count),),
+                              lambda: self.publish_state(people_updated=utc_text()))
 
     def log_valve_operation(self, operation, mode):
         """记录水闸操作"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
+        self.db_writer.submit('''
             INSERT INTO valve_operations (operation, mode, operator)
             VALUES (?, ?, ?)
         ''', (operation, mode, "系统" if mode == "自动" else "用户"))
-        self.conn.commit()
 
     def __del__(self):
         """清理资源"""
         self.is_receiving = False
         self.stop_video()
+        if self.detector_pool:
+            self.detector_pool.close()
+            self.detector_pool = None
+        if hasattr(self, 'pipeline'):
+            self.pipeline.close()
+        if hasattr(self, 'commands'):
+            self.commands.close()
+        if hasattr(self, 'bus'):
+            self.bus.close()
+        if hasattr(self, 'db_writer'):
+            self.db_writer.close()
         if self.serial_port:
             self.serial_port.close()
         if hasattr(self, 'conn'):
             self.conn.close()
 
-@app.route('/')
-def index():
-    return """<!DOCTYPE html>
+class StaticAssets:
+    """仪表盘静态资源. 启动时读入 static/ 目录, 按内容哈希命名并预先压缩(gzip, 安装 brotli 时另加 br),
+    请求时按 Accept-Encoding 直接返回压缩结果"""
+
+    def __init__(self, root=STATIC_DIR):
+        self.root = root
+        self.names = {}
+        self.files = {}
+        if os.path.isdir(root):
+            for name in sorted(os.listdir(root)):
+                path = os.path.join(root, name)
+                if os.path.isfile(path):
+                    with open(path, 'rb') as f:
+                        self.add(name, f.read())
+
+    def add(self, name, data, mimetype=None):
+        """登记一个资源, 返回带哈希的文件名"""
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        stem, ext = os.path.splitext(name)
+        hashed = f"{stem}.{digest}{ext}"
+        mimetype = mimetype or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        if mimetype.startswith('text/') or mimetype.endswith(('javascript', 'svg+xml')):
+            if 'charset' not in mimetype:
+                mimetype += '; charset=utf-8'
+            encodings = self.compress(data)
+        else:
+            encodings = {}
+        encodings['identity'] = data
+        self.names[name] = hashed
+        self.files[hashed] = (mimetype, digest, encodings)
+        return hashed
+
+    @staticmethod
+    def compress(data):
+        encodings = {}
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+        encodings['gzip'] = compressor.compress(data) + compressor.flush()
+        try:
+            import brotli
+        except ImportError:
+            pass
+        else:
+            encodings['br'] = brotli.compress(data, quality=11)
+        # 压缩后反而更大的不保留
+        return {k: v for k, v in encodings.items() if len(v) < len(data)}
+
+    def url(self, name):
+        return f"/static/{self.names[name]}"
+
+    def response(self, hashed, max_age=STATIC_MAX_AGE):
+        """返回资源响应; max_age 为 0 时每次需用 ETag 验证"""
+        if hashed not in self.files:
+            return Response('Not Found', status=404)
+        mimetype, digest, encodings = self.files[hashed]
+        headers = {
+            'ETag': f'"{digest}"',
+            'Vary': 'Accept-Encoding',
+            'Cache-Control': f"public, max-age={max_age}, immutable" if max_age else 'no-cache'
+        }
+        if digest in request.if_none_match:
+            return Response(status=304, headers=headers)
+        encoding = 'identity'
+        for candidate in ('br', 'gzip'):
+            if candidate in encodings and request.accept_encodings[candidate]:
+                encoding = candidate
+                break
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        return Response(encodings[encoding], content_type=mimetype, headers=headers)
+
+
+static_assets = StaticAssets()
+
+DASHBOARD_HTML = """<!DOCTYPE html>
 <html lang="en">
 
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>智能室内消防报警系统</title>
-    <script src="https://cdn.tailwindcss.com"></script>
-    <link href="https://cdn.jsdelivr.net/npm/font-awesome@4.7.0/css/font-awesome.min.css" rel="stylesheet">
-    <script src="https://cdn.jsdelivr.net/npm/chart.js@4.4.8/dist/chart.umd.min.js"></script>
-    <script>
-        tailwind.config = {
-            theme: {
-                extend: {
-                    colors: {
-                        primary: '#4CAF50',
-                        secondary: '#2E7D32',
-                        danger: '#F44336',
-                        warning: '#FFC107',
-                        info: '#2196F3',
-                        dark: '#333333',
-                    },
-                    fontFamily: {
-                        sans: ['Inter', 'system-ui', 'sans-serif'],
-                    },
-                }
-            }
-        }
-    </script>
-    <style type="text/tailwindcss">
-        @layer utilities {
-            .content-auto {
-                content-visibility: auto;
-            }
-            .table-hover-row {
-                @apply transition-colors duration-200;
-            }
-            .table-hover-row:hover {
-                @apply bg-gray-100;
-            }
-            .card {
-                @apply bg-white rounded-lg shadow-md p-5 mb-5;
-            }
-            .btn {
-                @apply px-4 py-2 rounded-md transition-all duration-200;
-            }
-            .btn-primary {
-                @apply bg-primary text-white hover:bg-secondary;
-            }
-            .btn-danger {
-                @apply bg-danger text-white hover:bg-red-600;
-            }
-            .alert {
-                @apply p-4 rounded-md mb-4;
-            }
-            .alert-danger {
-                @apply bg-red-100 text-red-700 border-l-4 border-red-500;
-            }
-            .threshold-alert {
-                @apply font-bold text-danger;
-            }
-        }
-    </style>
+    <link href="{css}" rel="stylesheet">
 </head>
 
-<body class="bg-gray-50 text-dark">
+<body class="bg-gray-50 text-dark" data-icons="{icons}">
     <div class="container mx-auto px-4 py-6">
         <!-- 导航栏 -->
         <nav class="bg-primary text-white rounded-lg shadow-md mb-6">
             <div class="container mx-auto px-4">
                 <div class="flex justify-between items-center h-16">
                     <div class="flex items-center">
-                        <i class="fa fa-fire-extinguisher mr-3 text-2xl"></i>
+                        <svg class="icon mr-3 text-2xl"><use href="{icons}#fire-extinguisher"></use></svg>
                         <span class="font-bold text-xl">智能室内消防报警系统</span>
                     </div>
                     <div class="flex items-center space-x-4">
                         <a href="https://open.iot.10086.cn/view/main/index.html#/view2d?id=682d3d1ec7c5e4004002d5d4" 
                            target="_blank" 
                            class="btn btn-primary flex items-center">
-                            <i class="fa fa-area-chart mr-2"></i>系统可视化
+                            <svg class="icon mr-2"><use href="{icons}#area-chart"></use></svg>系统可视化
                         </a>
                     </div>
                 </div>
@@ -793,13 +4411,14 @@ def index():
                         <h3 id="current-people" class="text-3xl font-bold">0</h3>
                     </div>
                     <div class="bg-white/20 p-3 rounded-full">
-                        <i class="fa fa-users text-2xl"></i>
+                        <svg class="icon text-2xl"><use href="{icons}#users"></use></svg>
                     </div>
                 </div>
                 <div class="mt-4 flex justify-between text-sm">
                     <span>今日最高: <span id="today-max-people">0</span></span>
                     <span>今日平均: <span id="today-avg-people">0</span></span>
                 </div>
+                <div id="zone-counts" class="mt-3 text-sm"></div>
             </div>
 
             <div class="card bg-gradient-to-r from-green-500 to-green-400 text-white">
@@ -809,7 +4428,7 @@ def index():
                         <h3 id="valve-status" class="text-3xl font-bold">关闭</h3>
                     </div>
                     <div class="bg-white/20 p-3 rounded-full">
-                        <i class="fa fa-tint text-2xl"></i>
+                        <svg class="icon text-2xl"><use href="{icons}#tint"></use></svg>
                     </div>
                 </div>
                 <div class="mt-4">
@@ -824,7 +4443,7 @@ def index():
                         <h3 id="alert-count" class="text-3xl font-bold">0</h3>
                     </div>
                     <div class="bg-white/20 p-3 rounded-full">
-                        <i class="fa fa-bell text-2xl"></i>
+                        <svg class="icon text-2xl"><use href="{icons}#bell"></use></svg>
                     </div>
                 </div>
                 <div class="mt-4">
@@ -838,7 +4457,7 @@ def index():
             <!-- 人数趋势图表 -->
             <div class="card lg:col-span-1">
                 <h2 class="text-xl font-bold mb-4 flex items-center">
-                    <i class="fa fa-line-chart mr-2 text-primary"></i>人数趋势
+                    <svg class="icon mr-2 text-primary"><use href="{icons}#line-chart"></use></svg>人数趋势
                 </h2>
                 <div class="h-64">
                     <canvas id="people-chart"></canvas>
@@ -851,7 +4470,7 @@ def index():
             <!-- 传感器数据 -->
             <div class="card lg:col-span-2">
                 <h2 class="text-xl font-bold mb-4 flex items-center">
-                    <i class="fa fa-dashboard mr-2 text-primary"></i>传感器数据
+                    <svg class="icon mr-2 text-primary"><use href="{icons}#dashboard"></use></svg>传感器数据
                 </h2>
                 <div class="overflow-x-auto">
                     <table class="min-w-full">
@@ -873,10 +4492,56 @@ def index():
             </div>
         </div>
 
+        <!-- 传感器趋势图表 -->
+        <div class="card">
+            <div class="flex justify-between items-center mb-4">
+                <h2 class="text-xl font-bold flex items-center">
+                    <svg class="icon mr-2 text-primary"><use href="{icons}#area-chart"></use></svg>历史趋势
+                </h2>
+                <div class="flex items-center space-x-4 text-sm">
+                    <select id="trend-channel" class="select">
+                        <option value="temperature">温度 (°C)</option>
+                        <option value="humidity">湿度 (%)</option>
+                        <option value="light">光照 (lux)</option>
+                        <option value="pir">人体红外</option>
+                        <option value="gas">烟雾</option>
+                        <option value="people">人数</option>
+                    </select>
+                    <select id="trend-range" class="select">
+                        <option value="3600">1 小时</option>
+                        <option value="86400" selected>24 小时</option>
+                        <option value="604800">7 天</option>
+                        <option value="2592000">30 天</option>
+                        <option value="31536000">1 年</option>
+                    </select>
+                </div>
+            </div>
+            <div class="h-64">
+                <canvas id="trend-chart"></canvas>
+            </div>
+            <div class="mt-3 text-sm text-gray-600">
+                <p>原始数据点: <span id="trend-total">--</span></p>
+            </div>
+        </div>
+
+        <!-- 人员分布热力图 -->
+        <div class="card">
+            <div class="flex justify-between items-center mb-4">
+                <h2 class="text-xl font-bold flex items-center">
+                    <svg class="icon mr-2 text-primary"><use href="{icons}#users"></use></svg>人员分布热力图
+                </h2>
+                <select id="heatmap-layer" class="select text-sm">
+                    <option value="footprint">占用范围</option>
+                    <option value="centers">停留位置</option>
+                </select>
+            </div>
+            <img id="heatmap-image" class="heatmap" alt="人员分布热力图">
+        </div>
+
         <!-- 水闸操作记录 -->
         <div class="card">
             <h2 class="text-xl font-bold mb-4 flex items-center">
-                <i class="fa fa-history mr-2 text-primary"></i>水闸操作记录
+                <svg class="icon mr-2 text-primary"><use href="{icons}#history"></use></svg>水闸操作记录
             </h2>
             <div class="overflow-x-auto">
                 <table class="min-w-full">
@@ -896,170 +4561,36 @@ def index():
         </div>
     </div>
 
-    <script>
-        // 全局变量
-        let peopleChart;
-        const MAX_PEOPLE_RECORDS = 30; // 图表最多显示30个数据点
-        const peopleData = {
-            labels: Array(MAX_PEOPLE_RECORDS).fill(''),
-            datasets: [{
-                label: '实时人数',
-                data: Array(MAX_PEOPLE_RECORDS).fill(0),
-                borderColor: '#4CAF50',
-                backgroundColor: 'rgba(76, 175, 80, 0.1)',
-                borderWidth: 2,
-                tension: 0.4,
-                fill: true
-            }]
-        };
-
-        // 初始化图表
-        function initPeopleChart() {
-            const ctx = document.getElementById('people-chart').getContext('2d');
-            peopleChart = new Chart(ctx, {
-                type: 'line',
-                data: peopleData,
-                options: {
-                    responsive: true,
-                    maintainAspectRatio: false,
-                    plugins: {
-                        legend: {
-                            display: false
-                        },
-                        tooltip: {
-                            mode: 'index',
-                            intersect: false
-                        }
-                    },
-                    scales: {
-                        x: {
-                            grid: {
-                                display: false
-                            }
-                        },
-                        y: {
-                            beginAtZero: true,
-                            grid: {
-                                color: 'rgba(0, 0, 0, 0.05)'
-                            }
-                        }
-                    },
-                    animation: {
-                        duration: 500
-                    }
-                }
-            });
-        }
-
-        // 更新人数数据
-        function updatePeopleData() {
-            fetch('/get_people_data')
-              .then(response => response.json())
-              .then(data => {
-                    // 更新当前人数
-                    document.getElementById('current-people').textContent = data.current || 0;
-                    document.getElementById('today-max-people').textContent = data.today_max || 0;
-                    document.getElementById('today-avg-people').textContent = (data.today_avg || 0).toFixed(1);
-                    
-                    // 更新图表
-                    if (peopleChart) {
-                        // 移除最早的数据点并添加新的数据点
-                        peopleData.datasets[0].data.shift();
-                        peopleData.datasets[0].data.push(data.current || 0);
-                        peopleChart.update();
-                    }
-                });
-        }
-
-        // 更新传感器数据
-        function updateSensorData() {
-            fetch('/get_sensor_data')
-              .then(response => response.json())
-              .then(data => {
-                    const tableBody = document.getElementById('sensor-table-body');
-                    tableBody.innerHTML = '';
-                    data.forEach(item => {
-                        const row = document.createElement('tr');
-                        row.innerHTML = `
-                            <td class="px-4 py-2">${item.timestamp}</td>
-                            <td class="px-4 py-2">${item.temperature}</td>
-                            <td class="px-4 py-2">${item.humidity}</td>
-                            <td class="px-4 py-2">${item.light}</td>
-                            <td class="px-4 py-2">${item.pir}</td>
-                            <td class="px-4 py-2">${item.gas}</td>
-                        `;
-                        tableBody.appendChild(row);
-                    });
-                });
-        }
+    <script src="{js}" defer></script>
+</body>
 
-        // 更新水闸操作数据
-        function updateValveData() {
-            fetch('/get_valve_data')
-              .then(response => response.json())
-              .then(data => {
-                    const tableBody = document.getElementById('valve-table-body');
-                    tableBody.innerHTML = '';
-                    data.forEach(item => {
-                        const row = document.createElement('tr');
-                        const operationIcon = item.operation === '打开' ? '<i class="fa fa-toggle-on text-green-500"></i>' : '<i class="fa fa-toggle-off text-gray-500"></i>';
-                        row.innerHTML = `
-                            <td class="px-4 py-2">${item.timestamp}</td>
-                            <td class="px-4 py-2">${operationIcon}</td>
-                            <td class="px-4 py-2">${item.mode}</td>
-                            <td class="px-4 py-2">${item.operator}</td>
-                        `;
-                        tableBody.appendChild(row);
-                    });
-                });
-        }
+</html>"""
 
-        // 更新水闸状态
-        function updateValveStatus() {
-            fetch('/get_valve_status')
-              .then(response => response.json())
-              .then(data => {
-                    document.getElementById('valve-status').textContent = data.status ? '打开' : '关闭';
-                    document.getElementById('valve-mode').textContent = data.mode;
-                });
-        }
 
-        // 初始化函数
-        function init() {
-            initPeopleChart();
-            updatePeopleData();
-            updateSensorData();
-            updateValveData();
-            updateValveStatus();
-
-            // 定时更新数据
-            setInterval(updatePeopleData, 5000);
-            setInterval(updateSensorData, 5000);
-            setInterval(updateValveData, 5000);
-            setInterval(updateValveStatus, 5000);
-        }
+@app.route('/')
+def index():
+    # 页面本身每次用 ETag 验证, 引用的样式和脚本文件名带内容哈希, 可长期缓存
+    if 'index.html' not in static_assets.names:
+        html = DASHBOARD_HTML.format(css=static_assets.url('dashboard.css'),
+                                     js=static_assets.url('dashboard.js'),
+                                     icons=static_assets.url('icons.svg'))
+        static_assets.add('index.html', html.encode('utf-8'), 'text/html')
+    return static_assets.response(static_assets.names['index.html'], max_age=0)
 
-        window.onload = init;
-    </script>
-</body>
 
-</html>
-"""
+@app.route('/static/<filename>')
+def static_file(filename):
+    return static_assets.response(filename)
 
 @app.route('/get_people_data')
 def get_people_data():
     today = datetime.now().strftime('%Y-%m-%d')
-    conn = sqlite3.connect('smart_monitor.db')
+    conn = connect_readonly(app.config['DB_PATH'])
     cursor = conn.cursor()
 
-    # 获取当前人数
-    cursor.execute('''
-        SELECT count FROM people_flow 
-        ORDER BY timestamp DESC 
-        LIMIT 1
-    ''')
-    current_row = cursor.fetchone()
-    current = current_row[0] if current_row else 0
+    # 获取当前人数和各区域人数
+    state = live_state.read()
+    current = state.get('people', 0)
 
     # 获取今日最高人数
     cursor.execute('''
@@ -1082,12 +4613,13 @@ def get_people_data():
     return jsonify({
         'current': current,
         'today_max': today_max,
-        'today_avg': today_avg
+        'today_avg': today_avg,
+        'zones': state.get('zones', {})
     })
 
 @app.route('/get_sensor_data')
 def get_sensor_data():
-    conn = sqlite3.connect('smart_monitor.db')
+    conn = connect_readonly(app.config['DB_PATH'])
     cursor = conn.cursor()
     cursor.execute('''
         SELECT timestamp, temperature, humidity, light, pir, gas 
@@ -1111,7 +4643,7 @@ def get_sensor_data():
 
 @app.route('/get_valve_data')
 def get_valve_data():
-    conn = sqlite3.connect('smart_monitor.db')
+    conn = connect_readonly(app.config['DB_PATH'])
     cursor = conn.cursor()
     cursor.execute('''
         SELECT timestamp, operation, mode, operator 
@@ -1131,23 +4663,653 @@ def get_valve_data():
     conn.close()
     return jsonify(data)
 
+class _StreamBuffer(io.RawIOBase):
+    """只写缓冲区, 记录已写入的总字节数, 供 Parquet 写入器分块输出"""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def export_rows(table, start=None, end=None, fmt='csv', compress=False, db_path=DB_PATH, archive=None):
+    """按时间范围逐块导出表数据, 返回字节块生成器, 内存占用与导出范围无关.
+    数据库按 (timestamp, id) 键集分页, 每块一个短的读事务, 导出期间不会一直占住 WAL 快照.
+    传入归档层时先输出归档中的旧数据"""
+    columns = EXPORT_TABLES[table]
+    names = [name for name, _ in columns]
+
+    def encode_csv(rows, first):
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        if first:
+            writer.writerow(names)
+        writer.writerows(rows)
+        return buf.getvalue().encode('utf-8')
+
+    def encode_ndjson(rows, first):
+        return ''.join(json.dumps(dict(zip(names, row)), ensure_ascii=False) + '\n'
+                       for row in rows).encode('utf-8')
+
+    if fmt == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        schema = pa.schema([(name, getattr(pa, type_name)()) for name, type_name in columns])
+        sink = _StreamBuffer()
+        parquet_writer = pq.ParquetWriter(sink, schema, compression='zstd')
+
+        def encode_parquet(rows, first):
+            arrays = [pa.array([row[i] for row in rows], type=schema.field(i).type)
+                      for i in range(len(names))]
+            parquet_writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            return sink.drain()
+
+        encode = encode_parquet
+    else:
+        encode = encode_csv if fmt == 'csv' else encode_ndjson
+
+    query = HistoryQuery(table, names)
+    filters = {'start': start, 'end': end}
+
+    conn = connect_readonly(db_path)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    try:
+        chunks = archive.iter_rows(start, end, names) if archive is not None else iter(())
+        first = True
+        key = None
+        while True:
+            rows = next(chunks, None)
+            if rows is None:
+                # 取完整块后语句即结束, 读事务随之结束; 下一块从上一块的最后一行之后接着查
+                rows = query.page(conn, filters, 'newer', key, EXPORT_CHUNK_SIZE)
+                if rows:
+                    key = (rows[-1][1], rows[-1][0])
+                    rows = [row[1:] for row in rows]
+            if not rows and not first:
+                break
+            data = encode(rows, first)
+            first = False
+            if compressor:
+                data = compressor.compress(data)
+            if data:
+                yield data
+            if not rows:
+                break
+        if fmt == 'parquet':
+            parquet_writer.close()
+            tail = sink.drain()
+            yield compressor.compress(tail) if compressor else tail
+        if compressor:
+            yield compressor.flush()
+    finally:
+        conn.close()
+
+
+def benchmark_export(rows=10_000_000, fmt='csv', compress=False):
+    """生成临时数据库并导出全部行, 输出吞吐量和进程内存峰值"""
+    import resource
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = os.path.join(tmpdir, 'bench.db')
+        conn = sqlite3.connect(db_path)
+        conn.execute('''
+            CREATE TABLE sensor_data (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp DATETIME, temperature REAL, humidity REAL,
+                light REAL, pir INTEGER, gas INTEGER, device TEXT
+            )
+        ''')
+        base = datetime(2025, 1, 1).timestamp()
+        conn.executemany(
+            "INSERT INTO sensor_data (timestamp, temperature, humidity, light, pir, gas, device) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            ((datetime.fromtimestamp(base + i).strftime('%Y-%m-%d %H:%M:%S'), 20 + i % 10, 50.0, 300.0, i % 2, 0, 'COM1')
+             for i in range(rows))
+        )
+        conn.execute("CREATE INDEX idx_sensor_data_time ON sensor_data (timestamp, id)")
+        conn.commit()
+        conn.close()
+
+        start = time.perf_counter()
+        total_bytes = 0
+        for chunk in export_rows('sensor_data', fmt=fmt, compress=compress, db_path=db_path):
+            total_bytes += len(chunk)
+        elapsed = time.perf_counter() - start
+
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"导出 {rows} 行 ({fmt}{'+gzip' if compress else ''}): {elapsed:.1f} s, "
+          f"{rows / elapsed:.0f} 行/s, 输出 {total_bytes / 1e6:.1f} MB, 进程内存峰值 {peak_mb:.0f} MB")
+    return elapsed
+
+
+@app.route('/export')
+def export_data():
+    table = request.args.get('table', 'sensor_data')
+    fmt = request.args.get('format', 'csv')
+    compress = request.args.get('gzip', '0') in ('1', 'true', 'yes')
+    if table not in EXPORT_TABLES or fmt not in EXPORT_MIMETYPES:
+        return jsonify({'error': '不支持的表或格式'}), 400
+    try:
+        start = parse_time_filter(request.args.get('start'))
+        end = parse_time_filter(request.args.get('end'), end_of_day=True)
+    except ValueError:
+        return jsonify({'error': '日期格式应为 YYYY-MM-DD 或 YYYY-MM-DD HH:MM:SS'}), 400
+    if fmt == 'parquet':
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            return jsonify({'error': '导出 Parquet 需要安装 pyarrow'}), 501
+
+    filename = f"{table}.{fmt}" + ('.gz' if compress else '')
+    mimetype = 'application/gzip' if compress else EXPORT_MIMETYPES[fmt]
+    return Response(
+        stream_with_context(export_rows(table, start, end, fmt, compress, app.config['DB_PATH'],
+                                        archive=archive if table == 'sensor_data' else None)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+@app.route('/api/stats')
+def api_stats():
+    try:
+        start = parse_time_filter(request.args.get('start'))
+        end = parse_time_filter(request.args.get('end'), end_of_day=True)
+        window = int(request.args.get('window', 3600))
+        step = int(request.args.get('step', window))
+    except ValueError:
+        return jsonify({'error': '参数格式错误'}), 400
+    if not start or window <= 0 or step <= 0:
+        return jsonify({'error': '需要 start 参数, window 和 step 必须为正整数(秒)'}), 400
+    device = request.args.get('device') or None
+
+    stats_cache.observe_update(live_state.read().get('sensor_updated'))
+    key = (start, end, window, step, device)
+    result = stats_cache.get(key)
+    if result is None:
+        start_epoch = to_epoch(start)
+        end_epoch = to_epoch(end) if end else int(time.time())
+        times, values = load_sensor_series(
+            utc_text(start_epoch - window), end, device, db_path=app.config['DB_PATH'])
+        try:
+            ends, counts, stats, exact = rolling_stats(times, values, start_epoch, end_epoch, window, step)
+        except ValueError as e:
+            return jsonify({'error': f"{str(e)}, 请增大 step 或缩小时间范围"}), 400
+
+        def to_list(array):
+            return [None if np.isnan(v) else round(float(v), 3) for v in array]
+
+        result = {
+            'times': [text.replace('T', ' ') for text in np.datetime_as_string(ends.astype('datetime64[s]'))],
+            'count': counts.tolist(),
+            'p95_method': 'exact' if exact else 'histogram',
+            'channels': {channel: {name: to_list(array) for name, array in channel_stats.items()}
+                         for channel, channel_stats in stats.items()}
+        }
+        stats_cache.put(key, result)
+    return jsonify(result)
+
+@app.route('/api/series')
+def api_series():
+    try:
+        start = parse_time_filter(request.args.get('start'))
+        end = parse_time_filter(request.args.get('end'), end_of_day=True)
+        points = int(request.args.get('points', 500))
+    except ValueError:
+        return jsonify({'error': '参数格式错误'}), 400
+    channel = request.args.get('channel', 'people')
+    if channel not in SERIES_CHANNELS:
+        return jsonify({'error': f"channel 必须为 {', '.join(SERIES_CHANNELS)} 之一"}), 400
+    if not 3 <= points <= SERIES_MAX_POINTS:
+        return jsonify({'error': f"points 必须在 3 到 {SERIES_MAX_POINTS} 之间"}), 400
+    device = request.args.get('device') or None
+    start, end = align_series_range(start, end, points)
+
+    state = live_state.read() if live_state else {}
+    series_cache.observe_update(max(state.get('sensor_updated') or '', state.get('people_updated') or ''))
+    key = (start, end, channel, device, points)
+    result = series_cache.get(key)
+    if result is None:
+        times, values = load_series(channel, start, end, device, app.config['DB_PATH'])
+        keep = np.isfinite(values)
+        if not keep.all():
+            times, values = times[keep], values[keep]
+        selected = lttb(times, values, points)
+        result = {
+            'channel': channel,
+            'total': int(len(values)),
+            'times': [text.replace('T', ' ') for text in np.datetime_as_string(times[selected].astype('datetime64[s]'))],
+            'values': [round(float(v), 3) for v in values[selected]]
+        }
+        series_cache.put(key, result)
+    return jsonify(result)
+
+@app.route('/api/heatmap.png')
+def api_heatmap_png():
+    layer = request.args.get('layer', 'footprint')
+    if layer not in OccupancyHeatmap.LAYERS:
+        return jsonify({'error': f"layer 必须为 {', '.join(OccupancyHeatmap.LAYERS)} 之一"}), 400
+    response = Response(read_heatmap().render(layer), mimetype='image/png')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/heatmap.npy')
+def api_heatmap_npy():
+    # 原始网格(float32, HEATMAP_ROWS x HEATMAP_COLS), 可用 numpy.load 读取
+    layer = request.args.get('layer', 'footprint')
+    if layer not in OccupancyHeatmap.LAYERS:
+        return jsonify({'error': f"layer 必须为 {', '.join(OccupancyHeatmap.LAYERS)} 之一"}), 400
+    buffer = io.BytesIO()
+    np.save(buffer, getattr(read_heatmap(), layer))
+    response = Response(buffer.getvalue(), mimetype='application/octet-stream')
+    response.headers['Content-Disposition'] = f'attachment; filename=heatmap_{layer}.npy'
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # 指标由主进程定期写入共享内存
+    text = metrics_snapshot.read().decode('utf-8') if metrics_snapshot else metrics.render()
+    text += web_metrics.render()
+    return Response(text, mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/profile')
+def admin_profile():
+    # 对主进程(process=main, 串口、视频、Tk等线程)或本Web进程(process=web)采样
+    token = os.environ.get(ADMIN_TOKEN_ENV)
+    # 令牌只从请求头读取, 不放在 URL 中, 以免留在访问日志和浏览器历史里
+    given = request.headers.get('X-Admin-Token', '')
+    if not token or not hmac.compare_digest(given.encode('utf-8'), token.encode('utf-8')):
+        return jsonify({'error': '需要管理员令牌'}), 403
+    try:
+        seconds = float(request.args.get('seconds', 10))
+    except ValueError:
+        return jsonify({'error': '参数格式错误'}), 400
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        return jsonify({'error': f"seconds 必须在 0 到 {PROFILE_MAX_SECONDS} 之间"}), 400
+    process = request.args.get('process', 'main')
+    fmt = request.args.get('format', 'collapsed')
+    if process not in ('main', 'web') or fmt not in ('collapsed', 'json'):
+        return jsonify({'error': "process 必须为 main 或 web, format 必须为 collapsed 或 json"}), 400
+
+    with profile_lock:
+        if process == 'web':
+            result = SamplingProfiler().run(seconds)
+        elif profile_conn is None:
+            return jsonify({'error': '主程序未运行'}), 503
+        else:
+            try:
+                profile_conn.send(seconds)
+                result = profile_conn.recv()
+            except (EOFError, OSError):
+                return jsonify({'error': '主程序未运行'}), 503
+    if 'error' in result:
+        return jsonify(result), 500
+    if fmt == 'json':
+        return jsonify(result)
+    response = Response(format_collapsed(result), mimetype='text/plain')
+    response.headers['Content-Disposition'] = \
+        f"attachment; filename=profile_{process}_{time.strftime('%Y%m%d_%H%M%S')}.txt"
+    return response
+
 @app.route('/get_valve_status')
 def get_valve_status():
+    state = live_state.read()
     return jsonify({
-        'status': app.monitor_system.valve_state.get(),
-        'mode': app.monitor_system.valve_mode.get()
+        'status': state.get('valve_open', False),
+        'mode': state.get('valve_mode', '自动'),
+        'alarm_count': state.get('alarm_count', 0),
+        'last_alarm': state.get('last_alarm')
     })
 
+def run_web_worker(sock, host, port, state_name=STATE_SHM_NAME, metrics_name=METRICS_SHM_NAME, conn=None,
+                   db_path=DB_PATH):
+    """Web工作进程: 打开共享状态后在父进程创建的监听套接字上提供服务"""
+    global live_state, metrics_snapshot, heatmap_block, profile_conn
+    profile_conn = conn
+    app.config['DB_PATH'] = db_path
+    from werkzeug.serving import make_server
+    live_state = LiveState(SharedBlock(state_name))
+    metrics_snapshot = SharedBlock(metrics_name)
+    try:
+        heatmap_block = SharedBlock(HEATMAP_SHM_NAME)
+    except FileNotFoundError:
+        # 没有主程序发布热力图时读取保存的文件
+        heatmap_block = None
+    server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+    server.serve_forever()
+
+def start_web_workers(host=WEB_HOST, port=WEB_PORT, workers=WEB_WORKERS,
+                      state_name=STATE_SHM_NAME, metrics_name=METRICS_SHM_NAME, profile_server=None, db_path=DB_PATH):
+    """创建监听套接字并启动Web工作进程, 各进程共享同一个套接字;
+    传入 profile_server 时每个Web进程与它之间建立一条采样请求管道.
+    主进程此时已有串口、上报等线程在运行, fork 出的子进程可能继承被其他线程持有的锁,
+    因此与检测进程一样使用 spawn 方式启动, 套接字和管道由 multiprocessing 传给子进程"""
+    ctx = multiprocessing.get_context('spawn')
+    sock = socket.create_server((host, port))
+    processes = []
+    for _ in range(workers):
+        conn = None
+        if profile_server is not None:
+            parent_conn, conn = ctx.Pipe()
+            profile_server.add(parent_conn)
+        process = ctx.Process(target=run_web_worker,
+                              args=(sock, host, port, state_name, metrics_name, conn, db_path))
+        process.daemon = True
+        process.start()
+        processes.append(process)
+    return sock, processes
+
+def run_load_clients(base_url, clients, duration, interval, results):
+    """负载生成进程: clients 个线程模拟浏览器轮询仪表盘接口, 返回各接口的延迟列表和错误数"""
+    latencies = {endpoint: [] for endpoint in LOAD_TEST_ENDPOINTS}
+    errors = {endpoint: 0 for endpoint in LOAD_TEST_ENDPOINTS}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(index):
+        # 各客户端错开起始时间, 避免同时发出请求
+        time.sleep(interval * index / max(clients, 1))
+        while time.perf_counter() < deadline:
+            poll_start = time.perf_counter()
+            for endpoint in LOAD_TEST_ENDPOINTS:
+                start = time.perf_counter()
+                try:
+                    with urllib.request.urlopen(base_url + endpoint, timeout=10) as response:
+                        response.read()
+                    ok = True
+                except Exception:
+                    ok = False
+                elapsed = time.perf_counter() - start
+                with lock:
+                    if ok:
+                        latencies[endpoint].append(elapsed)
+                    else:
+                        errors[endpoint] += 1
+            time.sleep(max(0.0, interval - (time.perf_counter() - poll_start)))
+
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put((latencies, errors))
+
+
+def populate_load_test_db(db_path, days=7, step=10):
+    """在 db_path 创建带模拟历史数据的数据库: 传感器数据每 step 秒一条, 人流量每分钟一条"""
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    init_database(conn)
+    now = int(time.time())
+    rng = np.random.default_rng(0)
+    times = np.arange(now - days * 86400, now, step)
+
+    def stamp(t):
+        return utc_text(int(t))
+
+    conn.executemany(
+        "INSERT INTO sensor_data (timestamp, temperature, humidity, light, pir, gas, device) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        ((stamp(t), round(22 + 3 * float(rng.standard_normal()), 1), 50.0, 300.0, int(t % 2), 10, 'COM1')
+         for t in times))
+    conn.executemany("INSERT INTO people_flow (timestamp, count) VALUES (?, ?)",
+                     ((stamp(t), int(t // 60 % 10)) for t in times[::max(1, 60 // step)]))
+    conn.executemany("INSERT INTO valve_operations (timestamp, operation, mode, operator) VALUES (?, ?, ?, ?)",
+                     ((stamp(t), "打开" if i % 2 else "关闭", "自动", "系统") for i, t in enumerate(times[::360])))
+    conn.commit()
+    return conn, len(times)
+
+
+def measure_ingest_latency(db_writer, duration, rate=10.0):
+    """模拟串口线程按 rate 条/秒写入传感器数据, 返回从提交到写入完成的延迟列表"""
+    latencies = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        submitted = time.perf_counter()
+        db_writer.submit(
+            "INSERT INTO sensor_data (temperature, humidity, light, pir, gas, device) VALUES (?, ?, ?, ?, ?, ?)",
+            (25.0, 50.0, 300.0, 0, 10, 'COM1'),
+            lambda submitted=submitted: latencies.append(time.perf_counter() - submitted))
+        time.sleep(1.0 / rate)
+    time.sleep(0.5)
+    return latencies
+
+
+def summarize_latencies(latencies, duration=None):
+    """延迟列表的 p50/p95/p99(毫秒), 给出 duration 时同时计算每秒请求数"""
+    summary = {'count': len(latencies)}
+    if latencies:
+        p50, p95, p99 = np.percentile(np.asarray(latencies) * 1000, [50, 95, 99])
+        summary.update(p50_ms=round(float(p50), 2), p95_ms=round(float(p95), 2), p99_ms=round(float(p99), 2))
+    if duration:
+        summary['rps'] = round(len(latencies) / duration, 1)
+    return summary
+
+
+def benchmark_web(clients=20, duration=30.0, interval=0.0, workers=WEB_WORKERS, baseline_path=LOAD_TEST_BASELINE,
+                  save_baseline=False):
+    """在临时目录中启动带模拟历史数据的Web服务, 用 clients 个客户端压测仪表盘接口,
+    同时测量串口数据写库延迟的变化. 结果与基线比较, 基线不存在或 save_baseline 时保存为新基线.
+    返回是否未出现退化"""
+    suffix = f"_bench{os.getpid()}"
+    global live_state, metrics_snapshot
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = os.path.join(tmpdir, DB_PATH)
+        processes, sock = [], None
+        try:
+            conn, rows = populate_load_test_db(db_path)
+            print(f"模拟历史数据: {rows} 条传感器记录")
+            db_writer = DatabaseWriter(conn, threading.Lock())
+
+            live_state = LiveState(SharedBlock(STATE_SHM_NAME + suffix, STATE_SHM_SIZE, create=True))
+            metrics_snapshot = SharedBlock(METRICS_SHM_NAME + suffix, METRICS_SHM_SIZE, create=True)
+            live_state.update(people=3, zones={}, valve_open=False, valve_mode="自动", alarm_count=0, last_alarm="")
+            metrics_snapshot.write(metrics.render().encode('utf-8'))
+            sock, processes = start_web_workers('127.0.0.1', 0, workers, STATE_SHM_NAME + suffix,
+                                                METRICS_SHM_NAME + suffix, db_path=db_path)
+            base_url = f"http://127.0.0.1:{sock.getsockname()[1]}"
+            time.sleep(1.0)
+
+            idle = measure_ingest_latency(db_writer, min(duration, 10.0))
+
+            results = multiprocessing.Queue()
+            load = multiprocessing.Process(target=run_load_clients,
+                                           args=(base_url, clients, duration, interval, results))
+            load.start()
+            under_load = measure_ingest_latency(db_writer, duration)
+            latencies, errors = results.get()
+            load.join()
+            db_writer.close()
+            conn.close()
+        finally:
+            for process in processes:
+                process.terminate()
+            if sock:
+                sock.close()
+            if live_state:
+                live_state.block.close()
+                live_state = None
+            if metrics_snapshot:
+                metrics_snapshot.close()
+                metrics_snapshot = None
+
+    report = {
+        'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'clients': clients, 'duration': duration, 'interval': interval, 'workers': workers,
+        'endpoints': {endpoint: dict(summarize_latencies(latencies[endpoint], duration), errors=errors[endpoint])
+                      for endpoint in LOAD_TEST_ENDPOINTS},
+        'ingest': {'idle': summarize_latencies(idle), 'load': summarize_latencies(under_load)}
+    }
+    total = sum(len(values) for values in latencies.values())
+    report['total_rps'] = round(total / duration, 1)
+
+    print(f"{clients} 个客户端, {workers} 个Web进程, {duration:.0f} s: 共 {report['total_rps']} 请求/s")
+    for endpoint, summary in report['endpoints'].items():
+        print(f"  {endpoint:<20} {summary.get('rps', 0):>8} 请求/s  p50 {summary.get('p50_ms', '-')} ms  "
+              f"p95 {summary.get('p95_ms', '-')} ms  p99 {summary.get('p99_ms', '-')} ms  错误 {summary['errors']}")
+    for phase, name in (('idle', '空闲'), ('load', '压测中')):
+        summary = report['ingest'][phase]
+        print(f"  串口数据写库延迟({name}): p50 {summary.get('p50_ms', '-')} ms  p99 {summary.get('p99_ms', '-')} ms")
+
+    passed = True
+    if os.path.exists(baseline_path):
+        with open(baseline_path, encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"与基线 {baseline_path} ({baseline.get('time')}) 比较:")
+        checks = [(f"{endpoint} p95", baseline['endpoints'].get(endpoint, {}).get('p95_ms'), summary.get('p95_ms'))
+                  for endpoint, summary in report['endpoints'].items()]
+        checks.append(("写库延迟 p99", baseline['ingest']['load'].get('p99_ms'), report['ingest']['load'].get('p99_ms')))
+        for name, old, new in checks:
+            if old is None or new is None:
+                continue
+            worse = new > old * (1 + LOAD_TEST_TOLERANCE)
+            passed &= not worse
+            print(f"  {name}: {old} -> {new} ms{' (退化)' if worse else ''}")
+        if report['total_rps'] < baseline['total_rps'] * (1 - LOAD_TEST_TOLERANCE):
+            passed = False
+            print(f"  吞吐量: {baseline['total_rps']} -> {report['total_rps']} 请求/s (退化)")
+    if save_baseline or not os.path.exists(baseline_path):
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存为基线: {baseline_path}")
+    return passed
+
+
+def publish_metrics():
+    """定期把主进程的监控指标写入共享内存"""
+    while True:
+        try:
+            metrics_snapshot.write(metrics.render().encode('utf-8'))
+        except Exception as e:
+            logging.error(f"监控指标发布错误: {str(e)}")
+        time.sleep(METRICS_PUBLISH_INTERVAL)
+
 def main():
+    parser = argparse.ArgumentParser(description="智能室内消防报警系统")
+    parser.add_argument('--bench-metrics', action='store_true', help="测量监控指标埋点开销后退出")
+    parser.add_argument('--bench-detector', action='store_true', help="测量异常检测吞吐量后退出")
+    parser.add_argument('--bench-inference', action='store_true',
+                        help="比较进程内与进程池推理饱和时的串口处理延迟后退出")
+    parser.add_argument('--bench-lttb', action='store_true', help="测量趋势图 LTTB 降采样耗时后退出")
+    parser.add_argument('--bench-zones', action='store_true', help="测量区域人数统计耗时后退出")
+    parser.add_argument('--bench-bus', action='store_true', help="测量有慢订阅者时事件发布耗时后退出")
+    parser.add_argument('--bench-heatmap', action='store_true', help="测量每帧累加热力图的耗时后退出")
+    parser.add_argument('--video-source', default=str(CAMERA_INDEX),
+                        help="视频帧源: 摄像头编号、视频文件、图片目录或 synthetic[:帧数]")
+    parser.add_argument('--bench-video', metavar='SOURCE',
+                        help="不启动界面, 用视频文件、图片目录或 synthetic[:帧数] 测量视频处理链后退出")
+    parser.add_argument('--bench-video-frames', type=int, help="最多处理的帧数")
+    parser.add_argument('--bench-video-sync', action='store_true',
+                        help="每帧等待检测结果后再处理下一帧, 用于测量人数准确度")
+    parser.add_argument('--bench-video-labels', help="人数标注文件(CSV: frame,count)")
+    parser.add_argument('--bench-web', type=int, metavar='CLIENTS',
+                        help="用模拟数据启动Web服务并以 CLIENTS 个客户端压测, 与基线比较后退出")
+    parser.add_argument('--bench-duration', type=float, default=30.0, help="压测时长(秒)")
+    parser.add_argument('--bench-interval', type=float, default=0.0,
+                        help="每个客户端两次轮询的间隔(秒), 0 表示不停顿")
+    parser.add_argument('--bench-baseline',
+                        help=f"基线文件, 默认 {LOAD_TEST_BASELINE}(--bench-web)或 {VIDEO_BENCH_BASELINE}(--bench-video)")
+    parser.add_argument('--save-baseline', action='store_true', help="把本次压测或基准测试结果保存为新基线")
+    parser.add_argument('--bench-export', type=int, metavar='ROWS', help="测量导出指定行数的耗时后退出")
+    parser.add_argument('--export-format', choices=sorted(EXPORT_MIMETYPES), default='csv',
+                        help="--bench-export 使用的导出格式")
+    parser.add_argument('--export-gzip', action='store_true', help="--bench-export 时启用gzip压缩")
+    parser.add_argument('--profile', type=float, metavar='SECONDS',
+                        help=f"对运行中的程序采样 SECONDS 秒, 保存折叠栈并打印各线程CPU时间后退出(需要 {ADMIN_TOKEN_ENV})")
+    parser.add_argument('--profile-process', choices=('main', 'web'), default='main',
+                        help="采样主进程(串口、视频、Tk等线程)或Web进程")
+    parser.add_argument('--profile-output', help="折叠栈输出文件")
+    parser.add_argument('--profile-url', help=f"运行中程序的Web地址, 默认 http://127.0.0.1:{WEB_PORT}")
+    parser.add_argument('--web', action='store_true', help="只运行Web服务(需要主程序已在运行)")
+    parser.add_argument('--web-workers', type=int, default=WEB_WORKERS, help="Web工作进程数, 0 表示不启动Web服务")
+    args = parser.parse_args()
+
+    if args.bench_metrics:
+        overhead = benchmark_metrics_overhead()
+        sys.exit(0 if overhead < 1.0 else 1)
+    if args.bench_detector:
+        rate = benchmark_detector()
+        sys.exit(0 if rate >= 100000 else 1)
+    if args.bench_inference:
+        benchmark_inference()
+        sys.exit(0)
+    if args.bench_lttb:
+        benchmark_lttb()
+        sys.exit(0)
+    if args.bench_zones:
+        benchmark_zones()
+        sys.exit(0)
+    if args.bench_bus:
+        sys.exit(0 if benchmark_event_bus() else 1)
+    if args.bench_heatmap:
+        elapsed = benchmark_heatmap()
+        sys.exit(0 if elapsed < 1e-3 else 1)
+    if args.bench_video:
+        passed = benchmark_video(args.bench_video, args.bench_video_frames, args.bench_video_sync,
+                                 args.bench_video_labels, args.bench_baseline or VIDEO_BENCH_BASELINE,
+                                 args.save_baseline)
+        sys.exit(0 if passed else 1)
+    if args.bench_web:
+        passed = benchmark_web(args.bench_web, args.bench_duration, args.bench_interval,
+                               max(args.web_workers, 1), args.bench_baseline or LOAD_TEST_BASELINE,
+                               args.save_baseline)
+        sys.exit(0 if passed else 1)
+    if args.bench_export:
+        benchmark_export(args.bench_export, args.export_format, args.export_gzip)
+        sys.exit(0)
+    if args.profile:
+        passed = profile_remote(args.profile, args.profile_process, args.profile_output, args.profile_url)
+        sys.exit(0 if passed else 1)
+
+    if args.web:
+        sock, processes = start_web_workers(workers=max(args.web_workers, 1))
+        for process in processes:
+            process.join()
+        return
+
+    # 创建共享状态, Web进程从中读取实时数据和监控指标
+    global live_state, metrics_snapshot, heatmap_block
+    live_state = LiveState(SharedBlock(STATE_SHM_NAME, STATE_SHM_SIZE, create=True))
+    metrics_snapshot = SharedBlock(METRICS_SHM_NAME, METRICS_SHM_SIZE, create=True)
+    heatmap_block = SharedBlock(HEATMAP_SHM_NAME, HEATMAP_SHM_SIZE, create=True)
+    metrics_thread = threading.Thread(target=publish_metrics)
+    metrics_thread.daemon = True
+    metrics_thread.start()
+
     root = tk.Tk()
-    app.monitor_system = SmartMonitorSystem(root)
+    system = SmartMonitorSystem(root, args.video_source)
     
-    # 启动Flask服务器
-    flask_thread = threading.Thread(target=app.run, kwargs={'host': '0.0.0.0', 'port': 5000})
-    flask_thread.daemon = True
-    flask_thread.start()
+    # 启动Web服务进程, 主进程处理Web进程转发来的采样请求
+    profile_server = ProfileServer()
+    sock, processes = (start_web_workers(workers=args.web_workers, profile_server=profile_server)
+                       if args.web_workers > 0 else (None, []))
+    profile_server.start()
     
-    root.mainloop()
+    try:
+        root.mainloop()
+    finally:
+        for process in processes:
+            process.terminate()
+        if sock:
+            sock.close()
+        if system.detector_pool:
+            system.detector_pool.close()
+            system.detector_pool = None
+        live_state.block.close()
+        metrics_snapshot.close()
+        heatmap_block.close()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
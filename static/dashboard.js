@@ -0,0 +1,268 @@
+// 仪表盘脚本: 数据轮询和趋势图(Canvas 绘制, 不依赖第三方图表库)
+
+// 全局变量
+let peopleChart;
+let trendChart;
+const MAX_PEOPLE_RECORDS = 30; // 图表最多显示30个数据点
+const ICONS = document.body.dataset.icons;
+
+function icon(name, extraClass) {
+    return `<svg class="icon ${extraClass || ''}"><use href="${ICONS}#${name}"></use></svg>`;
+}
+
+// 简单折线图: 面积填充, 纵轴包含0
+class LineChart {
+    constructor(canvas, options) {
+        this.canvas = canvas;
+        this.options = Object.assign({
+            color: '#4CAF50',
+            fill: 'rgba(76, 175, 80, 0.1)',
+            grid: 'rgba(0, 0, 0, 0.05)',
+            font: '12px system-ui, sans-serif'
+        }, options);
+        this.labels = [];
+        this.values = [];
+        window.addEventListener('resize', () => this.draw());
+    }
+
+    setData(labels, values) {
+        this.labels = labels;
+        this.values = values;
+        this.draw();
+    }
+
+    push(label, value, limit) {
+        this.labels.push(label);
+        this.values.push(value);
+        while (this.values.length > limit) {
+            this.labels.shift();
+            this.values.shift();
+        }
+        this.draw();
+    }
+
+    draw() {
+        const canvas = this.canvas;
+        const ratio = window.devicePixelRatio || 1;
+        const width = canvas.parentElement.clientWidth;
+        const height = canvas.parentElement.clientHeight;
+        canvas.width = width * ratio;
+        canvas.height = height * ratio;
+        canvas.style.width = width + 'px';
+        canvas.style.height = height + 'px';
+        const ctx = canvas.getContext('2d');
+        ctx.setTransform(ratio, 0, 0, ratio, 0, 0);
+        ctx.clearRect(0, 0, width, height);
+        ctx.font = this.options.font;
+
+        const left = 32, right = 8, top = 8, bottom = 20;
+        const plotWidth = width - left - right;
+        const plotHeight = height - top - bottom;
+        const maxValue = Math.max(1, ...this.values);
+        const minValue = Math.min(0, ...this.values);
+        const tick = niceStep((maxValue - minValue) / 4);
+        const yMax = Math.ceil(maxValue / tick) * tick;
+        const yMin = Math.floor(minValue / tick) * tick;
+        const y = v => top + plotHeight * (1 - (v - yMin) / (yMax - yMin));
+
+        // 网格线和纵轴刻度
+        ctx.strokeStyle = this.options.grid;
+        ctx.fillStyle = '#666';
+        ctx.textAlign = 'right';
+        ctx.textBaseline = 'middle';
+        for (let v = yMin; v <= yMax + 1e-9; v += tick) {
+            ctx.beginPath();
+            ctx.moveTo(left, y(v));
+            ctx.lineTo(width - right, y(v));
+            ctx.stroke();
+            ctx.fillText(+v.toFixed(2), left - 4, y(v));
+        }
+
+        const n = this.values.length;
+        if (n === 0) {
+            return;
+        }
+        const x = i => left + (n === 1 ? plotWidth : plotWidth * i / (n - 1));
+
+        // 横轴标签: 首尾各一个
+        ctx.textBaseline = 'top';
+        ctx.textAlign = 'left';
+        ctx.fillText(this.labels[0] || '', left, height - bottom + 4);
+        ctx.textAlign = 'right';
+        ctx.fillText(this.labels[n - 1] || '', width - right, height - bottom + 4);
+
+        ctx.beginPath();
+        this.values.forEach((v, i) => i ? ctx.lineTo(x(i), y(v)) : ctx.moveTo(x(i), y(v)));
+        ctx.strokeStyle = this.options.color;
+        ctx.lineWidth = 2;
+        ctx.stroke();
+        ctx.lineTo(x(n - 1), y(yMin));
+        ctx.lineTo(x(0), y(yMin));
+        ctx.closePath();
+        ctx.fillStyle = this.options.fill;
+        ctx.fill();
+    }
+}
+
+function niceStep(raw) {
+    const power = Math.pow(10, Math.floor(Math.log10(raw)));
+    const fraction = raw / power;
+    return (fraction <= 1 ? 1 : fraction <= 2 ? 2 : fraction <= 5 ? 5 : 10) * power;
+}
+
+function timeLabel(date) {
+    return date.toTimeString().slice(0, 8);
+}
+
+// 服务器时间为 UTC 的 'YYYY-MM-DD HH:MM:SS'
+function utcText(date) {
+    return date.toISOString().slice(0, 19).replace('T', ' ');
+}
+
+function parseUtc(text) {
+    return new Date(text.replace(' ', 'T') + 'Z');
+}
+
+// 读取降采样后的历史数据: 起止时间对齐到一个输出点的宽度(与服务器规则相同), 同一时间段内的请求命中服务器缓存
+function fetchSeries(channel, seconds, points) {
+    const bucket = Math.max(1, Math.ceil(seconds / points));
+    const end = Math.ceil(Date.now() / 1000 / bucket) * bucket;
+    const start = end - Math.ceil(seconds / bucket) * bucket;
+    const range = `start=${encodeURIComponent(utcText(new Date(start * 1000)))}&end=${encodeURIComponent(utcText(new Date(end * 1000)))}`;
+    return fetch(`/api/series?channel=${channel}&${range}&points=${points}`)
+      .then(response => response.json());
+}
+
+// 初始化图表: 用最近的人流量记录填充
+function initPeopleChart() {
+    peopleChart = new LineChart(document.getElementById('people-chart'));
+    fetchSeries('people', 3600, MAX_PEOPLE_RECORDS)
+      .then(data => peopleChart.setData(data.times.map(t => timeLabel(parseUtc(t))), data.values));
+}
+
+// 历史趋势图: 点数按画布宽度请求
+function updateTrendChart() {
+    const channel = document.getElementById('trend-channel').value;
+    const seconds = +document.getElementById('trend-range').value;
+    const canvas = document.getElementById('trend-chart');
+    const points = Math.max(3, Math.min(1000, Math.floor(canvas.parentElement.clientWidth / 2)));
+    fetchSeries(channel, seconds, points)
+      .then(data => {
+            const format = seconds > 86400 ? (d => d.toLocaleDateString() + ' ' + timeLabel(d).slice(0, 5)) : (d => timeLabel(d));
+            trendChart.setData(data.times.map(t => format(parseUtc(t))), data.values);
+            document.getElementById('trend-total').textContent = data.total;
+        });
+}
+
+function initTrendChart() {
+    trendChart = new LineChart(document.getElementById('trend-chart'), {color: '#2196F3', fill: 'rgba(33, 150, 243, 0.1)'});
+    document.getElementById('trend-channel').addEventListener('change', updateTrendChart);
+    document.getElementById('trend-range').addEventListener('change', updateTrendChart);
+    updateTrendChart();
+}
+
+// 人员分布热力图: 加时间参数避免浏览器使用缓存的旧图片
+function updateHeatmap() {
+    const layer = document.getElementById('heatmap-layer').value;
+    document.getElementById('heatmap-image').src = `/api/heatmap.png?layer=${layer}&t=${Date.now()}`;
+}
+
+function initHeatmap() {
+    document.getElementById('heatmap-layer').addEventListener('change', updateHeatmap);
+    updateHeatmap();
+}
+
+// 更新人数数据
+function updatePeopleData() {
+    fetch('/get_people_data')
+      .then(response => response.json())
+      .then(data => {
+            // 更新当前人数
+            document.getElementById('current-people').textContent = data.current || 0;
+            document.getElementById('today-max-people').textContent = data.today_max || 0;
+            document.getElementById('today-avg-people').textContent = (data.today_avg || 0).toFixed(1);
+            document.getElementById('zone-counts').textContent =
+                Object.entries(data.zones || {}).map(([name, count]) => `${name}: ${count}`).join('  ');
+
+            // 更新图表: 移除最早的数据点并添加新的数据点
+            const now = new Date();
+            peopleChart.push(timeLabel(now), data.current || 0, MAX_PEOPLE_RECORDS);
+            document.getElementById('chart-update-time').textContent = timeLabel(now);
+        });
+}
+
+// 更新传感器数据
+function updateSensorData() {
+    fetch('/get_sensor_data')
+      .then(response => response.json())
+      .then(data => {
+            const tableBody = document.getElementById('sensor-table-body');
+            tableBody.innerHTML = '';
+            data.forEach(item => {
+                const row = document.createElement('tr');
+                row.innerHTML = `
+                    <td class="px-4 py-2">${item.timestamp}</td>
+                    <td class="px-4 py-2">${item.temperature}</td>
+                    <td class="px-4 py-2">${item.humidity}</td>
+                    <td class="px-4 py-2">${item.light}</td>
+                    <td class="px-4 py-2">${item.pir}</td>
+                    <td class="px-4 py-2">${item.gas}</td>
+                `;
+                tableBody.appendChild(row);
+            });
+        });
+}
+
+// 更新水闸操作数据
+function updateValveData() {
+    fetch('/get_valve_data')
+      .then(response => response.json())
+      .then(data => {
+            const tableBody = document.getElementById('valve-table-body');
+            tableBody.innerHTML = '';
+            data.forEach(item => {
+                const row = document.createElement('tr');
+                const operationIcon = item.operation.startsWith('打开') ? icon('toggle-on', 'text-2xl text-green-500') : icon('toggle-off', 'text-2xl text-gray-500');
+                row.innerHTML = `
+                    <td class="px-4 py-2">${item.timestamp}</td>
+                    <td class="px-4 py-2">${operationIcon}</td>
+                    <td class="px-4 py-2">${item.mode}</td>
+                    <td class="px-4 py-2">${item.operator}</td>
+                `;
+                tableBody.appendChild(row);
+            });
+        });
+}
+
+// 更新水闸状态
+function updateValveStatus() {
+    fetch('/get_valve_status')
+      .then(response => response.json())
+      .then(data => {
+            document.getElementById('valve-status').textContent = data.status ? '打开' : '关闭';
+            document.getElementById('valve-mode').textContent = data.mode;
+            document.getElementById('alert-count').textContent = data.alarm_count || 0;
+            document.getElementById('last-alert').textContent = data.last_alarm || '无';
+        });
+}
+
+// 初始化函数
+function init() {
+    initPeopleChart();
+    initTrendChart();
+    initHeatmap();
+    updatePeopleData();
+    updateSensorData();
+    updateValveData();
+    updateValveStatus();
+
+    // 定时更新数据
+    setInterval(updatePeopleData, 5000);
+    setInterval(updateSensorData, 5000);
+    setInterval(updateValveData, 5000);
+    setInterval(updateValveStatus, 5000);
+    setInterval(updateTrendChart, 60000);
+    setInterval(updateHeatmap, 10000);
+}
+
+init();
@@ -0,0 +1,13 @@
+"""DetectorPool 测试用的工作进程入口, 不导入 PAPT, 子进程启动快"""
+import sys
+import time
+
+
+def crash_on_start(shm_name, slot_bytes, tasks, results, worker_id):
+    sys.exit(3)
+
+
+def hang_on_task(shm_name, slot_bytes, tasks, results, worker_id):
+    results.put((worker_id, 0, None, b'', 0.0, 0.0, None))
+    tasks.get()
+    time.sleep(3600)
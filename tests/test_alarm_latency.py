@@ -0,0 +1,41 @@
+"""报警快速通道: 读数到开闸命令写入串口的延迟预算"""
+import threading
+import time
+
+import PAPT
+
+
+def test_alarm_command_p99_within_budget():
+    """后续任务很慢时, 经过命令写入线程的读数到开闸命令写入延迟 p99 仍在 ALARM_LATENCY_BUDGET 之内.
+    模拟的串口写入后立即确认"""
+    samples = 1000
+    written = threading.Event()
+    writes = []
+
+    def write(payload):
+        writes.append(time.perf_counter())
+        commands.acknowledge(PAPT.VALVE_ACK_CODES.get(payload))
+        written.set()
+        return True
+
+    commands = PAPT.CommandWriter(write, require_ack=True)
+    fast_path = PAPT.AlarmFastPath(
+        lambda cmd, received_at: commands.send(cmd, PAPT.COMMAND_PRIORITY_ALARM, '自动', received_at),
+        on_trip=lambda data, reason: time.sleep(0.05), detector=PAPT.AnomalyDetector())
+    reading = {'temp': 45.0, 'humi': 50.0, 'light': 100.0, 'pir': 0, 'gas': 0}
+
+    latencies = []
+    try:
+        for _ in range(samples):
+            fast_path.valve_open = False
+            written.clear()
+            received_at = time.perf_counter()
+            assert fast_path.check(reading, received_at, changed=('temp', 'humi'))
+            assert written.wait(1.0)
+            latencies.append(writes[-1] - received_at)
+    finally:
+        commands.close()
+
+    latencies.sort()
+    p99 = latencies[int(samples * 0.99) - 1]
+    assert p99 < PAPT.ALARM_LATENCY_BUDGET, f"p99 {p99 * 1e6:.1f} us"
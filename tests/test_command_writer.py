@@ -0,0 +1,45 @@
+"""水闸命令写入: 确认帧、超时重发和不支持确认帧的固件"""
+import threading
+
+import PAPT
+
+
+def run_command(require_ack, ack=False):
+    writes, done = [], []
+    finished = threading.Event()
+
+    def write(payload):
+        writes.append(payload)
+        if ack:
+            commands.acknowledge(PAPT.VALVE_ACK_CODES[payload])
+        return True
+
+    def on_done(payload, context, result):
+        done.append(result)
+        finished.set()
+
+    commands = PAPT.CommandWriter(write, on_done=on_done, ack_timeout=0.05, retries=2, require_ack=require_ack)
+    try:
+        commands.send(b'\x01', PAPT.COMMAND_PRIORITY_MANUAL, '手动')
+        assert finished.wait(2)
+    finally:
+        commands.close()
+    return writes, done
+
+
+def test_write_counts_as_ack_without_firmware_support():
+    writes, done = run_command(require_ack=False)
+    assert writes == [b'\x01']
+    assert done == ['acked']
+
+
+def test_acknowledged_command():
+    writes, done = run_command(require_ack=True, ack=True)
+    assert writes == [b'\x01']
+    assert done == ['acked']
+
+
+def test_unacknowledged_command_is_retried_then_times_out():
+    writes, done = run_command(require_ack=True)
+    assert writes == [b'\x01'] * 3
+    assert done == ['timeout']
@@ -0,0 +1,51 @@
+"""人员检测进程池: 启动即崩溃的进程按退避间隔重启, 卡住的进程被结束并重启"""
+import logging
+import re
+import time
+
+import numpy as np
+
+import PAPT
+import detector_workers
+
+
+def wait_until(condition, timeout):
+    """条件成立(只求值到第一次成立)或超时后返回最后一次的结果"""
+    deadline = time.time() + timeout
+    while True:
+        result = condition()
+        if result or time.time() >= deadline:
+            return result
+        time.sleep(0.05)
+
+
+def test_crashing_worker_restarts_with_backoff(caplog):
+    caplog.set_level(logging.ERROR)
+    pool = PAPT.DetectorPool(slot_bytes=64 * 64 * 3, target=detector_workers.crash_on_start,
+                             restart_min=0.2, restart_max=0.8)
+    try:
+        assert wait_until(lambda: pool.workers[0]['failures'] >= 4, 20)
+    finally:
+        pool.close()
+    delays = [float(match) for match in re.findall(r'([\d.]+) 秒后重启', caplog.text)]
+    assert '代码 3' in caplog.text
+    assert delays[:4] == [0.2, 0.4, 0.8, 0.8]
+
+
+def test_stuck_worker_is_killed_and_restarted():
+    hangs = PAPT.DETECT_WORKER_HANGS.value
+    pool = PAPT.DetectorPool(slot_bytes=64 * 64 * 3, target=detector_workers.hang_on_task,
+                             task_timeout=0.5, restart_min=0.1)
+    frame = np.zeros((64, 64, 3), np.uint8)
+    try:
+        assert wait_until(lambda: pool.submit(frame), 20)
+        first = pool.workers[0]['process']
+        assert not pool.submit(frame)
+        assert wait_until(lambda: PAPT.DETECT_WORKER_HANGS.value == hangs + 1, 10)
+        assert wait_until(lambda: not first.is_alive(), 5)
+        assert len(pool.free_slots) == PAPT.DETECT_SLOTS_PER_WORKER
+        # 重启后的进程就绪后又能接收任务
+        assert wait_until(lambda: pool.submit(frame), 20)
+        assert pool.workers[0]['process'] is not first
+    finally:
+        pool.close()
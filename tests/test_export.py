@@ -0,0 +1,33 @@
+"""历史数据导出: 按 (timestamp, id) 分块, 块之间不占住读事务"""
+import csv
+import io
+import sqlite3
+
+import PAPT
+
+
+def test_export_pages_without_holding_a_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(PAPT, 'EXPORT_CHUNK_SIZE', 7)
+    path = str(tmp_path / 'monitor.db')
+    writer = sqlite3.connect(path)
+    writer.execute("PRAGMA journal_mode=WAL")
+    PAPT.init_database(writer)
+    # 每 3 行同一时间戳, 块边界落在相同时间戳的行之间
+    rows = [(f'2026-10-01 00:00:{i // 3:02d}', float(i), 50.0, 300.0, 0, 10, 'COM3') for i in range(50)]
+    writer.executemany(PAPT.SENSOR_INSERT_SQL, rows)
+    writer.commit()
+
+    chunks = PAPT.export_rows('sensor_data', start='2026-10-01 00:00:00', end='2026-10-01 00:00:59', db_path=path)
+    data = [next(chunks)]
+    # 块之间没有读者持有快照, WAL 可以完整检查点
+    busy, _, _ = writer.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    assert busy == 0
+    # 导出过程中写入的更新数据在后面的块中导出
+    writer.execute(PAPT.SENSOR_INSERT_SQL, ('2026-10-01 00:00:30', 50.0, 50.0, 300.0, 0, 10, 'COM3'))
+    writer.commit()
+    data.extend(chunks)
+    writer.close()
+
+    exported = list(csv.reader(io.StringIO(b''.join(data).decode('utf-8'))))
+    assert exported[0] == [name for name, _ in PAPT.EXPORT_TABLES['sensor_data']]
+    assert [float(row[1]) for row in exported[1:]] == [float(i) for i in range(51)]
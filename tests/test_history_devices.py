@@ -0,0 +1,22 @@
+"""历史数据设备筛选的候选列表: 数据库和归档中的设备名"""
+import sqlite3
+
+import PAPT
+
+
+def test_devices_from_database_and_archive(tmp_path):
+    path = str(tmp_path / 'monitor.db')
+    conn = sqlite3.connect(path)
+    PAPT.init_database(conn)
+    rows = [('2026-10-01 00:00:00', 20.0, 50.0, 300.0, 0, 10, device)
+            for device in ('COM3', '', None, '/dev/ttyUSB0', 'COM3')]
+    conn.executemany(PAPT.SENSOR_INSERT_SQL, rows)
+    conn.commit()
+    conn.close()
+
+    store = PAPT.ArchiveStore(tmp_path / 'archive')
+    store.write_day('2026-09-01', [(1, '2026-09-01 00:00:00', 20.0, 50.0, 300.0, 0, 10, 'bench'),
+                                   (2, '2026-09-01 00:00:01', 20.0, 50.0, 300.0, 0, 10, 'COM3')])
+
+    assert PAPT.history_devices(path, store) == ['/dev/ttyUSB0', 'COM3', 'bench']
+    assert PAPT.history_devices(path) == ['/dev/ttyUSB0', 'COM3']
@@ -0,0 +1,145 @@
+"""OneNet 待发送队列: 用本地模拟服务器启停模拟断网和恢复"""
+import json
+import threading
+import time
+import types
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import PAPT
+
+
+class StubOnenet:
+    """模拟 OneNet 服务器: 记录收到的上报, 含 bad 属性的上报返回 400; 可停止后在同一端口重新启动"""
+
+    def __init__(self):
+        self.received = []
+        self.server = None
+        self.port = 0
+
+    def start(self):
+        received = self.received
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if 'bad' in body:
+                    self.send_response(400)
+                else:
+                    received.append(body)
+                    self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', self.port), Handler)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def send(self, params):
+        # 与 report_to_onenet 相同的约定: 被拒绝时返回真值, 网络错误时抛出 OSError
+        request = urllib.request.Request(f'http://127.0.0.1:{self.port}/', data=json.dumps(params).encode(),
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            urllib.request.urlopen(request, timeout=1).close()
+            return False
+        except urllib.error.HTTPError as e:
+            return f"HTTP {e.code}"
+
+    def seqs(self):
+        return [payload['seq']['value'] for payload in self.received]
+
+
+def wait_until(condition, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline and not condition():
+        time.sleep(0.05)
+    return condition()
+
+
+@pytest.fixture
+def stub():
+    server = StubOnenet()
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def outbox(tmp_path, stub):
+    box = PAPT.OnenetOutbox(str(tmp_path / 'outbox.db'), stub.send, max_records=150,
+                            drain_rate=1000.0, retry_min=0.05, retry_max=0.5, max_attempts=3)
+    box.start()
+    yield box
+    box.stop()
+
+
+def test_delivers_in_order_exactly_once(stub, outbox):
+    for i in range(20):
+        outbox.submit({'seq': {'value': i}})
+    assert wait_until(lambda: outbox.backlog == 0)
+    time.sleep(0.2)
+    assert stub.seqs() == list(range(20))
+
+
+def test_outage_keeps_records_and_evicts_oldest(stub, outbox):
+    stub.stop()
+    for i in range(200):
+        outbox.submit({'seq': {'value': i}})
+    time.sleep(1.0)
+    assert stub.received == []
+    assert outbox.backlog == 150
+    # 网络错误不计入重试次数, 不会把记录移入 dead_letter
+    assert outbox.peek(1)[0][2] == 0
+    assert outbox.dead_letters() == 0
+
+    stub.start()
+    assert wait_until(lambda: outbox.backlog == 0, 30)
+    time.sleep(0.2)
+    assert stub.seqs() == list(range(50, 200))
+
+
+def test_rejected_record_is_dead_lettered(stub, outbox):
+    for i in range(5):
+        outbox.submit({'seq': {'value': i}})
+    outbox.submit({'bad': {'value': 0}})
+    for i in range(5, 10):
+        outbox.submit({'seq': {'value': i}})
+    assert wait_until(lambda: outbox.backlog == 0)
+    assert outbox.dead_letters() == 1
+    assert stub.seqs() == list(range(10))
+
+
+def test_manual_report_is_queued_during_outage(stub, outbox, monkeypatch):
+    shown = []
+    monkeypatch.setattr(PAPT, 'messagebox', types.SimpleNamespace(
+        showinfo=lambda *args: shown.append(('info',) + args),
+        showerror=lambda *args: shown.append(('error',) + args)))
+    values = {'temp': '25.5', 'humi': '60', 'light': '300', 'pir': '1', 'gas': '12'}
+    system = types.SimpleNamespace(
+        sensor_data={key: types.SimpleNamespace(get=lambda value=value: value) for key, value in values.items()},
+        check_thresholds=lambda data: False,
+        log_sensor_data=lambda data: None,
+        outbox=outbox)
+
+    stub.stop()
+    PAPT.SmartMonitorSystem.report_sensor_data(system)
+    assert [kind for kind, *_ in shown] == ['info']
+    time.sleep(0.5)
+    assert outbox.backlog == 1
+
+    stub.start()
+    assert wait_until(lambda: outbox.backlog == 0)
+    assert len(stub.received) == 1
+    assert stub.received[0]['temp']['value'] == 25
+    assert stub.received[0]['yanwu']['value'] == 12
@@ -0,0 +1,52 @@
+"""串口读数处理链: 解析、界面变量、确认帧和分帧合并"""
+import types
+
+import PAPT
+
+
+class Var:
+    def __init__(self):
+        self.value = None
+
+    def set(self, value):
+        self.value = value
+
+
+def make_pipeline():
+    published, acks = [], []
+    bus = types.SimpleNamespace(publish=published.append)
+    alarm = PAPT.AlarmFastPath(lambda cmd, received_at: None)
+    display = {key: Var() for key in ('temp', 'humi', 'light', 'pir', 'gas')}
+    pipeline = PAPT.SensorPipeline(bus, alarm, display=display, on_ack=acks.append)
+    pipeline.device = 'COM3'
+    return pipeline, published, acks, display
+
+
+def test_frames_of_one_sample_are_merged_into_one_reading():
+    pipeline, published, acks, display = make_pipeline()
+    try:
+        for frame in ("g300\n", "h1\n", "y12\n", "w25.5&s60!\n"):
+            pipeline.handle_frame(frame)
+        assert len(published) == 1
+        reading = published[0]
+        assert isinstance(reading, PAPT.SensorReading)
+        assert (reading.device, reading.temp, reading.humi, reading.light, reading.pir, reading.gas) == \
+            ('COM3', 25.5, 60.0, 300.0, 1, 12)
+        assert display['temp'].value == '25.5' and display['gas'].value == '12'
+        assert acks == []
+    finally:
+        pipeline.close()
+
+
+def test_ack_frame_and_parse_error():
+    pipeline, published, acks, _ = make_pipeline()
+    errors = PAPT.SERIAL_PARSE_ERRORS.value
+    try:
+        pipeline.handle_frame(f"{PAPT.VALVE_ACK_PREFIX}1\n")
+        pipeline.handle_frame("gabc\n")
+        assert acks == ['1']
+        assert PAPT.SERIAL_PARSE_ERRORS.value == errors + 1
+        pipeline.ingest.flush()
+        assert published == []
+    finally:
+        pipeline.close()
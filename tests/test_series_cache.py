@@ -0,0 +1,54 @@
+"""Web进程传感器数值缓存: 字节上限、LRU 淘汰和截短后的补读"""
+import sqlite3
+
+import numpy as np
+import pytest
+
+import PAPT
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """两个设备各 1000 条每秒一条的读数"""
+    path = str(tmp_path / 'monitor.db')
+    conn = sqlite3.connect(path)
+    PAPT.init_database(conn)
+    start = PAPT.to_epoch('2026-10-01 00:00:00')
+    rows = [(PAPT.utc_text(start + i), float(i), 50.0, 300.0, 0, 10, device)
+            for device in ('A', 'B') for i in range(1000)]
+    conn.executemany(PAPT.SENSOR_INSERT_SQL, rows)
+    conn.commit()
+    conn.close()
+    return path
+
+
+def read(cache, db_path, device, start='2026-10-01 00:00:00', end='2026-10-01 00:16:39'):
+    times, values = cache.get(start, end, device, db_path)
+    return times, values['temperature']
+
+
+def test_least_recently_used_device_is_evicted(db_path):
+    row_bytes = 8 + 4 * len(PAPT.SENSOR_CHANNELS)
+    cache = PAPT.SensorSeriesCache(max_bytes=1500 * row_bytes)
+    read(cache, db_path, 'A')
+    times, temps = read(cache, db_path, 'B')
+    assert len(times) == 1000 and np.array_equal(temps, np.arange(1000))
+    assert list(cache.entries) == [(db_path, 'B')]
+    assert PAPT.SERIES_CACHE_BYTES.value == 1000 * row_bytes
+
+
+def test_oversized_entry_keeps_newest_rows_and_rereads_older(db_path):
+    row_bytes = 8 + 4 * len(PAPT.SENSOR_CHANNELS)
+    cache = PAPT.SensorSeriesCache(max_bytes=300 * row_bytes)
+    times, temps = read(cache, db_path, 'A')
+    assert len(times) == 1000 and np.array_equal(temps, np.arange(1000))
+    entry = cache.entries[(db_path, 'A')]
+    assert len(entry['times']) <= 300
+    assert entry['times'][-1] == times[-1]
+    assert PAPT.SERIES_CACHE_BYTES.value <= 300 * row_bytes
+
+    # 截掉的部分再次查询时重新读取, 结果不变
+    times, temps = read(cache, db_path, 'A')
+    assert len(times) == 1000 and np.array_equal(temps, np.arange(1000))
+    times, temps = read(cache, db_path, 'A', start='2026-10-01 00:15:00')
+    assert np.array_equal(temps, np.arange(900, 1000))
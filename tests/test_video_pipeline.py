@@ -0,0 +1,33 @@
+"""视频处理链各阶段计时: 区域计数和热力图单独计时, 发布只计事件发布"""
+import numpy as np
+
+import PAPT
+
+
+class StubPool:
+    def __init__(self):
+        self.latest = (1, np.array([[10, 10, 50, 80, 0.9, 0]], dtype=np.float32))
+
+    def submit(self, frame, imgsz=None):
+        return True
+
+
+def test_stage_timings_cover_each_step():
+    bus = PAPT.EventBus()
+    events = []
+    bus.subscribe((PAPT.PeopleCount,), events.append, 'test', policy='drop_oldest')
+    pipeline = PAPT.VideoPipeline(StubPool(), PAPT.InferenceController(), PAPT.ZoneMap(),
+                                  PAPT.OccupancyHeatmap(), bus)
+    try:
+        frame = np.zeros((120, 160, 3), np.uint8)
+        _, people_count, _ = pipeline.process(frame)
+        pipeline.process(frame)
+    finally:
+        bus.close()
+
+    assert people_count == 1
+    assert set(pipeline.timings) == {'detect', 'zones', 'heatmap', 'annotate', 'publish'}
+    assert set(pipeline.timings) <= set(PAPT.VIDEO_STAGE_SECONDS)
+    assert all(seconds >= 0 for seconds in pipeline.timings.values())
+    # 同一检测结果只发布一次
+    assert len(events) == 1